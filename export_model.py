@@ -0,0 +1,102 @@
+import torch  # noqa
+import logging  # noqa
+import argparse  # noqa
+import os  # noqa
+from time import time as now  # noqa
+
+from torch_geometric.data import Data  # noqa
+
+from gnn_agglomeration import utils  # noqa
+from gnn_agglomeration.nn.models.checkpoint import load_model_from_run  # noqa
+from gnn_agglomeration.nn.models.frozen_our_conv_model import freeze_our_conv_model, script_frozen_model  # noqa
+from gnn_agglomeration.nn.models.quantization import quantize_frozen_model, QUANTIZATION_GROUPS  # noqa
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        description='Export a trained RagNet checkpoint to a frozen TorchScript module '
+                    'with signature (x, edge_index, edge_attr) -> scores',
+        allow_abbrev=False)
+    p.add_argument('--run_path', type=str, required=True,
+                   help='absolute path to the run directory that contains config.json')
+    p.add_argument('--version', type=str, default='latest',
+                   help="checkpoint to export, 'latest', 'final' or e.g. 'epoch_10'")
+    p.add_argument('--out_path', type=str, default=None,
+                   help='where to save the frozen module, defaults to <run_path>/<model_dir>/frozen_<version>.pt')
+    p.add_argument('--int8_groups', type=str, nargs='*', default=[], choices=QUANTIZATION_GROUPS,
+                   help='groups of layers to quantize dynamically to int8 for CPU inference, '
+                        'use quantization_report.py to select them on validation blocks')
+    p.add_argument('--check_nodes', type=int, default=1000,
+                   help='number of nodes of the random graph used to compare frozen and original model')
+    p.add_argument('--check_edges', type=int, default=4000,
+                   help='number of undirected edges of the random graph used to compare frozen and original model')
+    return p.parse_args()
+
+
+def random_graph(config, num_nodes, num_edges):
+    """
+    random graph in the edge storage mode of the config, with bi-directed
+    edges next to each other in edge_index for directed storage
+    """
+    x = torch.rand(num_nodes, config.feature_dimensionality)
+    edge_index = torch.randint(num_nodes, (2, num_edges), dtype=torch.long)
+    edge_attr = torch.rand(num_edges, config.pseudo_dimensionality)
+    if not config.undirected_edges:
+        edge_index = utils.expand_undirected_edge_index(edge_index)
+        edge_attr = utils.expand_undirected_edge_attr(edge_attr, reversed_dims=0)
+    return Data(x=x, edge_index=edge_index, edge_attr=edge_attr)
+
+
+def check_frozen_model(model, frozen, config, num_nodes, num_edges):
+    data = random_graph(config, num_nodes, num_edges)
+    with torch.no_grad():
+        start = now()
+        expected = model.out_to_one_dim(model(data))
+        logger.info(f'original model forward in {now() - start} s')
+
+        # warm up the TorchScript profiling executor
+        frozen(data.x, data.edge_index, data.edge_attr)
+        start = now()
+        scores = frozen(data.x, data.edge_index, data.edge_attr)
+        logger.info(f'frozen model forward in {now() - start} s')
+
+    max_diff = (expected - scores).abs().max().item()
+    logger.info(f'max abs difference between original and frozen scores: {max_diff}')
+    return max_diff
+
+
+def export_model(run_path, version, out_path, int8_groups, check_nodes, check_edges):
+    config, model = load_model_from_run(run_abs_path=run_path, version=version)
+
+    frozen = freeze_our_conv_model(model)
+    if len(int8_groups) > 0:
+        frozen = quantize_frozen_model(frozen, groups=int8_groups)
+    frozen = script_frozen_model(frozen)
+    check_frozen_model(model, frozen, config, check_nodes, check_edges)
+
+    if out_path is None:
+        prefix = 'frozen_int8' if len(int8_groups) > 0 else 'frozen'
+        out_path = os.path.join(run_path, config.model_dir, f'{prefix}_{version}.pt')
+    torch.jit.save(frozen, out_path)
+    logger.info(f'saved frozen model to {out_path}')
+
+    start = now()
+    torch.jit.load(out_path)
+    logger.info(f'frozen model loads in {now() - start} s')
+    return out_path
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    export_model(
+        run_path=args.run_path,
+        version=args.version,
+        out_path=args.out_path,
+        int8_groups=args.int8_groups,
+        check_nodes=args.check_nodes,
+        check_edges=args.check_edges
+    )
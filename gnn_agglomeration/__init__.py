@@ -1,4 +1,5 @@
-from . import nn  # noqa
-from . import data_transforms  # noqa
-from . import pyg_datasets  # noqa
-from .utils import *  # noqa
+from .registry import lazy_attributes
+
+# subpackages are imported on first access, see registry.lazy_attributes
+__getattr__, __dir__, _ = lazy_attributes(
+    __name__, {}, submodules=['nn', 'data_transforms', 'pyg_datasets', 'utils'])
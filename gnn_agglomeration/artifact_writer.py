@@ -0,0 +1,142 @@
+import torch
+import numpy as np
+import os
+import json
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def to_host(obj):
+    """
+    copy of all tensors in a nested structure of dicts, lists and tuples in
+    host memory, e.g. a state dict, which is updated in place during training
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().cpu().clone()
+    if isinstance(obj, dict):
+        return {k: to_host(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_host(v) for v in obj)
+    return obj
+
+
+def atomic_write(path, write_fn):
+    """
+    write to a temporary file next to path and rename it, such that path
+    never holds a partially written file
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def apply_retention(model_dir, keep_checkpoints):
+    """
+    delete all but the keep_checkpoints latest epoch checkpoints in model_dir
+    """
+    if keep_checkpoints is None:
+        return
+    # checkpoints[:-0] would keep all of them
+    assert keep_checkpoints >= 1, f'keep_checkpoints has to be at least 1, got {keep_checkpoints}'
+    checkpoints = sorted([
+        x for x in os.listdir(model_dir) if x.startswith('epoch_') and x.endswith('.tar')],
+        key=lambda x: int(x[len('epoch_'):-len('.tar')]))
+    for name in checkpoints[:-keep_checkpoints]:
+        os.remove(os.path.join(model_dir, name))
+        logger.debug(f'remove checkpoint {name}')
+
+
+def write_checkpoint(checkpoint, path, keep_checkpoints=None):
+    atomic_write(path, lambda f: torch.save(checkpoint, f))
+    apply_retention(os.path.dirname(path), keep_checkpoints)
+
+
+def write_json(obj, path):
+    atomic_write(path, lambda f: f.write(json.dumps(obj).encode('utf-8')))
+
+
+def write_npz(path, arrays):
+    if not path.endswith('.npz'):
+        path = f'{path}.npz'
+    atomic_write(path, lambda f: np.savez(f, **arrays))
+
+
+class ArtifactWriter:
+    """
+    Writes outputs, checkpoints and configs from a background thread, such that
+    training does not wait for the file system. Tensors are copied to host
+    memory when an artifact is submitted. The queue is bounded, if the
+    writer falls behind by max_queue artifacts, submitting blocks.
+    An error in the writer thread is raised on the next submit or drain.
+
+    Args:
+        max_queue (int):
+        keep_checkpoints (int or None): number of epoch checkpoints to keep, None keeps all
+    """
+
+    def __init__(self, max_queue=8, keep_checkpoints=None):
+        assert keep_checkpoints is None or keep_checkpoints >= 1, \
+            f'keep_checkpoints has to be at least 1, got {keep_checkpoints}'
+        self.keep_checkpoints = keep_checkpoints
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                fn, args = item
+                fn(*args)
+            except Exception as e:
+                logger.error(f'artifact writer: {e}')
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args):
+        if self.error is not None:
+            raise self.error
+        if not self.thread.is_alive():
+            raise RuntimeError('artifact writer is closed')
+        self.queue.put((fn, args))
+
+    def savez(self, path, **arrays):
+        """
+        np.savez in the background, arrays can be numpy arrays or tensors
+        """
+        arrays = {k: to_host(v).numpy() if torch.is_tensor(v) else np.array(v)
+                  for k, v in arrays.items()}
+        self.submit(write_npz, path, arrays)
+
+    def save_checkpoint(self, checkpoint, path):
+        self.submit(write_checkpoint, to_host(checkpoint), path, self.keep_checkpoints)
+
+    def save_json(self, obj, path):
+        self.submit(write_json, json.loads(json.dumps(obj)), path)
+
+    def wait(self):
+        """
+        block until all submitted artifacts are written
+        """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def drain(self):
+        """
+        write all submitted artifacts and stop the writer thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,228 @@
+import torch
+import torch.multiprocessing as mp
+from torch_geometric.data import DataLoader
+import numpy as np
+import argparse
+import queue
+import os
+import logging
+from time import time as now
+
+from gnn_agglomeration import registry
+from gnn_agglomeration.metrics import MetricAccumulator
+from gnn_agglomeration.pyg_datasets.cached_validation_set import CachedValidationSet
+from gnn_agglomeration.artifact_writer import to_host, write_npz
+from gnn_agglomeration.distributed import NullSummaryWriter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+POLICIES = ['block', 'drop_oldest', 'drop_newest']
+
+
+def validation_loop(config, dataset, prune_to_targets, input_layer, device,
+                    outputs_dir, iterations_per_epoch, snapshots, results):
+    """
+    Runs in the validation process: builds its own model and loader, then
+    validates each snapshot of the weights until it receives None
+    """
+    np.random.seed()
+    device = torch.device(device)
+    # summaries are written by the training process
+    summarize_batches = config.write_summary and config.summary_per_batch
+    config = argparse.Namespace(**{**vars(config), 'write_summary': False})
+    model = registry.model(config.model)(
+        config=config,
+        train_writer=NullSummaryWriter(),
+        val_writer=NullSummaryWriter(),
+        model_type=config.model_type
+    )
+    model.input_layer = input_layer
+    model = model.to(device)
+    model.eval()
+
+    if isinstance(dataset, CachedValidationSet):
+        data_loader = dataset
+    else:
+        # DataLoader only takes persistent_workers from torch 1.7 on, pass it only if enabled
+        persistent_workers = {'persistent_workers': True} \
+            if config.persistent_workers and config.num_workers > 0 else {}
+        data_loader = DataLoader(
+            dataset,
+            batch_size=config.batch_size_eval,
+            shuffle=False,
+            sampler=torch.utils.data.RandomSampler(
+                data_source=dataset,
+                replacement=True,
+                num_samples=config.epoch_samples_val
+            ),
+            num_workers=config.num_workers,
+            worker_init_fn=lambda idx: np.random.seed(),
+            **persistent_workers
+        )
+
+    while True:
+        item = snapshots.get()
+        if item is None:
+            return
+        epoch, state_dict = item
+        start = now()
+        model.load_state_dict(state_dict)
+
+        metrics = MetricAccumulator(device)
+        metrics_batch = MetricAccumulator(device)
+        batch_summaries = []
+        with torch.no_grad():
+            for batch_i, data in enumerate(data_loader):
+                data = data.to(device)
+                if prune_to_targets is not None:
+                    data = prune_to_targets(data)
+                out = model(data)
+                loss = model.loss(out, data.y, data.mask)
+                weighted_correct = model.out_to_weighted_correct(out, data.y, data.mask)
+                metrics.add(loss, weighted_correct, data.mask)
+                if summarize_batches:
+                    metrics_batch.add(loss, weighted_correct, data.mask)
+
+                if batch_i % config.outputs_interval == 0:
+                    if isinstance(out, tuple):
+                        out = torch.stack([out[0], out[1]], dim=0)
+                    write_npz(
+                        os.path.join(outputs_dir, f'epoch_{epoch}_batch_{batch_i}'),
+                        {'out': out.cpu().numpy(), 'labels': data.y.cpu().numpy(),
+                         'mask': data.mask.cpu().numpy()})
+
+                if summarize_batches and batch_i % config.scalar_summary_interval == 0:
+                    batch_loss, batch_metric, _ = metrics_batch.compute()
+                    metrics_batch.reset()
+                    batch_summaries.append(
+                        (epoch * iterations_per_epoch + batch_i, batch_loss, batch_metric))
+
+        loss, metric, _ = metrics.compute()
+        results.put({
+            'epoch': epoch,
+            'loss': loss,
+            'metric': metric,
+            'batch_summaries': batch_summaries,
+            'seconds': now() - start
+        })
+
+
+class AsyncValidator:
+    """
+    Validates snapshots of the model weights in a separate process, with its
+    own model and data loader, while training continues. Results are
+    collected with poll, tagged with the epoch of the snapshot.
+
+    If max_pending snapshots wait for the validation process, a new snapshot
+    is handled according to policy:
+        block: wait until the validation process catches up
+        drop_oldest: replace the oldest waiting snapshot
+        drop_newest: skip the new snapshot
+
+    Args:
+        config (argparse.Namespace):
+        dataset (torch.utils.data.Dataset or CachedValidationSet): validation dataset
+        prune_to_targets (PruneToTargets or None):
+        input_layer (int): see OurConvModel.input_layer
+        device (torch.device):
+        outputs_dir (str): directory for the validation outputs
+        iterations_per_epoch (int): training batches per epoch, for the per-batch summaries
+        max_pending (int):
+        policy (str): one of POLICIES
+    """
+
+    def __init__(self, config, dataset, prune_to_targets, input_layer, device,
+                 outputs_dir, iterations_per_epoch, max_pending=1, policy='drop_oldest'):
+        assert policy in POLICIES, f'unknown policy {policy}'
+        self.policy = policy
+        self.dropped_epochs = []
+
+        # spawn, such that the validation process can use cuda
+        ctx = mp.get_context('spawn')
+        self.snapshots = ctx.Queue(maxsize=max_pending)
+        self.results = ctx.Queue()
+        self.num_pending = 0
+        self.process = ctx.Process(
+            target=validation_loop,
+            args=(config, dataset, prune_to_targets, input_layer, str(device),
+                  outputs_dir, iterations_per_epoch, self.snapshots, self.results))
+        self.process.start()
+        logger.info(f'validation process {self.process.pid} started')
+
+    def submit(self, epoch, model):
+        """
+        hand a snapshot of the weights of model after epoch to the validation process
+        """
+        if not self.process.is_alive():
+            raise RuntimeError(
+                f'validation process exited with code {self.process.exitcode}')
+        item = (epoch, to_host(model.state_dict()))
+        while True:
+            try:
+                self.snapshots.put_nowait(item)
+                self.num_pending += 1
+                return
+            except queue.Full:
+                pass
+
+            if self.policy == 'block':
+                self.snapshots.put(item)
+                self.num_pending += 1
+                return
+            if self.policy == 'drop_newest':
+                self.drop(epoch)
+                return
+            # drop_oldest
+            try:
+                stale_epoch, _ = self.snapshots.get_nowait()
+                self.num_pending -= 1
+                self.drop(stale_epoch)
+            except queue.Empty:
+                pass
+
+    def drop(self, epoch):
+        logger.warning(f'validation falls behind, skip validation of epoch {epoch}')
+        self.dropped_epochs.append(epoch)
+
+    def poll(self, block=False):
+        """
+        Args:
+            block (bool): wait for the results of all pending snapshots
+
+        Returns:
+            list of dict: results of the validated snapshots, in the order of the epochs
+        """
+        results = []
+        while self.num_pending > 0:
+            try:
+                if block:
+                    result = self.results.get(timeout=1.0)
+                else:
+                    result = self.results.get_nowait()
+            except queue.Empty:
+                if block and self.process.is_alive():
+                    continue
+                break
+            results.append(result)
+            self.num_pending -= 1
+        return results
+
+    def close(self):
+        """
+        validate all pending snapshots and stop the validation process
+
+        Returns:
+            list of dict: see poll
+        """
+        if not self.process.is_alive():
+            return []
+        results = self.poll(block=True)
+        self.snapshots.put(None)
+        self.process.join()
+        return results
+
+    def terminate(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
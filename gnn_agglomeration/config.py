@@ -1,4 +1,3 @@
-import torch
 import argparse
 import os
 import datetime
@@ -98,7 +97,9 @@ class Config:
                 'HemibrainDatasetRandom',
                 'HemibrainDatasetRandomInMemory',
                 'HemibrainDatasetBlockwise',
-                'HemibrainDatasetBlockwiseInMemory'
+                'HemibrainDatasetBlockwiseInMemory',
+                'HemibrainDatasetPartitioned',
+                'HemibrainDatasetHistorical'
             ],
             help='choose from different types of local datasets')
         self.default['dataset_type_train'] = 'HemibrainDatasetRandomInMemory'
@@ -110,7 +111,9 @@ class Config:
                 'HemibrainDatasetRandom',
                 'HemibrainDatasetRandomInMemory',
                 'HemibrainDatasetBlockwise',
-                'HemibrainDatasetBlockwiseInMemory'
+                'HemibrainDatasetBlockwiseInMemory',
+                'HemibrainDatasetPartitioned',
+                'HemibrainDatasetHistorical'
             ],
             help='choose from different types of local datasets')
         self.default['dataset_type_val'] = 'HemibrainDatasetBlockwiseInMemory'
@@ -122,7 +125,8 @@ class Config:
                 'HemibrainDatasetRandom',
                 'HemibrainDatasetRandomInMemory',
                 'HemibrainDatasetBlockwise',
-                'HemibrainDatasetBlockwiseInMemory'
+                'HemibrainDatasetBlockwiseInMemory',
+                'HemibrainDatasetPartitioned'
             ],
             help='choose from different types of local datasets')
         self.default['dataset_type_test'] = 'HemibrainDatasetBlockwiseInMemory'
@@ -838,7 +842,11 @@ class Config:
             help='binary threshold for cosine similarity')
         self.default['cosine_threshold'] = 0.75
 
-        self.parser.add_argument('--summary_per_batch', type=str2bool)
+        self.parser.add_argument(
+            '--summary_per_batch',
+            type=str2bool,
+            help='''with write_summary, write the loss and accuracy of the train and validation batches,
+            see scalar_summary_interval''')
         self.default['summary_per_batch'] = True
 
         self.parser.add_argument(
@@ -847,6 +855,234 @@ class Config:
             help='instead of outputting a score per edge, output the features on all nodes')
         self.default['our_conv_output_node_embeddings'] = False
 
+        self.parser.add_argument(
+            '--csr_aggregation',
+            type=str2bool,
+            help='''whether graphs carry a destination-sorted edge permutation and in-degrees,
+            such that OurConv uses segment-based softmax and aggregation instead of scatter.
+            Requires torch_scatter >= 2.0''')
+        self.default['csr_aggregation'] = False
+
+        self.parser.add_argument(
+            '--undirected_edges',
+            type=str2bool,
+            help='''store one column per RAG edge in edge_index and edge_attr, instead of a pair
+            of directed edges. Only for OurConvModel and HierarchicalOurConvModel, which expand both directions on the fly''')
+        self.default['undirected_edges'] = False
+
+        self.parser.add_argument(
+            '--prune_to_targets',
+            type=str2bool,
+            help='''restrict train and validation batches to the nodes within reach of the edges
+            with mask > 0, such that each layer only computes what the masked loss depends on.
+            Only for OurConvModel without batch_norm and att_batch_norm, which would normalize
+            over the remaining nodes and edges only''')
+        self.default['prune_to_targets'] = False
+
+        self.parser.add_argument(
+            '--halo_mode',
+            type=str,
+            choices=['padding', 'hops'],
+            help='''context around each inner block: padding adds block_padding in all dimensions,
+            hops reads exactly halo_hops hops through the RAG around the inner block''')
+        self.default['halo_mode'] = 'padding'
+
+        self.parser.add_argument(
+            '--halo_hops',
+            type=positive_int,
+            help='number of hops for halo_mode hops, defaults to the number of message passing layers')
+        self.default['halo_hops'] = None
+
+        self.parser.add_argument(
+            '--historical_embeddings',
+            type=str2bool,
+            help='''train and validate on the graph of the whole ROI with historical embeddings for
+            out-of-batch neighbours, kept in memory-mapped arrays in the run directory.
+            Requires HemibrainDatasetHistorical, OurConvModel and batch sizes of 1''')
+        self.default['historical_embeddings'] = False
+
+        self.parser.add_argument(
+            '--coarsening_thresholds',
+            type=float,
+            nargs='*',
+            help='''ascending merge score thresholds, one per level of coarsened RAGs, built from
+            the connected components of the edges with merge score below the threshold''')
+        self.default['coarsening_thresholds'] = []
+
+        self.parser.add_argument(
+            '--coarse_layers',
+            type=positive_int,
+            help='number of message passing layers per coarsening level in HierarchicalOurConvModel')
+        self.default['coarse_layers'] = 1
+
+        self.parser.add_argument(
+            '--confidence_gating',
+            type=str2bool,
+            help='''in the test pass, keep the input merge score of confident edges and run the
+            model only on the receptive field of the edges with uncertain merge scores''')
+        self.default['confidence_gating'] = False
+
+        self.parser.add_argument(
+            '--gate_thresholds',
+            type=float,
+            nargs=2,
+            help='merge scores <= the first or >= the second value are confident')
+        self.default['gate_thresholds'] = [0.1, 0.9]
+
+        self.parser.add_argument(
+            '--gate_calibration',
+            type=float,
+            nargs=2,
+            help='a, b for the calibration sigmoid(a * logit(p) + b) of confident merge scores')
+        self.default['gate_calibration'] = [1.0, 0.0]
+
+        self.parser.add_argument(
+            '--drop_edge_rate',
+            type=float,
+            help='''fraction of undirected edge pairs dropped from each training batch, DropEdge-style.
+            Edges with mask > 0 and self-loops are never dropped. Validation and test are not affected''')
+        self.default['drop_edge_rate'] = 0.0
+
+        self.parser.add_argument(
+            '--drop_edge_anneal_epochs',
+            type=positive_int,
+            help='decay drop_edge_rate linearly to 0 over this number of epochs. If None, the rate is constant')
+        self.default['drop_edge_anneal_epochs'] = None
+
+        self.parser.add_argument(
+            '--frozen_layers',
+            type=nonnegative_int,
+            help='''number of leading message passing layers of OurConvModel that are not trained.
+            Their outputs are computed once per train and validation graph and cached in the run directory,
+            training and validation then start at the first trainable layer''')
+        self.default['frozen_layers'] = 0
+
+        self.parser.add_argument(
+            '--feature_cache_augmentations',
+            type=nonnegative_int,
+            help='''number of randomly augmented draws per graph in the feature cache, a fixed pool.
+            0 caches the graphs without data augmentation''')
+        self.default['feature_cache_augmentations'] = 0
+
+        self.parser.add_argument(
+            '--summary_interval',
+            type=positive_int,
+            help='''record the variable summaries of write_summary only every summary_interval-th
+            train and validation iteration''')
+        self.default['summary_interval'] = 1
+
+        self.parser.add_argument(
+            '--scalar_summary_interval',
+            type=positive_int,
+            help='''write the batch loss and accuracy of summary_per_batch only every
+            scalar_summary_interval-th train and validation batch, averaged over these batches.
+            Each write reduces the metrics over all ranks and syncs with the device''')
+        self.default['scalar_summary_interval'] = 50
+
+        self.parser.add_argument(
+            '--keep_checkpoints',
+            type=positive_int,
+            help='number of the latest epoch checkpoints to keep, older ones are deleted. If None, all are kept')
+        self.default['keep_checkpoints'] = None
+
+        self.parser.add_argument(
+            '--distributed',
+            type=str2bool,
+            help='''data-parallel training with one process per rank, launched with torchrun.
+            Each rank trains on its shard of epoch_samples_train, gradients are averaged over all ranks''')
+        self.default['distributed'] = False
+
+        self.parser.add_argument(
+            '--dist_backend',
+            type=str,
+            choices=['gloo', 'nccl'],
+            help='torch.distributed backend, gloo for CPU nodes')
+        self.default['dist_backend'] = 'gloo'
+
+        self.parser.add_argument(
+            '--score_histogram_bins',
+            type=positive_int,
+            help='number of bins of the per-class score histograms in the test pass, '
+                 'which resolve the threshold curves')
+        self.default['score_histogram_bins'] = 1000
+
+        self.parser.add_argument(
+            '--persistent_workers',
+            type=str2bool,
+            help='keep the dataloader workers for training and validation alive across epochs, '
+                 'with their db connections and block caches. Needs torch >= 1.7')
+        self.default['persistent_workers'] = True
+
+        self.parser.add_argument(
+            '--worker_block_cache',
+            type=nonnegative_int,
+            help='number of unaugmented graphs each dataloader worker caches, for datasets that read '
+                 'the same graph for an index on every call. 0 disables the cache')
+        self.default['worker_block_cache'] = 0
+
+        self.parser.add_argument(
+            '--async_validation',
+            type=str2bool,
+            help='validate snapshots of the weights in a separate process, while training continues')
+        self.default['async_validation'] = False
+
+        self.parser.add_argument(
+            '--async_validation_max_pending',
+            type=positive_int,
+            help='number of snapshots that can wait for the validation process')
+        self.default['async_validation_max_pending'] = 1
+
+        self.parser.add_argument(
+            '--async_validation_policy',
+            type=str,
+            choices=['block', 'drop_oldest', 'drop_newest'],
+            help='what happens to a new snapshot if async_validation_max_pending snapshots are waiting')
+        self.default['async_validation_policy'] = 'drop_oldest'
+
+        self.parser.add_argument(
+            '--val_cache',
+            type=str2bool,
+            help='validate on a fixed subset of epoch_samples_val graphs without data augmentation, '
+                 'read and collated once per run')
+        self.default['val_cache'] = False
+
+        self.parser.add_argument(
+            '--val_cache_max_edges',
+            type=positive_int,
+            help='directed edges per batch of the cached validation set. None means batch_size_eval graphs')
+        self.default['val_cache_max_edges'] = None
+
+        self.parser.add_argument(
+            '--val_cache_seed',
+            type=nonnegative_int,
+            help='seed for drawing the cached validation set')
+        self.default['val_cache_seed'] = 0
+
+        self.parser.add_argument(
+            '--val_cache_on_device',
+            type=str2bool,
+            help='keep the cached validation batches in device memory')
+        self.default['val_cache_on_device'] = False
+
+        self.parser.add_argument(
+            '--shm_loader',
+            type=str2bool,
+            help='pass collated training and validation batches from the workers through a '
+                 'shared memory ring buffer instead of pickling them')
+        self.default['shm_loader'] = False
+
+        self.parser.add_argument(
+            '--shm_slots',
+            type=positive_int,
+            help='slots of the shared memory ring buffer per loader. None means 2 * num_workers')
+        self.default['shm_slots'] = None
+
+        self.parser.add_argument(
+            '--shm_slot_mb',
+            type=positive_int,
+            help='size of a slot of the shared memory ring buffer in MB, larger batches are pickled')
+        self.default['shm_slot_mb'] = 256
+
     def localhost(self):
         return {
             'mongo_url': 'localhost:27017',
@@ -1,2 +1,10 @@
-from .augment_hemibrain import AugmentHemibrain  # noqa
-from .unit_edge_attr_gaussian_noise import UnitEdgeAttrGaussianNoise  # noqa
\ No newline at end of file
+from gnn_agglomeration.registry import lazy_attributes
+
+__getattr__, __dir__, __all__ = lazy_attributes(
+    __name__,
+    {
+        'AugmentHemibrain': '.augment_hemibrain',
+        'UnitEdgeAttrGaussianNoise': '.unit_edge_attr_gaussian_noise',
+        'PruneToTargets': '.prune_to_targets',
+        'DropEdgePairs': '.drop_edge_pairs',
+    })
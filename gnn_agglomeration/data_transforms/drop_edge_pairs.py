@@ -0,0 +1,82 @@
+import torch
+
+from gnn_agglomeration import utils
+
+
+class DropEdgePairs:
+    """
+    DropEdge-style subsampling of the edges of a (batched) training graph.
+    Both directions of a RAG edge are dropped together, such that the pairs of
+    directed edges stay next to each other in the edge index. Edges with
+    mask > 0, which the loss is computed on, and self-loops are never dropped.
+    y, mask and roi_mask are subsampled along with the edges.
+
+    The drop rate decays linearly from rate to 0 over anneal_epochs, such that
+    the last epochs train on the same graphs as validation and test.
+
+    Args:
+        rate (float): fraction of the droppable edge pairs to drop
+        anneal_epochs (int or None): if None, the rate is constant
+        undirected_edges (bool): whether the graph stores one column per RAG edge
+    """
+
+    def __init__(self, rate, anneal_epochs=None, undirected_edges=False):
+        assert 0.0 <= rate < 1.0
+        self.rate = rate
+        self.anneal_epochs = anneal_epochs
+        self.undirected_edges = undirected_edges
+        self.current_rate = rate
+        self.reset_stats()
+
+    def set_epoch(self, epoch):
+        if self.anneal_epochs is None:
+            self.current_rate = self.rate
+        else:
+            self.current_rate = self.rate * max(0.0, 1.0 - epoch / self.anneal_epochs)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_pairs = 0
+        self.num_dropped = 0
+
+    def dropped_fraction(self):
+        return int(self.num_dropped) / max(self.num_pairs, 1)
+
+    def __call__(self, data):
+        if self.undirected_edges:
+            pairs = data.edge_index
+        else:
+            # a pair of directed edges is next to each other in the edge index
+            pairs = data.edge_index[:, 0::2]
+        num_pairs = pairs.size(1)
+        self.num_pairs += num_pairs
+        if self.current_rate == 0.0 or num_pairs == 0:
+            return data
+
+        droppable = (data.mask <= 0) & (pairs[0] != pairs[1])
+        drop = droppable & (torch.rand(num_pairs, device=pairs.device) < self.current_rate)
+        keep = ~drop
+        # stays on the device, no sync per batch
+        self.num_dropped += drop.sum()
+
+        if self.undirected_edges:
+            keep_directed = keep
+        else:
+            keep_directed = keep.view(-1, 1).expand(-1, 2).reshape(-1)
+        data.edge_index = data.edge_index[:, keep_directed]
+        data.edge_attr = data.edge_attr[keep_directed]
+        data.y = data.y[keep]
+        data.mask = data.mask[keep]
+        data.roi_mask = data.roi_mask[keep]
+
+        if getattr(data, 'edge_perm', None) is not None:
+            if self.undirected_edges:
+                edge_index = utils.expand_undirected_edge_index(data.edge_index)
+            else:
+                edge_index = data.edge_index
+            num_edges = edge_index.size(1)
+            data.edge_perm = torch.argsort(
+                edge_index[1] * num_edges + torch.arange(num_edges, device=edge_index.device))
+            data.in_degree = torch.bincount(edge_index[1], minlength=data.num_nodes)
+
+        return data
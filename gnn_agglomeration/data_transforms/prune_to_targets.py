@@ -0,0 +1,107 @@
+import torch
+
+from gnn_agglomeration import utils
+
+
+class PruneToTargets:
+    """
+    Restricts a (batched) graph to the computation the masked loss depends on.
+    The target edges are the edges with mask > 0. The output of the last of
+    num_layers message passing layers is only needed on their endpoints, the
+    output of layer l only on nodes within num_layers - 1 - l hops of them.
+
+    Nodes are relabeled by their hop distance to the targets, and directed
+    edges are sorted by destination. Hence the nodes that layer l has to
+    compute form a prefix of x, and their incoming edges form a prefix of
+    edge_index, which is also CSR-sorted:
+        layer_nodes (torch.Tensor): number of output nodes per layer
+        layer_edges (torch.Tensor): number of directed edges per layer
+        target_edge_index (torch.Tensor): (u, v) per target edge, shape (2, T)
+        target_edge_attr (torch.Tensor): attributes of (u, v) and (v, u), shape (T, 2, D)
+    y, mask and roi_mask are restricted to the target edges, such that the
+    masked loss and metric stay the same.
+
+    Args:
+        num_layers (int): number of message passing layers of the model
+        undirected_edges (bool): whether the graph stores one column per RAG edge
+        reversed_dims (int): see utils.reversed_edge_attr_dims, only used for undirected edges
+        csr (bool): whether to add edge_perm and in_degree for CSR aggregation
+    """
+
+    def __init__(self, num_layers, undirected_edges=False, reversed_dims=0, csr=False):
+        self.num_layers = num_layers
+        self.undirected_edges = undirected_edges
+        self.reversed_dims = reversed_dims
+        self.csr = csr
+
+    def __call__(self, data):
+        edge_index = data.edge_index
+        edge_attr = data.edge_attr.unsqueeze(-1) if data.edge_attr.dim() == 1 else data.edge_attr
+        if self.undirected_edges:
+            edge_index = utils.expand_undirected_edge_index(edge_index)
+            edge_attr = utils.expand_undirected_edge_attr(edge_attr, self.reversed_dims)
+
+        num_nodes = data.num_nodes
+        device = edge_index.device
+
+        # a pair of directed edges is next to each other in the edge index
+        targets = data.mask > 0
+        target_edge_index = edge_index.view(2, -1, 2)[:, targets, 0]
+        target_edge_attr = edge_attr.view(-1, 2, edge_attr.size(-1))[targets]
+
+        # hop distance to the closest endpoint of a target edge, against the
+        # direction of message passing
+        hop = torch.full((num_nodes,), self.num_layers + 1, dtype=torch.long, device=device)
+        hop[target_edge_index.view(-1)] = 0
+        for h in range(1, self.num_layers + 1):
+            reached = hop < h
+            new = reached[edge_index[1]] & ~reached[edge_index[0]]
+            hop[edge_index[0][new]] = h
+
+        # order by hop, ties by original node index
+        num_kept = int((hop <= self.num_layers).sum())
+        node_order = torch.argsort(
+            hop * num_nodes + torch.arange(num_nodes, device=device))[:num_kept]
+        relabel = torch.full((num_nodes,), -1, dtype=torch.long, device=device)
+        relabel[node_order] = torch.arange(num_kept, device=device)
+        # number of nodes within h hops
+        hop_nodes = torch.cumsum(
+            torch.bincount(hop[node_order], minlength=self.num_layers + 1), dim=0)
+
+        # the input layer only needs the edges into nodes within num_layers - 1 hops
+        edges_kept = hop[edge_index[1]] < self.num_layers
+        edge_index = relabel[edge_index[:, edges_kept]]
+        edge_attr = edge_attr[edges_kept]
+        edge_order = torch.argsort(
+            edge_index[1] * edge_index.size(1) + torch.arange(edge_index.size(1), device=device))
+        edge_index = edge_index[:, edge_order]
+        edge_attr = edge_attr[edge_order]
+
+        in_degree = torch.bincount(edge_index[1], minlength=num_kept)
+        rowptr = utils.degree_to_rowptr(in_degree)
+        layer_nodes = hop_nodes[:self.num_layers].flip(0)
+        layer_edges = rowptr[layer_nodes]
+
+        for key in ['x', 'pos', 'node_ids', 'nodes_mask', 'batch']:
+            if getattr(data, key, None) is not None:
+                data[key] = data[key][node_order]
+        for key in ['y', 'mask', 'roi_mask']:
+            if getattr(data, key, None) is not None:
+                data[key] = data[key][targets]
+
+        data.num_nodes = num_kept
+        data.edge_index = edge_index
+        data.edge_attr = edge_attr
+        data.target_edge_index = relabel[target_edge_index]
+        data.target_edge_attr = target_edge_attr
+        data.layer_nodes = layer_nodes
+        data.layer_edges = layer_edges
+        if self.csr:
+            # already destination-sorted
+            data.edge_perm = torch.arange(edge_index.size(1), device=device)
+            data.in_degree = in_degree
+
+        return data
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(num_layers={self.num_layers})'
@@ -0,0 +1,153 @@
+import torch
+import torch.distributed as dist
+import os
+import math
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def init(backend='gloo'):
+    """
+    Join the process group of a run launched with torchrun, which sets
+    RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT for each process
+    """
+    # torchrun and the object collectives need torch >= 1.10
+    if not hasattr(dist, 'gather_object') or 'LOCAL_RANK' not in os.environ:
+        raise RuntimeError(
+            f'distributed training needs torch >= 1.10 and a launch with torchrun, found torch {torch.__version__}')
+    dist.init_process_group(backend=backend, init_method='env://')
+    logger.info(f'process {rank()} of {world_size()} joined the {backend} process group')
+
+
+def destroy():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+@contextmanager
+def main_process_first():
+    """
+    run a block on rank 0 first, e.g. to process and cache a dataset, then on the other ranks
+    """
+    if not is_main_process():
+        barrier()
+    yield
+    if is_main_process():
+        barrier()
+
+
+def broadcast_object(obj, src=0):
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def gather_object(obj, dst=0):
+    """
+    Returns:
+        list or None: on rank dst, obj of each rank in the order of the ranks
+    """
+    if not is_distributed():
+        return [obj]
+    objects = [None] * world_size() if rank() == dst else None
+    dist.gather_object(obj, objects, dst=dst)
+    return objects
+
+
+def shard_indices(num_items):
+    """
+    indices of the items of this rank, interleaved over the ranks, such that
+    the items of neighbouring indices, e.g. blocks, are spread over the ranks
+    """
+    return list(range(rank(), num_items, world_size()))
+
+
+def shard_size(num_samples):
+    """
+    number of samples per rank, equal on all ranks, such that all ranks run
+    the same number of iterations and collectives
+    """
+    return int(math.ceil(num_samples / world_size()))
+
+
+def broadcast_module(module, src=0):
+    """
+    copy parameters and buffers, e.g. batch norm statistics, from rank src to all ranks
+    """
+    if not is_distributed():
+        return
+    for t in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(t.data, src=src)
+
+
+def all_reduce_gradients(parameters):
+    """
+    average the gradients over all ranks, with a single all_reduce on a
+    flattened buffer. Missing gradients count as zero
+    """
+    if not is_distributed():
+        return
+    parameters = [p for p in parameters if p.requires_grad]
+    if len(parameters) == 0:
+        return
+    for p in parameters:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+
+    flat = torch.cat([p.grad.reshape(-1) for p in parameters])
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    flat /= world_size()
+
+    offset = 0
+    for p in parameters:
+        numel = p.grad.numel()
+        p.grad.copy_(flat[offset:offset + numel].view_as(p.grad))
+        offset += numel
+
+
+class NullSummaryWriter:
+    """
+    stands in for the tensorboardX SummaryWriter on ranks other than 0
+    """
+
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+    def add_histogram(self, *args, **kwargs):
+        pass
+
+    def add_figure(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
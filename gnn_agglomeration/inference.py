@@ -0,0 +1,102 @@
+import torch
+import copy
+import logging
+from time import time as now
+
+from gnn_agglomeration import utils
+from gnn_agglomeration.data_transforms import PruneToTargets
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def input_merge_scores(data, config):
+    """
+    merge score from the RAG per undirected edge, the first edge attribute
+    """
+    if config.undirected_edges:
+        return data.edge_attr[:, 0]
+    # a pair of directed edges is next to each other in the edge index
+    return data.edge_attr[0::2, 0]
+
+
+def calibrate(merge_score, calibration):
+    """
+    Platt-style calibration of merge scores, sigmoid(a * logit(p) + b).
+    For a = 1 and b = 0, the scores stay unchanged.
+
+    Args:
+        merge_score (torch.Tensor): probability of a split, in [0, 1]
+        calibration (list of float): a, b
+    """
+    a, b = calibration
+    if a == 1.0 and b == 0.0:
+        return merge_score
+    eps = 1e-6
+    p = torch.clamp(merge_score, min=eps, max=1 - eps)
+    return torch.sigmoid(a * torch.log(p / (1 - p)) + b)
+
+
+class ConfidenceGate:
+    """
+    Inference that only runs the GNN around edges with uncertain input merge
+    scores. Edges with merge score <= low or >= high are confident and keep
+    their (calibrated) input score. For OurConvModel, the graph is pruned to
+    the receptive field of the uncertain edges, see PruneToTargets, such that
+    the cost scales with the number of ambiguous edges. Other models run on
+    the whole graph, and only the uncertain scores are taken from the model.
+
+    Args:
+        model (GnnModel):
+        config (argparse.Namespace):
+    """
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+        self.low, self.high = config.gate_thresholds
+        if config.model == 'OurConvModel':
+            self.prune = PruneToTargets(
+                num_layers=config.hidden_layers + 1,
+                undirected_edges=config.undirected_edges,
+                reversed_dims=utils.reversed_edge_attr_dims(config) if config.undirected_edges else 0,
+                csr=config.csr_aggregation
+            )
+        else:
+            self.prune = None
+
+        self.num_edges = 0
+        self.num_uncertain = 0
+        self.time = 0.0
+
+    def __call__(self, data):
+        """
+        Returns:
+            torch.Tensor: one-dimensional output per undirected edge, see GnnModel.out_to_one_dim
+        """
+        start = now()
+        merge_score = input_merge_scores(data, self.config)
+        uncertain = (merge_score > self.low) & (merge_score < self.high)
+        one_dim = self.model.probability_to_one_dim(
+            calibrate(merge_score, self.config.gate_calibration))
+
+        num_uncertain = int(uncertain.sum())
+        if num_uncertain > 0:
+            if self.prune is not None:
+                # shallow copy, pruning assigns new attributes
+                gated = copy.copy(data)
+                gated.mask = uncertain.float()
+                gated = self.prune(gated)
+                one_dim[uncertain] = self.model.out_to_one_dim(self.model(gated))
+            else:
+                one_dim[uncertain] = self.model.out_to_one_dim(self.model(data))[uncertain]
+
+        self.num_edges += uncertain.numel()
+        self.num_uncertain += num_uncertain
+        self.time += now() - start
+        return one_dim
+
+    def log_summary(self):
+        logger.info(
+            f'confidence gating: model on {self.num_uncertain}/{self.num_edges} edges, '
+            f'thresholds ({self.low}, {self.high}), in {self.time:.3f} s')
@@ -0,0 +1,181 @@
+import torch
+import numpy as np
+import torch.distributed as dist
+
+
+def _all_reduce(t):
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t
+
+
+class MetricAccumulator:
+    """
+    Sums of the mask-weighted loss, the mask-weighted number of correct
+    predictions and the mask weights over a number of batches, kept on the
+    device. Adding a batch does not sync with the host, the sums are copied
+    once when they are computed. In multi-process training, compute reduces
+    the sums over all processes.
+
+    Args:
+        device (torch.device):
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        # loss, correct, weight
+        self.sums = torch.zeros(3, dtype=torch.float64, device=self.device)
+
+    def add(self, loss, weighted_correct, mask):
+        """
+        Args:
+            loss (torch.Tensor): mask-weighted mean loss of the batch
+            weighted_correct (torch.Tensor): see ModelType.weighted_correct
+            mask (torch.Tensor): loss weights per edge
+        """
+        weight = mask.sum().detach().double()
+        self.sums += torch.stack([
+            loss.detach().double() * weight,
+            weighted_correct.detach().double(),
+            weight
+        ])
+
+    def compute(self):
+        """
+        Returns:
+            (float, float, float): weighted mean loss, weighted mean metric, sum of weights
+        """
+        sums = _all_reduce(self.sums.clone())
+        loss, correct, weight = sums.cpu().tolist()
+        tiny = torch.finfo(torch.float).tiny
+        return loss / (weight + tiny), correct / (weight + tiny), weight
+
+
+class ConfusionMatrixAccumulator:
+    """
+    Confusion matrix of predictions vs. targets over a number of batches,
+    updated with a single bincount per batch on the device. Memory does not
+    depend on the number of edges. Predictions and targets outside of
+    [0, num_classes) are clipped to the nearest class.
+
+    Args:
+        num_classes (int):
+        device (torch.device):
+    """
+
+    def __init__(self, num_classes, device):
+        self.num_classes = num_classes
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.counts = torch.zeros(
+            self.num_classes * self.num_classes, dtype=torch.long, device=self.device)
+
+    def add(self, predictions, targets):
+        n = self.num_classes
+        predictions = predictions.detach().reshape(-1).long().clamp(0, n - 1)
+        targets = targets.detach().reshape(-1).long().clamp(0, n - 1)
+        self.counts += torch.bincount(predictions * n + targets, minlength=n * n)
+
+    def compute(self):
+        """
+        Returns:
+            np.ndarray: counts of shape (num_classes, num_classes), predictions along the
+                first and targets along the second axis
+        """
+        counts = _all_reduce(self.counts.clone())
+        return counts.view(self.num_classes, self.num_classes).cpu().numpy()
+
+
+class ScoreHistogramAccumulator:
+    """
+    Histograms of the scores of a binary problem, one per target class, with
+    num_bins fixed bins over [0, 1]. Precision-recall and ROC curves are
+    computed from the histograms at the bin edges, without storing the
+    scores of each edge.
+
+    Args:
+        num_bins (int):
+        device (torch.device):
+    """
+
+    def __init__(self, num_bins, device):
+        self.num_bins = num_bins
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.counts = torch.zeros(2 * self.num_bins, dtype=torch.long, device=self.device)
+
+    def add(self, scores, targets):
+        """
+        Args:
+            scores (torch.Tensor): probability of class 1, see ModelType.one_dim_to_probability
+            targets (torch.Tensor): 0 or 1
+        """
+        bins = (scores.detach().reshape(-1).float() * self.num_bins).long()
+        bins = bins.clamp(0, self.num_bins - 1)
+        targets = targets.detach().reshape(-1).long().clamp(0, 1)
+        self.counts += torch.bincount(
+            targets * self.num_bins + bins, minlength=2 * self.num_bins)
+
+    def compute(self):
+        """
+        Returns:
+            dict: see threshold_curves
+        """
+        counts = _all_reduce(self.counts.clone())
+        return threshold_curves(counts.view(2, self.num_bins).cpu().numpy())
+
+
+def threshold_curves(histograms):
+    """
+    Precision, recall, false positive rate and accuracy when predicting class 1
+    for all scores >= threshold, at each lower bin edge of the histograms
+
+    Args:
+        histograms (np.ndarray): counts per bin of shape (2, num_bins), for targets 0 and 1
+
+    Returns:
+        dict: curves over the thresholds in ascending order, the areas under the
+            precision-recall and ROC curves and the threshold of best accuracy
+    """
+    histograms = histograms.astype(np.float64)
+    num_bins = histograms.shape[1]
+    thresholds = np.arange(num_bins) / num_bins
+
+    # predicted class 1 at threshold i: all bins >= i
+    fp = np.cumsum(histograms[0][::-1])[::-1]
+    tp = np.cumsum(histograms[1][::-1])[::-1]
+    negatives = histograms[0].sum()
+    positives = histograms[1].sum()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = tp / positives if positives > 0 else np.zeros(num_bins)
+        fpr = fp / negatives if negatives > 0 else np.zeros(num_bins)
+    accuracy = (tp + negatives - fp) / max(positives + negatives, 1.0)
+
+    # the curves end at threshold > 1, where nothing is predicted as class 1
+    recall_end = np.append(recall, 0.0)
+    fpr_end = np.append(fpr, 0.0)
+    tpr_end = recall_end
+    pr_auc = np.sum((recall_end[:-1] - recall_end[1:]) * precision)
+    roc_auc = np.sum((fpr_end[:-1] - fpr_end[1:]) * (tpr_end[:-1] + tpr_end[1:]) * 0.5)
+
+    best = int(np.argmax(accuracy))
+    return {
+        'thresholds': thresholds,
+        'precision': precision,
+        'recall': recall,
+        'fpr': fpr,
+        'accuracy': accuracy,
+        'pr_auc': float(pr_auc),
+        'roc_auc': float(roc_auc),
+        'best_threshold': float(thresholds[best]),
+        'best_accuracy': float(accuracy[best]),
+    }
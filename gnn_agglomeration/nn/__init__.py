@@ -1,2 +1,4 @@
-from . import layers  # noqa
-from . import models  # noqa
+from gnn_agglomeration.registry import lazy_attributes
+
+__getattr__, __dir__, _ = lazy_attributes(
+    __name__, {}, submodules=['layers', 'models'])
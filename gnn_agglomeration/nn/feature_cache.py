@@ -0,0 +1,107 @@
+import torch
+import numpy as np
+import os
+import copy
+import logging
+from time import time as now
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class FeatureCache:
+    """
+    Outputs of the frozen first message passing layers of an OurConvModel, for
+    each graph of a dataset, computed once and stored in a memory-mapped array,
+    such that fine-tuning the remaining layers does not rerun the frozen ones.
+    The graphs are stored without their node features next to it.
+
+    With num_augmentations = 0, the graphs are not augmented. Otherwise each
+    graph is drawn num_augmentations times with random data augmentation, which
+    gives a fixed pool of augmented graphs.
+
+    Args:
+        path (str): directory of the cache
+        dataset (HemibrainDataset):
+        model (OurConvModel):
+        num_layers (int): number of frozen layers
+        num_augmentations (int):
+        device (torch.device):
+    """
+
+    def __init__(self, path, dataset, model, num_layers, num_augmentations, device):
+        self.path = path
+        self.features_path = os.path.join(path, 'features.npy')
+        self.offsets_path = os.path.join(path, 'offsets.npy')
+        self.graphs_path = os.path.join(path, 'graphs.pt')
+
+        if os.path.isfile(self.features_path) and os.path.isfile(self.graphs_path):
+            self.graphs = torch.load(self.graphs_path)
+            self.offsets = np.load(self.offsets_path)
+            logger.info(f'load feature cache of {len(self.graphs)} graphs from {path}')
+        else:
+            self.build(dataset, model, num_layers, num_augmentations, device)
+
+    def build(self, dataset, model, num_layers, num_augmentations, device):
+        start = now()
+        os.makedirs(self.path, exist_ok=True)
+
+        was_training = model.training
+        model.eval()
+        model.output_layer = num_layers
+
+        num_draws = max(num_augmentations, 1)
+        self.graphs = []
+        features = []
+        with torch.no_grad():
+            for idx in range(len(dataset)):
+                for _ in range(num_draws):
+                    if num_augmentations == 0:
+                        data = dataset.get_unaugmented(idx)
+                    else:
+                        data = dataset[idx]
+                    x = model(data.to(device))
+                    features.append(x.cpu().numpy().astype(np.float32))
+                    data.x = None
+                    self.graphs.append(data.to('cpu'))
+
+        model.output_layer = None
+        model.train(was_training)
+
+        # a single array, graph i has the rows offsets[i]:offsets[i + 1]
+        self.offsets = np.cumsum([0] + [len(f) for f in features]).astype(np.int64)
+        np.save(self.features_path, np.concatenate(features, axis=0))
+        np.save(self.offsets_path, self.offsets)
+        torch.save(self.graphs, self.graphs_path)
+
+        logger.info(
+            f'build feature cache of {len(self.graphs)} graphs, {self.offsets[-1]} nodes, '
+            f'after {num_layers} layers in {now() - start} s')
+
+
+class FeatureCacheDataset(torch.utils.data.Dataset):
+    """
+    Graphs of a FeatureCache, with the cached layer outputs as node features.
+    The memory map is opened lazily, once per data loader worker.
+
+    Args:
+        cache (FeatureCache):
+    """
+
+    def __init__(self, cache):
+        self.graphs = cache.graphs
+        self.offsets = cache.offsets
+        self.features_path = cache.features_path
+        self.features = None
+
+    def __len__(self):
+        return len(self.graphs)
+
+    def __getitem__(self, idx):
+        if self.features is None:
+            self.features = np.load(self.features_path, mmap_mode='r')
+        # shallow copy, the cached graph keeps x = None
+        data = copy.copy(self.graphs[idx])
+        data.x = torch.from_numpy(
+            np.array(self.features[self.offsets[idx]:self.offsets[idx + 1]]))
+        return data
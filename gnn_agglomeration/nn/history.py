@@ -0,0 +1,60 @@
+import torch
+import numpy as np
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class History:
+    """
+    Historical embeddings of all nodes of a ROI graph, one memory-mapped array
+    per message passing layer, as in GNNAutoScale (Fey et al., 2021).
+    After each layer, the outputs of the in-batch nodes are pushed, and the
+    outputs of the out-of-batch neighbours are pulled from the history, such
+    that memory on the device only depends on the size of a mini-batch.
+
+    Args:
+        path (str): directory for the memory-mapped arrays
+        num_nodes (int): number of nodes of the ROI graph
+        dims (list of int): output dimensionality per layer
+    """
+
+    def __init__(self, path, num_nodes, dims):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.arrays = []
+        for i, d in enumerate(dims):
+            self.arrays.append(np.lib.format.open_memmap(
+                os.path.join(path, f'layer_{i}.npy'),
+                mode='w+',
+                dtype=np.float32,
+                shape=(num_nodes, d)))
+        logger.info(
+            f'history of {len(dims)} layers for {num_nodes} nodes in {path}')
+
+    def push(self, layer, x, n_id):
+        self.arrays[layer][n_id.cpu().numpy()] = x.detach().cpu().numpy()
+
+    def pull(self, layer, n_id):
+        return torch.from_numpy(self.arrays[layer][n_id.cpu().numpy()])
+
+    def push_and_pull(self, layer, x, n_id, num_batch_nodes):
+        """
+        Args:
+            layer (int):
+            x (torch.Tensor): layer outputs, in-batch nodes first
+            n_id (torch.Tensor): index of each node in the ROI graph
+            num_batch_nodes (int): number of in-batch nodes
+
+        Returns:
+            torch.Tensor: fresh outputs for in-batch nodes, historical ones for the others
+        """
+        self.push(layer, x[:num_batch_nodes], n_id[:num_batch_nodes])
+        x_hist = self.pull(layer, n_id[num_batch_nodes:]).to(x.device)
+        return torch.cat([x[:num_batch_nodes], x_hist], dim=0)
+
+    def flush(self):
+        for a in self.arrays:
+            a.flush()
@@ -131,8 +131,12 @@ class OurConv(MessagePassing):
         torch_geometric.nn.inits.zeros(self.bias)
         self.att.reset_parameters()
 
-    def forward(self, x, edge_index, pseudo):
-        """"""
+    def forward(self, x, edge_index, pseudo, rowptr=None):
+        """
+        If rowptr is given, edge_index and pseudo have to be sorted by
+        destination, and softmax and aggregation are computed segment-wise
+        over the CSR structure, instead of scattering.
+        """
         # add second dimensionality in case pseudo is 1D
         pseudo = pseudo.unsqueeze(-1) if pseudo.dim() == 1 else pseudo
         # add third dimensionality for attention head dimension, at penultimate
@@ -152,12 +156,43 @@ class OurConv(MessagePassing):
 
         x = x.view(-1, self.heads, self.out_channels)
 
+        if rowptr is not None:
+            return self.propagate_csr(
+                x=x, edge_index=edge_index, pseudo=pseudo, rowptr=rowptr)
+
         return self.propagate(
             edge_index,
             x=x,
             num_nodes=x.size(0),
             pseudo=pseudo)
 
+    def propagate_csr(self, x, edge_index, pseudo, rowptr):
+        # segment operations need torch_scatter >= 2.0, only required for csr_aggregation
+        from torch_scatter import segment_csr, gather_csr
+
+        x_j = x[edge_index[0]]
+
+        if self.att_use_node_features:
+            alpha = torch.cat([x[edge_index[1]], x_j, pseudo], dim=-1)
+        else:
+            alpha = pseudo
+
+        alpha = self.att(alpha)
+        alpha = F.leaky_relu(alpha, self.negative_slope)
+        if self.normalize_with_softmax:
+            alpha_max = segment_csr(alpha, rowptr, reduce='max')
+            alpha = (alpha - gather_csr(alpha_max, rowptr)).exp()
+            alpha_sum = segment_csr(alpha, rowptr, reduce='sum')
+            alpha = alpha / (gather_csr(alpha_sum, rowptr) + 1e-16)
+
+        # Dropout on attention vector
+        if self.training and self.dropout > 0:
+            alpha = F.dropout(alpha, p=self.dropout, training=True)
+
+        aggr_out = segment_csr(
+            x_j * alpha.view(-1, self.heads, 1), rowptr, reduce='sum')
+        return self.update(aggr_out)
+
     def message(self, edge_index_i, x_i, x_j, num_nodes, pseudo):
         # Compute attention coefficients
         # TODO we should be able to speed this up if we don't pass x_i and x_j to this function
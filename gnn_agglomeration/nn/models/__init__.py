@@ -1,10 +1,16 @@
-from .gnn_model import GnnModel  # noqa
-from .our_conv_model import OurConvModel  # noqa
+from gnn_agglomeration.registry import lazy_attributes
 
-from .gat_conv_model import GatConvModel  # noqa
-from .gcn_model import GcnModel  # noqa
-from .gmm_conv_model import GmmConvModel  # noqa
-from .minimal_spline_conv_model import MinimalSplineConvModel  # noqa
-from .spline_conv_model import SplineConvModel  # noqa
+__getattr__, __dir__, __all__ = lazy_attributes(
+    __name__,
+    {
+        'GnnModel': '.gnn_model',
+        'OurConvModel': '.our_conv_model',
+        'HierarchicalOurConvModel': '.hierarchical_our_conv_model',
 
-from . import model_type  # noqa
+        'GatConvModel': '.gat_conv_model',
+        'GcnModel': '.gcn_model',
+        'GmmConvModel': '.gmm_conv_model',
+        'MinimalSplineConvModel': '.minimal_spline_conv_model',
+        'SplineConvModel': '.spline_conv_model',
+    },
+    submodules=['model_type'])
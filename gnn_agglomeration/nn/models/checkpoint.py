@@ -0,0 +1,105 @@
+import torch
+import argparse
+import os
+import json
+import logging
+from time import time as now
+
+from gnn_agglomeration.config import Config
+from gnn_agglomeration import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def find_checkpoint(model_dir, version='latest'):
+    """
+    Resolve a checkpoint version to a file in the model directory of a run
+
+    Args:
+        model_dir (str): directory that contains the .tar checkpoints
+        version (str): 'latest' or the name of a checkpoint without extension,
+            e.g. 'final' or 'epoch_10'
+
+    Returns:
+        str: file name of the checkpoint, relative to model_dir
+    """
+    if version != 'latest':
+        return f'{version}.tar'
+
+    checkpoint_versions = [name for name in os.listdir(
+        model_dir) if name.endswith('.tar')]
+    if 'final.tar' in checkpoint_versions:
+        return 'final.tar'
+
+    checkpoint_versions = sorted([
+        x for x in checkpoint_versions if x.startswith('epoch')],
+        key=lambda x: int(x[len('epoch_'):-len('.tar')]))
+    if len(checkpoint_versions) == 0:
+        raise FileNotFoundError(f'no checkpoint found in {model_dir}')
+    return checkpoint_versions[-1]
+
+
+def load_run_config(run_abs_path):
+    """
+    Read the config.json of a run. Options that were added after the run
+    was started fall back to the current defaults.
+
+    Args:
+        run_abs_path (str): absolute path to the run directory
+
+    Returns:
+        argparse.Namespace: run config
+    """
+    config = Config().default
+    with open(os.path.join(run_abs_path, 'config.json'), 'r') as f:
+        config.update(json.load(f))
+    config['run_abs_path'] = run_abs_path
+    return argparse.Namespace(**config)
+
+
+def load_model_from_run(
+        run_abs_path,
+        version='latest',
+        device=torch.device('cpu'),
+        config=None):
+    """
+    Rebuild a trained model from the config and a checkpoint of a run.
+    The returned model is in eval mode and does not write any summaries.
+
+    Args:
+        run_abs_path (str): absolute path to the run directory
+        version (str): checkpoint version, see ``find_checkpoint``
+        device (torch.device): device to load the weights to
+        config (argparse.Namespace or None): if None, the config of the run
+            is used
+
+    Returns:
+        (argparse.Namespace, GnnModel): config, model
+    """
+    start = now()
+    if config is None:
+        config = load_run_config(run_abs_path)
+
+    model_dir = os.path.join(run_abs_path, config.model_dir)
+    checkpoint_path = os.path.join(
+        model_dir, find_checkpoint(model_dir, version))
+    logger.info(f'Loading checkpoint {checkpoint_path} ...')
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+
+    model = registry.model(config.model)(
+        config=config,
+        train_writer=None,
+        val_writer=None,
+        epoch=checkpoint['epoch'],
+        train_batch_iteration=checkpoint['train_batch_iteration'],
+        val_batch_iteration=checkpoint['val_batch_iteration'],
+        model_type=config.model_type
+    )
+    model.to(device)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    model.current_writer = None
+
+    logger.info(f'load model from run in {now() - start} s')
+    return config, model
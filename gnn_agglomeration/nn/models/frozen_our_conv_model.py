@@ -0,0 +1,452 @@
+import logging
+import torch
+import torch.nn.functional as F
+
+from gnn_agglomeration import utils
+from .our_conv_model import OurConvModel
+from .model_type.classification_problem import ClassificationProblem
+from .model_type.cosine_embedding_loss_problem import CosineEmbeddingLossProblem
+from .model_type.regression_problem import RegressionProblem
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def activation(x: torch.Tensor, name: str) -> torch.Tensor:
+    """
+    TorchScript cannot resolve torch.nn.functional by name,
+    therefore the non-linearities available in the config are dispatched here
+    """
+    if name == 'relu':
+        return F.relu(x)
+    elif name == 'leaky_relu':
+        return F.leaky_relu(x)
+    elif name == 'sigmoid':
+        return torch.sigmoid(x)
+    elif name == 'tanh':
+        return torch.tanh(x)
+    elif name == 'elu':
+        return F.elu(x)
+    elif name == 'identity':
+        return x
+    else:
+        raise NotImplementedError(f'non-linearity {name} not supported')
+
+
+def segment_softmax(src: torch.Tensor, index: torch.Tensor, num_nodes: int) -> torch.Tensor:
+    """
+    softmax over all entries of src that share the same index, without
+    depending on torch_scatter
+    """
+    size = [num_nodes] + list(src.shape[1:])
+    src_max = torch.zeros(size, dtype=src.dtype, device=src.device).scatter_reduce_(
+        0, index.view(-1, 1).expand_as(src), src, reduce='amax', include_self=False)
+    out = (src - src_max[index]).exp()
+    out_sum = torch.zeros(size, dtype=src.dtype, device=src.device).index_add_(
+        0, index, out)
+    return out / (out_sum[index] + 1e-16)
+
+
+def batch_norm_affine(bn):
+    """
+    express an eval mode BatchNorm1d as y = x * scale + shift
+    """
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.affine:
+        scale = scale * bn.weight
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        shift = shift + bn.bias
+    return scale.detach(), shift.detach()
+
+
+class HeadwiseLinear(torch.nn.Module):
+    """
+    one independent linear map per attention head, input of shape (E, heads, in_features)
+    """
+
+    def __init__(self, weight, bias):
+        super(HeadwiseLinear, self).__init__()
+        # weight: (heads, in_features, out_features), bias: (heads, out_features)
+        self.weight = torch.nn.Parameter(weight, requires_grad=False)
+        self.bias = torch.nn.Parameter(bias, requires_grad=False)
+
+    def forward(self, x):
+        return torch.matmul(x.unsqueeze(-2), self.weight).squeeze(-2) + self.bias
+
+
+class FrozenAttentionMLP(torch.nn.Module):
+    """
+    AttentionMLP in eval mode, with batch norms folded into the following layer
+    """
+
+    def __init__(self, shared_in, layers_list, heads, non_linearity, out_scale, out_shift):
+        super(FrozenAttentionMLP, self).__init__()
+        # if the input is identical for all heads (only pseudo coordinates),
+        # the first layer is a single dense torch.nn.Linear for all heads
+        self.shared_in = shared_in
+        self.layers_list = torch.nn.ModuleList(layers_list)
+        self.heads = heads
+        self.non_linearity = non_linearity
+        self.register_buffer('out_scale', out_scale)
+        self.register_buffer('out_shift', out_shift)
+
+    def forward(self, x):
+        for i, l in enumerate(self.layers_list):
+            x = l(x)
+            if i == 0 and self.shared_in:
+                x = x.view(x.size(0), self.heads, -1)
+            x = activation(x, self.non_linearity)
+
+        x = x * self.out_scale.view(1, -1, 1) + self.out_shift.view(1, -1, 1)
+        return x.squeeze(-1)
+
+
+class FrozenOurConv(torch.nn.Module):
+    def __init__(
+            self,
+            node_mlp,
+            att,
+            bias,
+            heads,
+            out_channels,
+            concat,
+            negative_slope,
+            normalize_with_softmax,
+            non_linearity,
+            att_use_node_features):
+        super(FrozenOurConv, self).__init__()
+        self.node_mlp = torch.nn.ModuleList(node_mlp)
+        self.att = att
+        self.register_buffer('bias', bias)
+        self.heads = heads
+        self.out_channels = out_channels
+        self.concat = concat
+        self.negative_slope = negative_slope
+        self.normalize_with_softmax = normalize_with_softmax
+        self.non_linearity = non_linearity
+        self.att_use_node_features = att_use_node_features
+
+    def forward(self, x, edge_index, pseudo):
+        for l in self.node_mlp:
+            x = activation(l(x), self.non_linearity)
+        num_nodes = x.size(0)
+        x = x.view(num_nodes, self.heads, self.out_channels)
+
+        index_j = edge_index[0]
+        index_i = edge_index[1]
+        x_j = x[index_j]
+
+        if self.att_use_node_features:
+            pseudo = pseudo.unsqueeze(-2).expand(-1, self.heads, -1)
+            alpha = self.att(torch.cat([x[index_i], x_j, pseudo], dim=-1))
+        else:
+            alpha = self.att(pseudo)
+
+        alpha = F.leaky_relu(alpha, self.negative_slope)
+        if self.normalize_with_softmax:
+            alpha = segment_softmax(alpha, index_i, num_nodes)
+
+        out = torch.zeros_like(x).index_add_(
+            0, index_i, x_j * alpha.view(-1, self.heads, 1))
+
+        if self.concat:
+            out = out.view(num_nodes, self.heads * self.out_channels)
+        else:
+            out = out.mean(dim=1)
+        return out + self.bias
+
+
+class FrozenOurConvModel(torch.nn.Module):
+    """
+    Inference-only version of a trained OurConvModel with a flat
+    (x, edge_index, edge_attr) -> scores signature, where scores are the
+    outputs of ``GnnModel.out_to_one_dim``, one per undirected edge.
+
+    Dropout and summaries are removed, and all batch norms are folded into
+    the linear map that follows them. The batch norms sit behind
+    non-linearities, hence folding them into the preceding weights would not
+    be exact.
+
+    Use ``freeze_our_conv_model`` to create it, then ``torch.jit.script`` it.
+    """
+
+    def __init__(
+            self,
+            convs,
+            non_linearity,
+            fc_layers,
+            out_scale,
+            out_shift,
+            out_nonlinearity,
+            score,
+            edge_labels,
+            fc_use_edge,
+            undirected_edges,
+            reversed_dims):
+        super(FrozenOurConvModel, self).__init__()
+        self.convs = torch.nn.ModuleList(convs)
+        self.non_linearity = non_linearity
+        self.fc_layers_list = torch.nn.ModuleList(fc_layers)
+        # batch norm of the last layer, if it cannot be folded into an fc layer
+        self.register_buffer('out_scale', out_scale)
+        self.register_buffer('out_shift', out_shift)
+        self.out_nonlinearity = out_nonlinearity
+        self.score = score
+        self.edge_labels = edge_labels
+        self.fc_use_edge = fc_use_edge
+        # graphs with one column per RAG edge are expanded to directed pairs
+        self.undirected_edges = undirected_edges
+        self.reversed_dims = reversed_dims
+
+    def forward(self, x: torch.Tensor, edge_index: torch.Tensor, edge_attr: torch.Tensor) -> torch.Tensor:
+        if edge_attr.dim() == 1:
+            edge_attr = edge_attr.unsqueeze(-1)
+
+        if self.undirected_edges:
+            edge_index = torch.stack(
+                [edge_index, torch.flip(edge_index, dims=[0])], dim=2).view(2, -1)
+            if self.reversed_dims > 0:
+                reverse_attr = torch.cat(
+                    [edge_attr[:, :-self.reversed_dims], 1 - edge_attr[:, -self.reversed_dims:]], dim=-1)
+            else:
+                reverse_attr = edge_attr
+            edge_attr = torch.stack(
+                [edge_attr, reverse_attr], dim=1).view(-1, edge_attr.size(-1))
+
+        for conv in self.convs:
+            x = conv(x, edge_index, edge_attr)
+            x = activation(x, self.non_linearity)
+        x = x * self.out_scale + self.out_shift
+
+        # a pair of directed edges is next to each other in the edge index
+        if self.score == 'cosine':
+            x = x[edge_index[0]]
+            cosine_sim = F.cosine_similarity(x[0::2], x[1::2], dim=1)
+            cosine_sim = torch.clamp(cosine_sim, min=-1.0, max=1.0)
+            return -((cosine_sim - 1) * 0.5)
+
+        if self.edge_labels:
+            x = x[edge_index[0]]
+            if self.fc_use_edge:
+                x = torch.cat([x, edge_attr], dim=-1)
+            x = x.view(edge_index.size(1) // 2, -1)
+
+        num_fc_layers = len(self.fc_layers_list)
+        for i, l in enumerate(self.fc_layers_list):
+            x = l(x)
+            if i < num_fc_layers - 1:
+                x = activation(x, self.non_linearity)
+
+        if self.out_nonlinearity == 'log_softmax':
+            x = F.log_softmax(x, dim=1)
+
+        if self.score == 'class_1':
+            return x[:, 1]
+        return x.squeeze()
+
+
+def _fold_into_linear(linear, scale, shift, blocks):
+    """
+    Fold y = x * scale + shift, applied to the given column blocks of the
+    input of a linear layer, into the weights and bias of that layer
+
+    Args:
+        linear (torch.nn.Linear):
+        scale (torch.Tensor): of shape (C,)
+        shift (torch.Tensor): of shape (C,)
+        blocks (list of int): start column of each block of size C in the input
+
+    Returns:
+        torch.nn.Linear: new layer, with bias
+    """
+    weight = linear.weight.detach().clone()
+    if linear.bias is not None:
+        bias = linear.bias.detach().clone()
+    else:
+        bias = torch.zeros(weight.size(0), dtype=weight.dtype, device=weight.device)
+
+    c = scale.size(0)
+    for b in blocks:
+        bias = bias + torch.mv(weight[:, b:b + c], shift)
+        weight[:, b:b + c] = weight[:, b:b + c] * scale
+
+    folded = torch.nn.Linear(weight.size(1), weight.size(0), bias=True)
+    folded.weight.data.copy_(weight)
+    folded.bias.data.copy_(bias)
+    return folded
+
+
+def _freeze_attention_mlp(att, heads, shared_in):
+    layers_list = []
+    scale = None
+    shift = None
+    for i, w in enumerate(att.weight_list):
+        # (1, heads, in, out) -> (heads, in, out)
+        w = w.detach()[0]
+        if att.bias:
+            b = att.bias_list[i].detach()[0].clone()
+        else:
+            b = torch.zeros(w.size(0), w.size(2), dtype=w.dtype, device=w.device)
+
+        # fold the batch norm of the previous layer, which has one channel per head
+        if scale is not None:
+            b = b + shift.view(-1, 1) * w.sum(dim=1)
+            w = w * scale.view(-1, 1, 1)
+
+        if i == 0 and shared_in:
+            in_features = w.size(1)
+            l = torch.nn.Linear(in_features, heads * w.size(2), bias=True)
+            l.weight.data.copy_(w.permute(1, 0, 2).reshape(in_features, -1).t())
+            l.bias.data.copy_(b.reshape(-1))
+        else:
+            l = HeadwiseLinear(weight=w.clone(), bias=b)
+        layers_list.append(l)
+
+        if att.batch_norm:
+            scale, shift = batch_norm_affine(att.batch_norm_list[i])
+        else:
+            scale, shift = None, None
+
+    if scale is None:
+        device = att.weight_list[0].device
+        scale = torch.ones(heads, device=device)
+        shift = torch.zeros(heads, device=device)
+
+    return FrozenAttentionMLP(
+        shared_in=shared_in,
+        layers_list=layers_list,
+        heads=heads,
+        non_linearity=att.non_linearity,
+        out_scale=scale,
+        out_shift=shift)
+
+
+def freeze_our_conv_model(model):
+    """
+    Create a FrozenOurConvModel from a trained OurConvModel
+
+    Args:
+        model (OurConvModel): trained model
+
+    Returns:
+        FrozenOurConvModel: eval mode, no parameters require gradients
+    """
+    if type(model) is not OurConvModel:
+        raise NotImplementedError(
+            f'freezing is only implemented for OurConvModel, not {type(model).__name__}')
+    config = model.config
+    if config.our_conv_output_node_embeddings:
+        raise NotImplementedError(
+            'frozen models output edge scores, not node embeddings')
+
+    model.eval()
+    with torch.no_grad():
+        convs = []
+        scale, shift = None, None
+        for i, l in enumerate(model.layers_list):
+            node_mlp = []
+            for j, w in enumerate(l.weight_list):
+                lin = torch.nn.Linear(w.size(0), w.size(1), bias=False)
+                lin.weight.data.copy_(w.detach().t())
+                if j == 0 and scale is not None:
+                    lin = _fold_into_linear(lin, scale, shift, blocks=[0])
+                node_mlp.append(lin)
+
+            if l.bias is not None:
+                bias = l.bias.detach().clone()
+            elif l.concat:
+                bias = torch.zeros(l.heads * l.out_channels, device=l.weight_list[0].device)
+            else:
+                bias = torch.zeros(l.out_channels, device=l.weight_list[0].device)
+
+            convs.append(FrozenOurConv(
+                node_mlp=node_mlp,
+                att=_freeze_attention_mlp(
+                    l.att, heads=l.heads, shared_in=not l.att_use_node_features),
+                bias=bias,
+                heads=l.heads,
+                out_channels=l.out_channels,
+                concat=l.concat,
+                negative_slope=l.negative_slope,
+                normalize_with_softmax=l.normalize_with_softmax,
+                non_linearity=l.non_linearity,
+                att_use_node_features=l.att_use_node_features))
+
+            if config.batch_norm:
+                scale, shift = batch_norm_affine(model.batch_norm_list[i])
+            else:
+                scale, shift = None, None
+
+        fc_layers = []
+        if isinstance(model.model_type, CosineEmbeddingLossProblem):
+            score = 'cosine'
+            out_nonlinearity = 'identity'
+        else:
+            if isinstance(model.model_type, ClassificationProblem):
+                if model.model_type.out_channels > 2:
+                    raise NotImplementedError(
+                        "projection of outputs to continuous 1d output space not defined yet")
+                score = 'class_1'
+                out_nonlinearity = 'log_softmax'
+            elif isinstance(model.model_type, RegressionProblem):
+                score = 'squeeze'
+                out_nonlinearity = 'identity'
+            else:
+                raise NotImplementedError(
+                    f'model type {type(model.model_type).__name__} cannot be frozen')
+
+            for i, l in enumerate(model.fc_layers_list):
+                lin = torch.nn.Linear(l.in_features, l.out_features, bias=True)
+                lin.weight.data.copy_(l.weight.detach())
+                if l.bias is not None:
+                    lin.bias.data.copy_(l.bias.detach())
+                else:
+                    lin.bias.data.zero_()
+
+                if i == 0 and scale is not None:
+                    c = scale.size(0)
+                    if config.edge_labels:
+                        # the fc input concatenates the features of both
+                        # directed edges of a pair
+                        per_edge = lin.in_features // 2
+                        blocks = [0, per_edge]
+                        assert per_edge - c in [0, config.pseudo_dimensionality]
+                    else:
+                        blocks = [0]
+                    lin = _fold_into_linear(lin, scale, shift, blocks=blocks)
+                    scale, shift = None, None
+                fc_layers.append(lin)
+
+        device = model.layers_list[0].weight_list[0].device
+        if scale is None:
+            scale = torch.ones(1, device=device)
+            shift = torch.zeros(1, device=device)
+
+        frozen = FrozenOurConvModel(
+            convs=convs,
+            non_linearity=config.non_linearity,
+            fc_layers=fc_layers,
+            out_scale=scale,
+            out_shift=shift,
+            out_nonlinearity=out_nonlinearity,
+            score=score,
+            edge_labels=config.edge_labels,
+            fc_use_edge=config.fc_use_edge,
+            undirected_edges=config.undirected_edges,
+            reversed_dims=utils.reversed_edge_attr_dims(config) if config.undirected_edges else 0)
+
+    frozen.eval()
+    for p in frozen.parameters():
+        p.requires_grad = False
+    return frozen
+
+
+def script_frozen_model(frozen):
+    """
+    Compile a FrozenOurConvModel with TorchScript and freeze the module
+    attributes, so it can be loaded with ``torch.jit.load`` without any
+    gnn_agglomeration or torch_geometric code.
+    """
+    scripted = torch.jit.script(frozen.eval())
+    return torch.jit.freeze(scripted)
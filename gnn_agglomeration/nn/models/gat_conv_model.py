@@ -65,7 +65,7 @@ class GatConvModel(GnnModel):
         x, edge_index = data.x, data.edge_index
 
         for i, l in enumerate(self.layers_list):
-            if self.training:
+            if self.training and self.recorder is not None:
                 self.write_to_variable_summary(
                     l.weight, 'layer_{}'.format(i), 'weights')
                 self.write_to_variable_summary(
@@ -39,7 +39,7 @@ class GcnModel(GnnModel):
     def forward(self, data):
         x, edge_index = data.x, data.edge_index
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.conv_in.weight, 'in_layer', 'params_weights')
             self.write_to_variable_summary(
@@ -53,7 +53,7 @@ class GcnModel(GnnModel):
             x, p=self.config.dropout_probs, training=self.training)
 
         for i, l in enumerate(self.hidden_layers):
-            if self.training:
+            if self.training and self.recorder is not None:
                 self.write_to_variable_summary(
                     l.weight, 'layer_{}'.format(i), 'params_weights')
                 self.write_to_variable_summary(
@@ -67,7 +67,7 @@ class GcnModel(GnnModel):
             x = getattr(F, self.config.dropout_type)(
                 x, p=self.config.dropout_probs, training=self.training)
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.conv_out.weight, 'out_layer', 'params_weights')
             self.write_to_variable_summary(
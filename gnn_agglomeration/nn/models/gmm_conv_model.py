@@ -50,7 +50,7 @@ class GmmConvModel(GnnModel):
     def forward(self, data):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.conv_in.mu, 'in_layer', 'weights_mu')
             self.write_to_variable_summary(
@@ -69,7 +69,7 @@ class GmmConvModel(GnnModel):
             x, p=self.config.dropout_probs, training=self.training)
 
         for i, l in enumerate(self.hidden_layers):
-            if self.training:
+            if self.training and self.recorder is not None:
                 self.write_to_variable_summary(
                     l.mu, 'layer_{}'.format(i), 'weights_mu')
                 self.write_to_variable_summary(
@@ -88,7 +88,7 @@ class GmmConvModel(GnnModel):
             x = getattr(F, self.config.dropout_type)(
                 x, p=self.config.dropout_probs, training=self.training)
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.conv_out.mu, 'out_layer', 'weights_mu')
             self.write_to_variable_summary(
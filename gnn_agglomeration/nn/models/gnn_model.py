@@ -1,10 +1,11 @@
 import torch
 from abc import ABC, abstractmethod
 import os
-import json
 import logging
 
-from .model_type import *
+from gnn_agglomeration import registry
+from ..summary_recorder import SummaryRecorder
+from gnn_agglomeration.artifact_writer import write_checkpoint, write_json
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -24,12 +25,7 @@ class GnnModel(torch.nn.Module, ABC):
 
         self.config = config
 
-        try:
-            self.model_type = globals()[model_type](config=self.config)
-        except Exception as e:
-            print(e)
-            raise NotImplementedError(
-                'The model type you have specified is not implemented')
+        self.model_type = registry.model_type(model_type)(config=self.config)
 
         self.layers()
         self.init_optimizer()
@@ -44,6 +40,19 @@ class GnnModel(torch.nn.Module, ABC):
         self.train_batch_iteration = train_batch_iteration
         self.val_batch_iteration = val_batch_iteration
 
+        # writes checkpoints in the background if set, see ArtifactWriter
+        self.artifact_writer = None
+
+        if config.write_summary and not config.log_per_epoch_only:
+            self.recorder = SummaryRecorder(
+                interval=config.summary_interval,
+                log_histograms=config.log_histograms,
+                log_only_gradients=config.log_only_gradients)
+        else:
+            self.recorder = None
+            # no per-call cost when summaries are disabled
+            self.write_to_variable_summary = self.skip_variable_summary
+
     @abstractmethod
     def layers(self):
         pass
@@ -71,6 +80,15 @@ class GnnModel(torch.nn.Module, ABC):
     def out_to_one_dim(self, out):
         return self.model_type.out_to_one_dim(out=out)
 
+    def one_dim_to_predictions(self, one_dim):
+        return self.model_type.one_dim_to_predictions(one_dim=one_dim)
+
+    def probability_to_one_dim(self, probability):
+        return self.model_type.probability_to_one_dim(probability=probability)
+
+    def one_dim_to_probability(self, one_dim):
+        return self.model_type.one_dim_to_probability(one_dim=one_dim)
+
     def metric(self, predictions, targets, mask):
         return self.model_type.metric(
             predictions=predictions,
@@ -87,14 +105,25 @@ class GnnModel(torch.nn.Module, ABC):
         pred = self.out_to_predictions(out)
         return self.metric(pred, targets, mask)
 
+    def out_to_weighted_correct(self, out, targets, mask):
+        pred = self.out_to_predictions(out)
+        return self.model_type.weighted_correct(
+            predictions=pred,
+            targets=targets,
+            mask=mask
+        )
+
     def predictions_to_list(self, predictions):
         return self.model_type.predictions_to_list(predictions=predictions)
 
-    def plot_targets_vs_predictions(self, targets, predictions):
-        self.model_type.plot_targets_vs_predictions(
-            targets=targets, predictions=predictions)
+    def plot_confusion_matrix(self, confusion_matrix):
+        self.model_type.plot_confusion_matrix(
+            confusion_matrix=confusion_matrix)
 
     def print_current_loss(self, epoch, batch_i, logger):
+        # formatting the loss syncs with the device
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         logger.debug('epoch {}, batch {}, {}: {} '.format(
             epoch, batch_i, self.model_type.loss_name, self.current_loss))
 
@@ -133,10 +162,7 @@ class GnnModel(torch.nn.Module, ABC):
         return ret
 
     def write_to_variable_summary(self, var, namespace, var_name):
-        """Write summary statistics for a Tensor (for tensorboardX visualization)"""
-
-        if not self.config.write_summary or self.config.log_per_epoch_only:
-            return
+        """Write summary statistics for a Tensor (for tensorboardX visualization), see SummaryRecorder"""
 
         # optional filter on namespaces
         if len(self.config.log_namespaces) > 0:
@@ -152,37 +178,18 @@ class GnnModel(torch.nn.Module, ABC):
         else:
             iteration = self.val_batch_iteration
 
-        # plot gradients of weights
-        grad = var.grad
-        if grad is not None:
-            grad_mean = torch.mean(grad)
-            self.current_writer.add_scalar(os.path.join(
-                namespace, var_name, 'gradients_mean'), grad_mean, iteration)
-            grad_stddev = torch.std(grad)
-            self.current_writer.add_scalar(
-                os.path.join(
-                    namespace,
-                    var_name,
-                    'gradients_stddev'),
-                grad_stddev,
-                iteration)
-
-            if self.config.log_histograms:
-                self.current_writer.add_histogram(os.path.join(
-                    namespace, var_name, 'gradients'), grad, iteration)
-
-        if self.config.log_only_gradients:
+        if not self.recorder.is_sampled(iteration):
             return
 
-        mean = torch.mean(var.data)
-        self.current_writer.add_scalar(os.path.join(
-            namespace, var_name, 'mean'), mean, iteration)
-        stddev = torch.std(var.data)
-        self.current_writer.add_scalar(os.path.join(
-            namespace, var_name, 'stddev'), stddev, iteration)
-        if self.config.log_histograms:
-            self.current_writer.add_histogram(os.path.join(
-                namespace, var_name), var.data, iteration)
+        self.recorder.record(
+            writer=self.current_writer,
+            iteration=iteration,
+            var=var,
+            namespace=namespace,
+            var_name=var_name)
+
+    def skip_variable_summary(self, var, namespace, var_name):
+        pass
 
     def save(self, name):
         """
@@ -200,13 +207,20 @@ class GnnModel(torch.nn.Module, ABC):
         #     os.remove(os.path.join(load_model_dir, checkpoint_versions[0]))
 
         # save the new one
-        torch.save({
+        checkpoint = {
             'epoch': self.epoch,
             'train_batch_iteration': self.train_batch_iteration,
             'val_batch_iteration': self.val_batch_iteration,
             'model_state_dict': self.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
-        }, os.path.join(self.config.run_abs_path, self.config.model_dir, name + '.tar'))
-
-        with open(os.path.join(self.config.run_abs_path, 'config.json'), 'w') as f:
-            json.dump(vars(self.config), f)
+        }
+        checkpoint_path = os.path.join(
+            self.config.run_abs_path, self.config.model_dir, name + '.tar')
+        config_path = os.path.join(self.config.run_abs_path, 'config.json')
+
+        if self.artifact_writer is not None:
+            self.artifact_writer.save_checkpoint(checkpoint, checkpoint_path)
+            self.artifact_writer.save_json(vars(self.config), config_path)
+        else:
+            write_checkpoint(checkpoint, checkpoint_path, self.config.keep_checkpoints)
+            write_json(vars(self.config), config_path)
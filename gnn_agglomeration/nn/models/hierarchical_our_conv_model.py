@@ -0,0 +1,89 @@
+import logging
+import torch
+import torch.nn.functional as F
+from torch_scatter import scatter_mean
+
+from .our_conv_model import OurConvModel
+from ..layers.our_conv import OurConv
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HierarchicalOurConvModel(OurConvModel):
+    """
+    OurConvModel with additional message passing on a hierarchy of coarsened
+    RAGs, see HemibrainGraph.add_coarsening. After the fragment-level layers,
+    the node representations are mean-pooled along the assignment maps, level
+    by level. On each level, OurConv layers run on the coarse edges, with
+    cartesian pseudo coordinates between the pooled positions. The results
+    are unpooled back to the fragments and added as residuals, such that
+    neuron-scale context costs a fraction of the fragment nodes.
+    """
+
+    def layers(self):
+        super(HierarchicalOurConvModel, self).layers()
+        assert len(self.config.coarsening_thresholds) > 0
+
+        dim = self.layer_output_dims()[-1]
+        self.coarse_layers_list = torch.nn.ModuleList()
+        self.unpool_list = torch.nn.ModuleList()
+        for _ in self.config.coarsening_thresholds:
+            convs = torch.nn.ModuleList()
+            for _ in range(self.config.coarse_layers):
+                convs.append(OurConv(
+                    in_channels=dim,
+                    out_channels=self.config.hidden_units[-1],
+                    dim=self.config.euclidian_dimensionality,
+                    heads=self.config.attention_heads[-1],
+                    concat=self.config.att_heads_concat,
+                    negative_slope=0.2,
+                    dropout=self.config.att_final_dropout,
+                    bias=self.config.use_bias,
+                    normalize_with_softmax=self.config.att_normalize,
+                    local_layers=self.config.att_nodenet_layers,
+                    local_hidden_dims=self.config.att_nodenet_hidden_dims,
+                    non_linearity=self.config.att_non_linearity,
+                    attention_nn_params=self.attention_nn_params()
+                ))
+            self.coarse_layers_list.append(convs)
+            self.unpool_list.append(torch.nn.Linear(dim, dim))
+
+    def cartesian(self, pos, edge_index):
+        """
+        normalized cartesian pseudo coordinates in [0, 1], as torch_geometric.transforms.Cartesian
+        """
+        cart = pos[edge_index[1]] - pos[edge_index[0]]
+        max_value = cart.abs().max() if cart.numel() > 0 else cart.new_ones(())
+        return cart / (2 * max_value + torch.finfo(torch.float).tiny) + 0.5
+
+    def coarse_context(self, x, data):
+        pos = data.pos
+        x_coarse = x
+        x_levels = []
+        assignments = []
+        for level, convs in enumerate(self.coarse_layers_list, start=1):
+            assignment = data[f'assignment_{level}']
+            num_clusters = data[f'num_clusters_{level}']
+            # summed up over the graphs in a batch
+            num_clusters = int(num_clusters.sum()) if torch.is_tensor(num_clusters) else int(num_clusters)
+            edge_index = data[f'coarse_edge_index_{level}']
+
+            x_coarse = scatter_mean(x_coarse, assignment, dim=0, dim_size=num_clusters)
+            pos = scatter_mean(pos, assignment, dim=0, dim_size=num_clusters)
+            pseudo = self.cartesian(pos, edge_index)
+            for i, conv in enumerate(convs):
+                x_coarse = conv(x=x_coarse, edge_index=edge_index, pseudo=pseudo)
+                x_coarse = getattr(F, self.config.non_linearity)(x_coarse)
+                self.write_to_variable_summary(
+                    x_coarse, f'coarse_level_{level}', f'layer_{i}/outputs')
+
+            x_levels.append(x_coarse)
+            assignments.append(assignment)
+
+        # unpool from the coarsest level back to the fragments
+        x_up = x_levels[-1]
+        for level in reversed(range(len(x_levels))):
+            below = x_levels[level - 1] if level > 0 else x
+            x_up = below + self.unpool_list[level](x_up[assignments[level]])
+        return x_up
@@ -55,7 +55,7 @@ class MinimalSplineConvModel(GnnModel):
     def forward(self, data):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.conv_in.weight, 'in_layer', 'weights')
             if self.config.use_bias:
@@ -71,7 +71,7 @@ class MinimalSplineConvModel(GnnModel):
         x = getattr(F, self.config.dropout_type)(
             x, p=self.config.dropout_probs, training=self.training)
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.fc.weight, 'fc_layer', 'weights')
             if self.config.use_bias:
@@ -84,7 +84,7 @@ class MinimalSplineConvModel(GnnModel):
         x = getattr(F, self.config.dropout_type)(
             x, p=self.config.dropout_probs, training=self.training)
 
-        if self.training:
+        if self.training and self.recorder is not None:
             self.write_to_variable_summary(
                 self.fc2.weight, 'out_layer', 'weights')
             if self.config.use_bias:
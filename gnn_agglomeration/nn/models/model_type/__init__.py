@@ -1,5 +1,11 @@
-from .model_type import ModelType  # noqa
+from gnn_agglomeration.registry import lazy_attributes
 
-from .classification_problem import ClassificationProblem  # noqa
-from .regression_problem import RegressionProblem  # noqa
-from .cosine_embedding_loss_problem import CosineEmbeddingLossProblem  # noqa
+__getattr__, __dir__, __all__ = lazy_attributes(
+    __name__,
+    {
+        'ModelType': '.model_type',
+
+        'ClassificationProblem': '.classification_problem',
+        'RegressionProblem': '.regression_problem',
+        'CosineEmbeddingLossProblem': '.cosine_embedding_loss_problem',
+    })
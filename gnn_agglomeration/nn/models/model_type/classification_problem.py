@@ -1,4 +1,5 @@
 import torch
+import math
 import torch.nn.functional as F
 
 from .model_type import ModelType
@@ -28,11 +29,25 @@ class ClassificationProblem(ModelType):
 
         return out[:, 1]
 
+    def one_dim_to_predictions(self, one_dim):
+        # one_dim is the log probability of class 1
+        return (one_dim > math.log(0.5)).long()
+
+    def probability_to_one_dim(self, probability):
+        # log probability of class 1
+        return torch.log(torch.clamp(probability, min=torch.finfo(torch.float).tiny))
+
+    def one_dim_to_probability(self, one_dim):
+        return torch.exp(one_dim)
+
     def predictions_to_list(self, predictions):
         return predictions.tolist()
 
     def metric(self, predictions, targets, mask):
-        weighted_equal = predictions.eq(targets.float()).float() * mask.float()
-        correct = weighted_equal.sum().item()
+        correct = self.weighted_correct(predictions, targets, mask).item()
         acc = correct / (mask.sum().item() + torch.finfo(torch.float).tiny)
         return acc
+
+    def weighted_correct(self, predictions, targets, mask):
+        weighted_equal = predictions.eq(targets.float()).float() * mask.float()
+        return weighted_equal.sum()
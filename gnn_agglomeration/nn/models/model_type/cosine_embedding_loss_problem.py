@@ -57,11 +57,26 @@ class CosineEmbeddingLossProblem(ModelType):
         # 0 = merge, 1 = split values for RAG db
         return -((cosine_sim - 1) * 0.5)
 
+    def one_dim_to_predictions(self, one_dim):
+        # back to cosine similarity, see out_to_one_dim
+        cosine_sim = 1 - 2 * one_dim
+        return (~(cosine_sim > self.config.cosine_threshold)).float()
+
+    def probability_to_one_dim(self, probability):
+        # one_dim is already in the space of the RAG merge scores
+        return probability
+
+    def one_dim_to_probability(self, one_dim):
+        return one_dim
+
     def predictions_to_list(self, predictions):
         return predictions.tolist()
 
     def metric(self, predictions, targets, mask):
-        weighted_equal = predictions.eq(targets.float()).float() * mask.float()
-        correct = weighted_equal.sum().item()
+        correct = self.weighted_correct(predictions, targets, mask).item()
         acc = correct / (mask.sum().item() + torch.finfo(torch.float).tiny)
         return acc
+
+    def weighted_correct(self, predictions, targets, mask):
+        weighted_equal = predictions.eq(targets.float()).float() * mask.float()
+        return weighted_equal.sum()
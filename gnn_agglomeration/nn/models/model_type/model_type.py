@@ -3,8 +3,6 @@ from abc import ABC, abstractmethod
 import os
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 
 class ModelType(torch.nn.Module, ABC):
@@ -38,6 +36,28 @@ class ModelType(torch.nn.Module, ABC):
     def out_to_one_dim(self, out):
         pass
 
+    @abstractmethod
+    def one_dim_to_predictions(self, one_dim):
+        """
+        inverse direction of out_to_one_dim, followed by out_to_predictions
+        """
+        pass
+
+    @abstractmethod
+    def probability_to_one_dim(self, probability):
+        """
+        map the probability of a split, e.g. a merge score from the RAG,
+        to the output space of out_to_one_dim
+        """
+        pass
+
+    @abstractmethod
+    def one_dim_to_probability(self, one_dim):
+        """
+        inverse direction of probability_to_one_dim
+        """
+        pass
+
     @abstractmethod
     def predictions_to_list(self, predictions):
         pass
@@ -46,14 +66,29 @@ class ModelType(torch.nn.Module, ABC):
     def metric(self, predictions, targets, mask):
         pass
 
-    def plot_targets_vs_predictions(self, targets, predictions):
-        # TODO improve: clip predictions to 0 as a quick fix
-        predictions = [x if x > 0 else 0 for x in predictions]
+    @abstractmethod
+    def weighted_correct(self, predictions, targets, mask):
+        """
+        mask-weighted number of correct predictions, as a tensor on the device
+        of the predictions, without a host sync. See metrics.MetricAccumulator
+        """
+        pass
+
+    def plot_confusion_matrix(self, confusion_matrix):
+        """
+        Args:
+            confusion_matrix (np.ndarray): predictions along the first and targets along the
+                second axis, see metrics.ConfusionMatrixAccumulator
+        """
+        # plotting libraries are slow to import, only needed at the end of a run
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         np.set_printoptions(suppress=True)
-        size = max(max(targets), max(predictions))
-        cm = np.zeros([size + 1, size + 1], dtype=int)
-        for i in range(len(targets)):
-            cm[predictions[i], targets[i]] += 1
+        # only the classes that occur in predictions or targets
+        occurring = np.nonzero(confusion_matrix.sum(axis=0) + confusion_matrix.sum(axis=1))[0]
+        size = occurring.max() if len(occurring) > 0 else 0
+        cm = confusion_matrix[:size + 1, :size + 1]
         cm = np.flip(cm, axis=0)
         ax = sns.heatmap(
             cm,
@@ -1,9 +1,6 @@
 import torch
 import os
-import tensorboardX
 import torch.nn.functional as F
-import chartify
-import pandas as pd
 import numpy as np
 
 from .model_type import ModelType
@@ -37,19 +34,39 @@ class RegressionProblem(ModelType):
     def out_to_one_dim(self, out):
         return out.squeeze()
 
+    def one_dim_to_predictions(self, one_dim):
+        return self.out_to_predictions(one_dim)
+
+    def probability_to_one_dim(self, probability):
+        if self.config.standardize_targets:
+            return (probability - self.config.targets_mean) / self.config.targets_std
+        return probability
+
+    def one_dim_to_probability(self, one_dim):
+        if self.config.standardize_targets:
+            one_dim = one_dim * self.config.targets_std + self.config.targets_mean
+        return torch.clamp(one_dim, min=0.0, max=1.0)
+
     def metric(self, predictions, targets, mask):
         # TODO test this
-        weighted_equal = torch.squeeze(predictions).eq(
-            targets.float()).float() * mask.float()
-        correct = weighted_equal.sum().item()
+        correct = self.weighted_correct(predictions, targets, mask).item()
         acc = correct / (mask.sum().item() + torch.finfo(torch.float).tiny)
         return acc
 
+    def weighted_correct(self, predictions, targets, mask):
+        weighted_equal = torch.squeeze(predictions).eq(
+            targets.float()).float() * mask.float()
+        return weighted_equal.sum()
+
     def predictions_to_list(self, predictions):
         return torch.squeeze(predictions).tolist()
 
     # TODO adapt to seaborn
     def plot_targets_vs_outputs(self, targets, outputs):
+        # plotting libraries are slow to import, only needed at the end of a run
+        import chartify
+        import pandas as pd
+
         ch = chartify.Chart(blank_labels=True)
         ch.plot.scatter(
             data_frame=pd.DataFrame({'t': targets, 'p': outputs}),
@@ -3,6 +3,7 @@ import torch
 import torch.nn.functional as F
 
 from .gnn_model import GnnModel
+from gnn_agglomeration import utils
 from ..layers.our_conv import OurConv
 from .model_type.cosine_embedding_loss_problem import CosineEmbeddingLossProblem
 
@@ -28,7 +29,43 @@ class OurConvModel(GnnModel):
             val_batch_iteration=val_batch_iteration,
             model_type=model_type)
 
+        # historical embeddings of out-of-batch nodes, see nn.history.History
+        self.history = None
+        # run only the message passing layers input_layer:output_layer, see nn.feature_cache.
+        # With output_layer set, forward returns the node representations of that layer
+        self.input_layer = 0
+        self.output_layer = None
+
+    def layer_output_dims(self):
+        """
+        dimensionality of the node representations after each message passing layer
+        """
+        if self.config.att_heads_concat:
+            return [u * h for u, h in zip(self.config.hidden_units, self.config.attention_heads)]
+        return list(self.config.hidden_units)
+
+    def attention_nn_params(self):
+        return {
+            'layers': self.config.att_layers,
+            'layer_dims': self.config.att_layer_dims,
+            'non_linearity': self.config.att_non_linearity,
+            'batch_norm': self.config.att_batch_norm,
+            'dropout_probs': self.config.att_dropout_probs,
+            'bias': self.config.att_bias,
+        }
+
+    def coarse_context(self, x, data):
+        """
+        hook for context from coarser graphs, applied to the node representations
+        after the last message passing layer
+        """
+        return x
+
     def layers(self):
+        if self.config.undirected_edges:
+            # fails early for pseudo coordinates that cannot be reversed
+            utils.reversed_edge_attr_dims(self.config)
+
         # Assert some layer configs
         # By default, we need to specify the size of the representation between
         # input and output layer
@@ -41,14 +78,7 @@ class OurConvModel(GnnModel):
         self.layers_list = torch.nn.ModuleList()
         self.batch_norm_list = torch.nn.ModuleList()
 
-        attention_nn_params = {
-            'layers': self.config.att_layers,
-            'layer_dims': self.config.att_layer_dims,
-            'non_linearity': self.config.att_non_linearity,
-            'batch_norm': self.config.att_batch_norm,
-            'dropout_probs': self.config.att_dropout_probs,
-            'bias': self.config.att_bias,
-        }
+        attention_nn_params = self.attention_nn_params()
 
         out_channels_in = self.config.hidden_units[0]
         conv_in = OurConv(
@@ -138,11 +168,52 @@ class OurConvModel(GnnModel):
                     bias=self.config.fc_bias)
             self.fc_layers_list.append(fc)
 
+        # the parameters of frozen layers are excluded from the optimizer
+        for i in range(self.config.frozen_layers):
+            for p in self.layers_list[i].parameters():
+                p.requires_grad = False
+            if self.config.batch_norm:
+                for p in self.batch_norm_list[i].parameters():
+                    p.requires_grad = False
+
     def forward(self, data):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
+        # graphs pruned to the target edges, see data_transforms.PruneToTargets
+        pruned = getattr(data, 'layer_nodes', None) is not None
+        if pruned:
+            layer_nodes = data.layer_nodes.tolist()
+            layer_edges = data.layer_edges.tolist()
+            head_edge_index = data.target_edge_index
+            head_edge_attr = data.target_edge_attr
+        elif self.config.undirected_edges:
+            # one column per RAG edge, expand both directions once for all layers
+            head_edge_index = edge_index
+            edge_index = utils.expand_undirected_edge_index(edge_index)
+            edge_attr = utils.expand_undirected_edge_attr(
+                edge_attr, utils.reversed_edge_attr_dims(self.config))
+            head_edge_attr = edge_attr.view(-1, 2, edge_attr.size(-1))
+        else:
+            head_edge_index, head_edge_attr = None, None
+
+        if self.config.csr_aggregation:
+            if getattr(data, 'edge_perm', None) is None:
+                raise ValueError(
+                    'csr_aggregation requires graphs with edge_perm and in_degree, re-process the dataset')
+            # sort the edges by destination once for all layers, the head keeps the pair layout
+            conv_edge_index = edge_index[:, data.edge_perm]
+            conv_edge_attr = edge_attr[data.edge_perm]
+            rowptr = utils.degree_to_rowptr(data.in_degree)
+        else:
+            conv_edge_index, conv_edge_attr, rowptr = edge_index, edge_attr, None
+
         for i, l in enumerate(self.layers_list):
-            if self.training:
+            if i < self.input_layer:
+                continue
+            if self.output_layer is not None and i >= self.output_layer:
+                break
+
+            if self.training and self.recorder is not None:
                 for j, weight in enumerate(l.weight_list):
                     self.write_to_variable_summary(
                         weight, f'layer_{i}', f'nodenet_{j}/weights')
@@ -159,7 +230,16 @@ class OurConvModel(GnnModel):
                         self.write_to_variable_summary(
                             l.att.bias_list[j], 'layer_{}'.format(i), 'att_mlp/bias_layer_{}'.format(j))
 
-            x = l(x=x, edge_index=edge_index, pseudo=edge_attr)
+            if pruned:
+                # only the nodes the following layers depend on, and their incoming edges
+                num_out, num_edges = layer_nodes[i - self.input_layer], layer_edges[i - self.input_layer]
+                x = l(x=x,
+                      edge_index=conv_edge_index[:, :num_edges],
+                      pseudo=conv_edge_attr[:num_edges],
+                      rowptr=None if rowptr is None else rowptr[:num_out + 1])
+                x = x[:num_out]
+            else:
+                x = l(x=x, edge_index=conv_edge_index, pseudo=conv_edge_attr, rowptr=rowptr)
             self.write_to_variable_summary(
                 x, 'layer_{}'.format(i), 'preactivations')
 
@@ -175,20 +255,42 @@ class OurConvModel(GnnModel):
             x = getattr(F, self.config.dropout_type)(
                 x, p=self.config.dropout_probs[i], training=self.training)
 
+            if self.history is not None:
+                x = self.history.push_and_pull(
+                    layer=i, x=x, n_id=data.n_id, num_batch_nodes=int(data.num_inner_nodes))
+
+        if self.output_layer is not None:
+            return x
+
+        x = self.coarse_context(x, data)
+
         # simply return the feature vector per node
         if self.config.our_conv_output_node_embeddings:
             return x
 
         if isinstance(self.model_type, CosineEmbeddingLossProblem):
-            # TODO this is a quick fix implementation, with the assumption that
-            #  a pair of edges is next to each other in the edge index
-            x = x[edge_index[0]]
-            x = (x[0::2], x[1::2])
+            if head_edge_index is not None:
+                x = (x[head_edge_index[0]], x[head_edge_index[1]])
+            else:
+                # TODO this is a quick fix implementation, with the assumption that
+                #  a pair of edges is next to each other in the edge index
+                x = x[edge_index[0]]
+                x = (x[0::2], x[1::2])
 
         else:
+            if self.config.edge_labels and head_edge_index is not None:
+                # same layout as for directed pairs: u, edge (u, v), v, edge (v, u)
+                x_u = x[head_edge_index[0]]
+                x_v = x[head_edge_index[1]]
+                if self.config.fc_use_edge:
+                    x = torch.cat(
+                        [x_u, head_edge_attr[:, 0], x_v, head_edge_attr[:, 1]], dim=-1)
+                else:
+                    x = torch.cat([x_u, x_v], dim=-1)
+
             # TODO this is a quick fix implementation, with the assumption that
             #  a pair of edges is next to each other in the edge index
-            if self.config.edge_labels:
+            elif self.config.edge_labels:
                 x = x[edge_index[0]]
                 # might be computationally expensive
                 if self.config.fc_use_edge:
@@ -197,7 +299,7 @@ class OurConvModel(GnnModel):
                 x = x.view(int(edge_index.size(1) / 2), -1)
 
             for i, l in enumerate(self.fc_layers_list):
-                if self.training:
+                if self.training and self.recorder is not None:
                     self.write_to_variable_summary(
                         l.weight, 'out_layer', f'fc_{i}/weights')
                     if self.config.fc_bias:
@@ -0,0 +1,126 @@
+import logging
+import copy
+import torch
+from time import time as now
+
+from .frozen_our_conv_model import HeadwiseLinear, FrozenOurConvModel
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# parts of a FrozenOurConvModel that can be quantized independently
+QUANTIZATION_GROUPS = ['node_mlp', 'attention', 'fc']
+
+
+class HeadwiseLinearList(torch.nn.Module):
+    """
+    HeadwiseLinear expressed as one torch.nn.Linear per attention head,
+    such that torch.quantization can swap them for dynamic int8 layers
+    """
+
+    def __init__(self, headwise_linear):
+        super(HeadwiseLinearList, self).__init__()
+        weight = headwise_linear.weight.detach()
+        bias = headwise_linear.bias.detach()
+        self.linears = torch.nn.ModuleList()
+        for h in range(weight.size(0)):
+            lin = torch.nn.Linear(weight.size(1), weight.size(2), bias=True)
+            lin.weight.data.copy_(weight[h].t())
+            lin.bias.data.copy_(bias[h])
+            self.linears.append(lin)
+
+    def forward(self, x):
+        out = []
+        for h, lin in enumerate(self.linears):
+            out.append(lin(x[:, h]))
+        return torch.stack(out, dim=1)
+
+
+def quantize_frozen_model(frozen, groups=QUANTIZATION_GROUPS):
+    """
+    Dynamic int8 quantization of the linear layers of a FrozenOurConvModel.
+    Weights are quantized ahead of time, activations on the fly per batch,
+    hence no activation statistics have to be collected.
+
+    Args:
+        frozen (FrozenOurConvModel): float32 model, not scripted yet
+        groups (list of str): subset of QUANTIZATION_GROUPS
+
+    Returns:
+        FrozenOurConvModel: copy with quantized layers, for CPU inference
+    """
+    assert isinstance(frozen, FrozenOurConvModel)
+    for g in groups:
+        if g not in QUANTIZATION_GROUPS:
+            raise ValueError(
+                f'quantization group {g} not in {QUANTIZATION_GROUPS}')
+
+    model = copy.deepcopy(frozen).cpu().eval()
+    qconfig_spec = {}
+    for i, conv in enumerate(model.convs):
+        if 'node_mlp' in groups:
+            qconfig_spec[f'convs.{i}.node_mlp'] = torch.quantization.default_dynamic_qconfig
+        if 'attention' in groups:
+            for j, l in enumerate(conv.att.layers_list):
+                if isinstance(l, HeadwiseLinear):
+                    conv.att.layers_list[j] = HeadwiseLinearList(l)
+            qconfig_spec[f'convs.{i}.att.layers_list'] = torch.quantization.default_dynamic_qconfig
+    if 'fc' in groups and len(model.fc_layers_list) > 0:
+        qconfig_spec['fc_layers_list'] = torch.quantization.default_dynamic_qconfig
+
+    return torch.quantization.quantize_dynamic(
+        model, qconfig_spec=qconfig_spec, dtype=torch.qint8)
+
+
+def score_deviation(reference, model, graphs):
+    """
+    mean absolute deviation of the scores of model from the reference scores
+
+    Args:
+        reference (list of torch.Tensor): float32 scores, one tensor per graph
+        model (torch.nn.Module): (x, edge_index, edge_attr) -> scores
+        graphs (list of torch_geometric.data.Data):
+
+    Returns:
+        float
+    """
+    abs_diff = 0.0
+    num_scores = 0
+    with torch.no_grad():
+        for ref, g in zip(reference, graphs):
+            scores = model(g.x, g.edge_index, g.edge_attr)
+            abs_diff += (scores - ref).abs().sum().item()
+            num_scores += ref.numel()
+    return abs_diff / max(num_scores, 1)
+
+
+def calibrate_quantization(frozen, graphs, tolerance):
+    """
+    Decide which groups of layers to quantize, based on a few calibration
+    graphs. Each group is quantized on its own, and kept if the mean absolute
+    deviation of its scores from the float32 scores is within tolerance.
+
+    Args:
+        frozen (FrozenOurConvModel): float32 model
+        graphs (list of torch_geometric.data.Data): calibration graphs
+        tolerance (float): maximal mean absolute score deviation per group
+
+    Returns:
+        (list of str, dict): selected groups, score deviation per group
+    """
+    with torch.no_grad():
+        reference = [frozen(g.x, g.edge_index, g.edge_attr) for g in graphs]
+
+    deviations = {}
+    selected = []
+    for group in QUANTIZATION_GROUPS:
+        start = now()
+        quantized = quantize_frozen_model(frozen, groups=[group])
+        deviations[group] = score_deviation(reference, quantized, graphs)
+        logger.info(
+            f'quantize {group}: mean abs score deviation {deviations[group]:.5f} in {now() - start} s')
+        if deviations[group] <= tolerance:
+            selected.append(group)
+
+    logger.info(f'selected quantization groups: {selected}')
+    return selected, deviations
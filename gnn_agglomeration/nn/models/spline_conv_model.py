@@ -71,7 +71,7 @@ class SplineConvModel(GnnModel):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
         for i, l in enumerate(self.layers_list):
-            if self.training:
+            if self.training and self.recorder is not None:
                 self.write_to_variable_summary(
                     l.weight, 'layer_{}'.format(i), 'weights')
                 if self.config.use_bias:
@@ -0,0 +1,120 @@
+import torch
+import os
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class SummaryRecorder:
+    """
+    Sampled variable summaries for tensorboardX, see GnnModel.write_to_variable_summary.
+    Only every interval-th iteration is recorded. The mean and standard
+    deviation of each variable are reduced on the device without a sync, and
+    stacked into a single tensor per iteration. A background thread copies it
+    to the host and writes the scalars and histograms, such that the training
+    loop does not wait for the device or the event files.
+
+    Args:
+        interval (int): record every interval-th iteration
+        log_histograms (bool):
+        log_only_gradients (bool):
+        max_queue (int): number of recorded iterations that can wait for the writer thread
+    """
+
+    def __init__(self, interval, log_histograms, log_only_gradients, max_queue=16):
+        self.interval = interval
+        self.log_histograms = log_histograms
+        self.log_only_gradients = log_only_gradients
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = None
+
+        self.writer = None
+        self.iteration = None
+        self.reset()
+
+    def reset(self):
+        self.tags = []
+        self.stats = []
+        self.histograms = []
+
+    def is_sampled(self, iteration):
+        return iteration % self.interval == 0
+
+    def record(self, writer, iteration, var, namespace, var_name):
+        if writer is not self.writer or iteration != self.iteration:
+            self.flush()
+            self.writer = writer
+            self.iteration = iteration
+
+        # plot gradients of weights
+        grad = var.grad
+        if grad is not None:
+            self.tags.append(os.path.join(namespace, var_name, 'gradients_mean'))
+            self.tags.append(os.path.join(namespace, var_name, 'gradients_stddev'))
+            self.stats.append(torch.stack([torch.mean(grad), torch.std(grad)]))
+            if self.log_histograms:
+                # the gradients are zeroed in place after the optimizer step
+                self.histograms.append(
+                    (os.path.join(namespace, var_name, 'gradients'), grad.detach().clone()))
+
+        if self.log_only_gradients:
+            return
+
+        data = var.detach()
+        self.tags.append(os.path.join(namespace, var_name, 'mean'))
+        self.tags.append(os.path.join(namespace, var_name, 'stddev'))
+        self.stats.append(torch.stack([torch.mean(data), torch.std(data)]))
+        if self.log_histograms:
+            # weights are updated in place by the optimizer
+            self.histograms.append((os.path.join(namespace, var_name), data.clone()))
+
+    def flush(self):
+        """
+        hand the recorded iteration to the writer thread
+        """
+        if self.error is not None:
+            raise self.error
+        if len(self.stats) == 0 and len(self.histograms) == 0:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write_loop, daemon=True)
+            self.thread.start()
+
+        stats = torch.cat(self.stats) if len(self.stats) > 0 else None
+        self.queue.put((self.writer, self.iteration, self.tags, stats, self.histograms))
+        self.reset()
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                writer, iteration, tags, stats, histograms = item
+                if stats is not None:
+                    # a single copy from the device per iteration
+                    for tag, value in zip(tags, stats.cpu().tolist()):
+                        writer.add_scalar(tag, value, iteration)
+                for tag, values in histograms:
+                    writer.add_histogram(tag, values.cpu(), iteration)
+            except Exception as e:
+                # keep consuming, such that flush does not block on a full queue
+                logger.error(f'summary recorder: {e}')
+                self.error = e
+
+    def close(self):
+        """
+        write the pending summaries and stop the writer thread
+        """
+        if self.error is None:
+            self.flush()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
@@ -1,9 +1,18 @@
-from .hemibrain_dataset_blockwise import HemibrainDatasetBlockwise  # noqa
-from .hemibrain_dataset_blockwise_in_memory import HemibrainDatasetBlockwiseInMemory  # noqa
-from .hemibrain_dataset_random import HemibrainDatasetRandom  # noqa
-from .hemibrain_dataset_random_in_memory import HemibrainDatasetRandomInMemory  # noqa
+from gnn_agglomeration.registry import lazy_attributes
 
-from .hemibrain_graph_unmasked import HemibrainGraphUnmasked  # noqa
-from .hemibrain_graph_masked import HemibrainGraphMasked  # noqa
+__getattr__, __dir__, __all__ = lazy_attributes(
+    __name__,
+    {
+        'HemibrainDatasetBlockwise': '.hemibrain_dataset_blockwise',
+        'HemibrainDatasetBlockwiseInMemory': '.hemibrain_dataset_blockwise_in_memory',
+        'HemibrainDatasetRandom': '.hemibrain_dataset_random',
+        'HemibrainDatasetRandomInMemory': '.hemibrain_dataset_random_in_memory',
+        'HemibrainDatasetPartitioned': '.hemibrain_dataset_partitioned',
+        'HemibrainDatasetHistorical': '.hemibrain_dataset_historical',
+        'HemibrainDatasetIncremental': '.hemibrain_dataset_incremental',
+        'CachedValidationSet': '.cached_validation_set',
 
-from . import toy_datasets
+        'HemibrainGraphUnmasked': '.hemibrain_graph_unmasked',
+        'HemibrainGraphMasked': '.hemibrain_graph_masked',
+    },
+    submodules=['toy_datasets'])
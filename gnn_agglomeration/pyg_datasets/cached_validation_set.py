@@ -0,0 +1,95 @@
+from torch_geometric.data import Batch
+import numpy as np
+import copy
+import logging
+from time import time as now
+
+from gnn_agglomeration import utils
+from gnn_agglomeration import distributed
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class CachedValidationSet:
+    """
+    Fixed subset of a validation dataset, drawn once with a seeded generator
+    and collated into batches once, such that each validation pass evaluates
+    the same graphs without I/O and without transforms. The graphs are not
+    augmented, only the coordinate transform is applied, see
+    HemibrainDataset.get_unaugmented. Graphs of a FeatureCacheDataset are
+    taken as they are.
+
+    Batches are filled with graphs up to max_edges directed edges, or hold
+    batch_size graphs if max_edges is None. In distributed runs, each rank
+    evaluates an equal number of graphs of the subset in batches of
+    batch_size, such that all ranks reduce their metrics the same number of
+    times. With shard False, the whole subset is kept, e.g. for the
+    asynchronous validation process of rank 0.
+
+    Iterating yields shallow copies of the batches, transforms on the device,
+    e.g. PruneToTargets, do not change the cached batches.
+
+    Args:
+        dataset (torch.utils.data.Dataset):
+        num_samples (int): size of the subset, at most the size of the dataset
+        batch_size (int):
+        config (argparse.Namespace):
+        max_edges (int or None): edge budget per batch
+        seed (int):
+        device (torch.device or None): keep the batches on this device, None keeps them in host memory
+        shard (bool): in distributed runs, keep only the graphs of this rank
+    """
+
+    def __init__(self, dataset, num_samples, batch_size, config, max_edges=None, seed=0, device=None,
+                 shard=True):
+        start = now()
+        num_samples = min(num_samples, len(dataset))
+        subset = np.random.RandomState(seed).choice(len(dataset), size=num_samples, replace=False)
+        subset = np.sort(subset)
+
+        if shard and distributed.is_distributed():
+            # interleaved shard, wrapped around to the same size on all ranks
+            shard_size = distributed.shard_size(num_samples)
+            subset = [subset[(distributed.rank() + i * distributed.world_size()) % num_samples]
+                      for i in range(shard_size)]
+            max_edges = None
+
+        graphs = [self.get_unaugmented(dataset, int(idx)) for idx in subset]
+
+        self.batches = []
+        if max_edges is None:
+            for i in range(0, len(graphs), batch_size):
+                self.batches.append(Batch.from_data_list(graphs[i:i + batch_size]))
+        else:
+            batch = []
+            batch_edges = 0
+            for g in graphs:
+                num_edges = utils.num_directed_edges(g, config)
+                if len(batch) > 0 and batch_edges + num_edges > max_edges:
+                    self.batches.append(Batch.from_data_list(batch))
+                    batch = []
+                    batch_edges = 0
+                batch.append(g)
+                batch_edges += num_edges
+            if len(batch) > 0:
+                self.batches.append(Batch.from_data_list(batch))
+
+        if device is not None:
+            self.batches = [b.to(device) for b in self.batches]
+
+        logger.info(
+            f'cached {len(graphs)} validation graphs in {len(self.batches)} batches in {now() - start:.3f} s')
+
+    @staticmethod
+    def get_unaugmented(dataset, idx):
+        if hasattr(dataset, 'get_unaugmented'):
+            return dataset.get_unaugmented(idx)
+        return dataset[idx]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        for b in self.batches:
+            yield copy.copy(b)
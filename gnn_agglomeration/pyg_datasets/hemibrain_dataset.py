@@ -13,9 +13,11 @@ import bson
 import multiprocessing
 from time import time as now
 import pickle
+import copy
+from collections import OrderedDict
 
-from ..data_transforms import *
 from gnn_agglomeration import utils
+from gnn_agglomeration import registry
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -25,6 +27,10 @@ logging.getLogger(
 
 
 class HemibrainDataset(Dataset, ABC):
+    # whether get_from_db returns the same graph for an index on every call,
+    # such that dataloader workers can cache the graphs, see get
+    deterministic_graphs = False
+
     def __init__(
             self,
             root,
@@ -42,16 +48,18 @@ class HemibrainDataset(Dataset, ABC):
         self.roi_shape = np.array(roi_shape, dtype=np.int_)
         self.len = length
         self.save_processed = save_processed
+        # unaugmented graphs by index, local to each dataloader worker
+        self.block_cache = OrderedDict()
 
         self.connect_to_db()
         self.load_node_embeddings()
         self.load_all_nodes()
         self.prepare()
 
-        data_augmentation = globals()[config.data_augmentation](config=config)
-        coordinate_transform = getattr(
+        data_augmentation = registry.data_augmentation(config.data_augmentation)(config=config)
+        self.coordinate_transform = getattr(
             T, config.data_transform)(norm=True, cat=True)
-        transform = T.Compose([data_augmentation, coordinate_transform])
+        transform = T.Compose([data_augmentation, self.coordinate_transform])
         super(HemibrainDataset, self).__init__(
             root=root, transform=transform, pre_transform=None)
 
@@ -60,13 +68,7 @@ class HemibrainDataset(Dataset, ABC):
         Needed to add node position to edges that go out of the cube
         """
         start = now()
-        with open(self.config.db_host, 'r') as f:
-            pw_parser = configparser.ConfigParser()
-            pw_parser.read_file(f)
-
-        client = pymongo.MongoClient(pw_parser['DEFAULT']['db_host'])
-        db = client[self.db_name]
-        collection = db[self.config.nodes_collection]
+        collection = self.db_collection(self.config.nodes_collection)
 
         # TODO parametrize field names
         self.all_nodes = {}
@@ -86,13 +88,7 @@ class HemibrainDataset(Dataset, ABC):
             return
 
         start = now()
-        with open(self.config.db_host, 'r') as f:
-            pw_parser = configparser.ConfigParser()
-            pw_parser.read_file(f)
-
-        client = pymongo.MongoClient(pw_parser['DEFAULT']['db_host'])
-        db = client[self.db_name]
-        collection = db[self.embeddings_collection]
+        collection = self.db_collection(self.embeddings_collection)
 
         # TODO parametrize field names
         self.embeddings = {}
@@ -116,6 +112,125 @@ class HemibrainDataset(Dataset, ABC):
             f'offset padded: {offset_padded}, shape padded: {shape_padded}')
         return self.crop_block(offset_padded, shape_padded)
 
+    def db_collection(self, collection_name):
+        return self.db_client()[self.db_name][collection_name]
+
+    def num_halo_hops(self):
+        """
+        hops of context needed around the targets, by default one per message passing layer
+        """
+        if self.config.halo_hops is not None:
+            return self.config.halo_hops
+        return self.config.hidden_layers + 1
+
+    def read_hop_halo(self, inner_offset, inner_shape):
+        """
+        RAG excerpt with all edges within halo_hops - 1 hops of the inner block,
+        read by iteratively querying the edges of a frontier of node ids.
+        The seeds are the nodes in the inner block and the v nodes of the edges
+        with u in the inner block, hence a model with halo_hops message passing
+        layers computes the same outputs on all target edges as on the full RAG.
+        Like padded blocks, the halo is cropped to the ROI of the dataset: nodes
+        outside are kept as neighbours, but not expanded further.
+
+        Args:
+            inner_offset (numpy.array): offset of the inner block
+            inner_shape (numpy.array): shape of the inner block
+
+        Returns:
+            (list of dict, list of dict): node attributes, edge attributes, as
+            returned by daisy.persistence.MongoDbGraphProvider
+        """
+        inner_roi = daisy.Roi(list(inner_offset), list(inner_shape))
+        inner_ids = [n['id'] for n in self.graph_provider.read_nodes(roi=inner_roi)]
+        return self.read_node_halo(inner_ids)
+
+    def read_node_halo(self, inner_ids):
+        """
+        RAG excerpt with all edges within halo_hops - 1 hops of the inner nodes
+        and the v nodes of the edges with u in the inner nodes, see read_hop_halo
+
+        Args:
+            inner_ids (list of int): ids of the inner nodes
+
+        Returns:
+            (list of dict, list of dict): node attributes, edge attributes
+        """
+        start = now()
+        hops = self.num_halo_hops()
+        inner_ids = [int(i) for i in inner_ids]
+        collection = self.db_collection(self.config.edges_collection)
+
+        lower_limit = self.roi_offset
+        upper_limit = self.roi_offset + self.roi_shape
+
+        def in_roi(node_id):
+            n = self.all_nodes[node_id]
+            pos = np.array([n['center_z'], n['center_y'], n['center_x']])
+            return np.all(pos >= lower_limit) and np.all(pos < upper_limit)
+
+        # TODO parametrize field names
+        edges = {}
+        # target edges, only u has to be in the inner block
+        for e in collection.find({'u': {'$in': inner_ids}}, {'_id': False}):
+            edges[(e['u'], e['v'])] = e
+
+        visited = set(inner_ids) | set(v for _, v in edges)
+        frontier = visited
+        for h in range(hops):
+            frontier = [i for i in frontier if in_roi(i)]
+            if len(frontier) == 0:
+                break
+            new_nodes = set()
+            for e in collection.find(
+                    {'$or': [{'u': {'$in': frontier}}, {'v': {'$in': frontier}}]},
+                    {'_id': False}):
+                edges[(e['u'], e['v'])] = e
+                for node_id in (e['u'], e['v']):
+                    if node_id not in visited:
+                        new_nodes.add(node_id)
+            visited |= new_nodes
+            frontier = new_nodes
+            logger.debug(
+                f'hop {h + 1}: {len(new_nodes)} new nodes, {len(edges)} edges in total')
+
+        node_attrs = [{'id': i, **self.all_nodes[i]} for i in sorted(visited)]
+        edge_attrs = list(edges.values())
+        logger.debug(
+            f'read {hops}-hop halo with {len(node_attrs)} nodes, {len(edge_attrs)} edges in {now() - start} s')
+        return node_attrs, edge_attrs
+
+    def read_graph(self, graph, inner_offset, inner_shape):
+        """
+        Read the context of an inner block from the RAG into graph, either a
+        padded block or a halo of hops around it, see config.halo_mode
+        """
+        if self.config.halo_mode == 'padding':
+            outer_offset, outer_shape = self.pad_block(
+                inner_offset, inner_shape)
+            rag_excerpt = None
+            logger.info(
+                f'get graph from {daisy.Roi(outer_offset, outer_shape)}')
+        elif self.config.halo_mode == 'hops':
+            outer_offset, outer_shape = inner_offset, inner_shape
+            rag_excerpt = self.read_hop_halo(inner_offset, inner_shape)
+            logger.info(
+                f'get graph from halo around {daisy.Roi(inner_offset, inner_shape)}')
+        else:
+            raise NotImplementedError(
+                f'halo_mode {self.config.halo_mode} not implemented')
+
+        graph.read_and_process(
+            graph_provider=self.graph_provider,
+            embeddings=self.embeddings,
+            all_nodes=self.all_nodes,
+            block_offset=outer_offset,
+            block_shape=outer_shape,
+            inner_block_offset=inner_offset,
+            inner_block_shape=inner_shape,
+            rag_excerpt=rag_excerpt
+        )
+
     def crop_block(self, offset, shape):
         """
 
@@ -142,15 +257,44 @@ class HemibrainDataset(Dataset, ABC):
         return cropped_offset, cropped_shape
 
     def connect_to_db(self):
+        """
+        The MongoDB client and the graph provider are opened lazily, once in
+        each process that uses them, and are not pickled. Persistent dataloader
+        workers keep their connections for the whole run.
+        """
+        self._db_client = None
+        self._graph_provider = None
+        self._connections_pid = os.getpid()
+
+    def check_connections(self):
+        # a forked process must not share the sockets of its parent
+        if self._connections_pid != os.getpid():
+            self.connect_to_db()
+
+    def db_host(self):
         with open(self.config.db_host, 'r') as f:
             pw_parser = configparser.ConfigParser()
             pw_parser.read_file(f)
+        return pw_parser['DEFAULT']['db_host']
 
-        # Graph provider
+    def db_client(self):
+        self.check_connections()
+        if self._db_client is None:
+            self._db_client = pymongo.MongoClient(self.db_host())
+        return self._db_client
+
+    @property
+    def graph_provider(self):
+        self.check_connections()
+        if self._graph_provider is None:
+            self._graph_provider = self.open_graph_provider()
+        return self._graph_provider
+
+    def open_graph_provider(self):
         # TODO fully parametrize once necessary
-        self.graph_provider = daisy.persistence.MongoDbGraphProvider(
+        return daisy.persistence.MongoDbGraphProvider(
             db_name=self.db_name,
-            host=pw_parser['DEFAULT']['db_host'],
+            host=self.db_host(),
             mode='r',
             nodes_collection=self.config.nodes_collection,
             edges_collection=self.config.edges_collection,
@@ -160,6 +304,15 @@ class HemibrainDataset(Dataset, ABC):
                 'center_y',
                 'center_x'])
 
+    def __getstate__(self):
+        # connections and cached graphs stay in the process that opened them
+        state = self.__dict__.copy()
+        state['_db_client'] = None
+        state['_graph_provider'] = None
+        state['_connections_pid'] = None
+        state['block_cache'] = OrderedDict()
+        return state
+
     def __len__(self):
         return self.len
 
@@ -210,11 +363,28 @@ class HemibrainDataset(Dataset, ABC):
     def get(self, idx):
         if self.save_processed:
             return torch.load(self.processed_paths[idx])
-        else:
-            start = now()
-            g = self.get_from_db(idx)
-            logger.debug(f'get graph from db in {now() - start} s')
-            return g
+        if idx in self.block_cache:
+            self.block_cache.move_to_end(idx)
+            # transforms assign new attributes, the cached graph stays unaugmented
+            return copy.copy(self.block_cache[idx])
+
+        start = now()
+        g = self.get_from_db(idx)
+        logger.debug(f'get graph from db in {now() - start} s')
+
+        if self.deterministic_graphs and self.config.worker_block_cache > 0:
+            self.block_cache[idx] = g
+            if len(self.block_cache) > self.config.worker_block_cache:
+                self.block_cache.popitem(last=False)
+            return copy.copy(g)
+        return g
+
+    def get_unaugmented(self, idx):
+        """
+        graph with pseudo coordinates as edge attributes, but without
+        random data augmentation
+        """
+        return self.coordinate_transform(self.get(idx))
 
     @abstractmethod
     def get_from_db(self, idx):
@@ -310,13 +480,7 @@ class HemibrainDataset(Dataset, ABC):
         assert len(orig_edge_attrs[node1_field]) == len(outputs_dict),\
             f'num edges in ROI {len(orig_edge_attrs[node1_field])}, num outputs including dummy values {len(outputs_dict)}'
 
-        with open(self.config.db_host, 'r') as f:
-            pw_parser = configparser.ConfigParser()
-            pw_parser.read_file(f)
-
-        client = pymongo.MongoClient(pw_parser['DEFAULT']['db_host'])
-        db = client[self.db_name]
-        collection = db[collection_name]
+        collection = self.db_collection(collection_name)
 
         start = now()
         insertion_elems = []
@@ -328,6 +492,39 @@ class HemibrainDataset(Dataset, ABC):
         logger.info(
             f'insert predicted merge_scores in {now() - start}s')
 
+    def update_outputs_in_db(self, outputs_dict, collection_name, removed_edges=()):
+        """
+        Overwrite the merge scores of the given edges in an existing collection
+        of predictions, see write_outputs_to_db, and delete the scores of edges
+        that have been removed from the RAG. All other predictions stay untouched.
+
+        Args:
+            outputs_dict (dict): merge score per (u, v)
+            collection_name (str):
+            removed_edges (iterable of tuple): (u, v) per removed edge
+        """
+        start = now()
+        collection = self.db_collection(collection_name)
+
+        # TODO parametrize field names
+        requests = []
+        for (u, v), merge_score in outputs_dict.items():
+            u, v = min(u, v), max(u, v)
+            requests.append(pymongo.UpdateOne(
+                {'u': bson.Int64(u), 'v': bson.Int64(v)},
+                {'$set': {'merge_score': float(merge_score)}},
+                upsert=True))
+        for u, v in removed_edges:
+            u, v = min(u, v), max(u, v)
+            requests.append(pymongo.DeleteOne(
+                {'u': bson.Int64(u), 'v': bson.Int64(v)}))
+
+        if len(requests) > 0:
+            result = collection.bulk_write(requests, ordered=False)
+            logger.info(
+                f'update {result.modified_count}, insert {result.upserted_count}, '
+                f'delete {result.deleted_count} merge scores in {now() - start} s')
+
     def targets_mean_std(self):
         """
         Not possible to estimate target mean and variance for a dataset that
@@ -5,14 +5,15 @@ import daisy
 from time import time as now
 
 from .hemibrain_dataset import HemibrainDataset
-from .hemibrain_graph_unmasked import HemibrainGraphUnmasked
-from .hemibrain_graph_masked import HemibrainGraphMasked
+
+from gnn_agglomeration import registry
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
 class HemibrainDatasetBlockwise(HemibrainDataset):
+    deterministic_graphs = True
 
     def prepare(self):
         self.define_blocks()
@@ -127,24 +128,14 @@ class HemibrainDatasetBlockwise(HemibrainDataset):
         start = now()
         # TODO remove duplicate code
 
-        # Get precomputed block offset, pad the block
-        inner_offset = self.block_offsets[idx]
-        outer_offset, outer_shape = self.pad_block(
-            inner_offset, self.block_shapes[idx])
-
-        logger.info(
-            f'get graph {idx} from {daisy.Roi(outer_offset, outer_shape)}')
-
-        graph = globals()[self.config.graph_type](config=self.config)
+        # Get precomputed block offset, read the block with its context
+        logger.info(f'get graph {idx}')
+        graph = registry.graph(self.config.graph_type)(config=self.config)
         try:
-            graph.read_and_process(
-                graph_provider=self.graph_provider,
-                embeddings=self.embeddings,
-                all_nodes=self.all_nodes,
-                block_offset=outer_offset,
-                block_shape=outer_shape,
-                inner_block_offset=inner_offset,
-                inner_block_shape=self.block_shapes[idx],
+            self.read_graph(
+                graph=graph,
+                inner_offset=self.block_offsets[idx],
+                inner_shape=self.block_shapes[idx]
             )
             logger.debug(f'get_from_db in {now() - start} s')
             return graph
@@ -10,6 +10,8 @@ from .hemibrain_dataset_blockwise import HemibrainDatasetBlockwise  # noqa
 from .hemibrain_graph_unmasked import HemibrainGraphUnmasked  # noqa
 from .hemibrain_graph_masked import HemibrainGraphMasked  # noqa
 
+from gnn_agglomeration.utils import num_directed_edges  # noqa
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -84,9 +86,10 @@ class HemibrainDatasetBlockwiseInMemory(
 
     def get(self, idx):
         data = InMemoryDataset.get(self, idx)
-        if data.num_edges > self.config.max_edges:
+        num_edges = num_directed_edges(data, self.config)
+        if num_edges > self.config.max_edges:
             logger.warning(
-                f'graph {idx} has {data.num_edges} edges, but the limit is set to {self.config.max_edges}.'
+                f'graph {idx} has {num_edges} edges, but the limit is set to {self.config.max_edges}.'
                 f'\nDuplicating previous graph')
             return self.get((idx - 1) % self.len)
         else:
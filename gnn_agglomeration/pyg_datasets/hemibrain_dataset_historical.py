@@ -0,0 +1,35 @@
+import numpy as np
+import logging
+
+from .hemibrain_dataset_partitioned import HemibrainDatasetPartitioned
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HemibrainDatasetHistorical(HemibrainDatasetPartitioned):
+    """
+    Mini-batches over the graph of the whole ROI, for training with historical
+    embeddings, see gnn_agglomeration.nn.history.History. Each graph consists
+    of the nodes of one part of the METIS partition, the in-batch nodes, which
+    come first, followed by their direct neighbours, whose layer outputs are
+    served from the history. All edges incident to in-batch nodes are
+    contained, hence there is no receptive field limit by padding.
+    Graphs carry n_id, the index of each node in the ROI graph, and
+    num_inner_nodes, the number of in-batch nodes.
+    """
+
+    def num_halo_hops(self):
+        return 1
+
+    def halo(self, part):
+        num_nodes = len(self.adj_rowptr) - 1
+        in_part = np.zeros(num_nodes, dtype=np.bool_)
+        in_part[part] = True
+
+        edge_ids, neighbours = self.incident_edges(part)
+        outside = np.unique(neighbours[~in_part[neighbours]])
+        return np.concatenate([part, outside]), np.unique(edge_ids)
+
+    def num_snapshot_nodes(self):
+        return len(self.adj_rowptr) - 1
@@ -0,0 +1,181 @@
+import numpy as np
+import logging
+from time import time as now
+
+from .hemibrain_dataset import HemibrainDataset
+
+from gnn_agglomeration import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HemibrainDatasetIncremental(HemibrainDataset):
+    """
+    Graphs that cover the part of the RAG affected by edits, for re-inference
+    without a full blockwise test pass. A model with K message passing layers
+    changes its outputs on the nodes within K hops of an edited node or edge.
+    Every edge incident to such a node is affected. The u nodes of the affected
+    edges are the inner nodes of the graphs, each read with a halo of K hops,
+    see HemibrainDataset.read_node_halo, and split spatially to fit max_edges.
+
+    Fragments that have been removed from the RAG are looked up in the
+    collection of predictions of the previous test pass. Their former
+    neighbours are re-inferred and their predicted edges are removed.
+
+    Args:
+        changed_node_ids (list of int): added, removed or modified fragments
+        changed_edges (list of tuple): added, removed or modified edges (u, v)
+        predictions_collection (str): collection with the merge scores of a previous test pass
+    """
+
+    def __init__(
+            self,
+            root,
+            config,
+            db_name,
+            embeddings_collection,
+            roi_offset,
+            roi_shape,
+            changed_node_ids,
+            changed_edges,
+            predictions_collection,
+            save_processed=False):
+        self.changed_node_ids = [int(i) for i in changed_node_ids]
+        self.changed_edges = [(int(u), int(v)) for u, v in changed_edges]
+        self.predictions_collection = predictions_collection
+        super(HemibrainDatasetIncremental, self).__init__(
+            root=root,
+            config=config,
+            db_name=db_name,
+            embeddings_collection=embeddings_collection,
+            roi_offset=roi_offset,
+            roi_shape=roi_shape,
+            length=None,
+            save_processed=save_processed
+        )
+
+    def prepare(self):
+        self.define_affected_region()
+        self.define_chunks()
+
+    def define_affected_region(self):
+        start = now()
+        collection = self.db_collection(self.config.edges_collection)
+
+        # TODO parametrize field names
+        seeds = set(i for i in self.changed_node_ids if i in self.all_nodes)
+        for u, v in self.changed_edges:
+            seeds.update(i for i in (u, v) if i in self.all_nodes)
+
+        # changed edges that are not in the RAG anymore
+        existing = set()
+        if len(self.changed_edges) > 0:
+            query = [{'u': u, 'v': v} for u, v in self.changed_edges] + \
+                [{'u': v, 'v': u} for u, v in self.changed_edges]
+            for e in collection.find({'$or': query}, {'_id': False, 'u': True, 'v': True}):
+                existing.add((min(e['u'], e['v']), max(e['u'], e['v'])))
+        removed_edges = set(
+            (min(u, v), max(u, v)) for u, v in self.changed_edges if (min(u, v), max(u, v)) not in existing)
+
+        # fragments that are not in the RAG anymore, their former edges are only in the predictions
+        removed_node_ids = [i for i in self.changed_node_ids if i not in self.all_nodes]
+        if len(removed_node_ids) > 0:
+            predictions = self.db_collection(self.predictions_collection)
+            for e in predictions.find(
+                    {'$or': [{'u': {'$in': removed_node_ids}}, {'v': {'$in': removed_node_ids}}]},
+                    {'_id': False, 'u': True, 'v': True}):
+                removed_edges.add((min(e['u'], e['v']), max(e['u'], e['v'])))
+                seeds.update(i for i in (e['u'], e['v']) if i in self.all_nodes)
+        self.removed_edges = sorted(removed_edges)
+
+        self.affected_node_ids = set(seeds)
+        frontier = list(seeds)
+        for _ in range(self.num_halo_hops()):
+            if len(frontier) == 0:
+                break
+            new_nodes = set()
+            for e in collection.find(
+                    {'$or': [{'u': {'$in': frontier}}, {'v': {'$in': frontier}}]},
+                    {'_id': False, 'u': True, 'v': True}):
+                for node_id in (e['u'], e['v']):
+                    if node_id not in self.affected_node_ids:
+                        new_nodes.add(node_id)
+            self.affected_node_ids |= new_nodes
+            frontier = list(new_nodes)
+
+        # edges are targets if their u node is inner
+        self.inner_node_ids = set(self.affected_node_ids)
+        for e in collection.find(
+                {'v': {'$in': list(self.affected_node_ids)}},
+                {'_id': False, 'u': True}):
+            self.inner_node_ids.add(e['u'])
+
+        logger.info(
+            f'{len(seeds)} changed nodes affect {len(self.affected_node_ids)} nodes, '
+            f'{len(removed_node_ids)} nodes and {len(self.removed_edges)} edges removed, in {now() - start} s')
+
+    def num_directed_edges(self, rag_excerpt):
+        node_attrs, edge_attrs = rag_excerpt
+        num_edges = len(edge_attrs)
+        if self.config.self_loops:
+            num_edges += len(node_attrs)
+        return 2 * num_edges
+
+    def define_chunks(self):
+        """
+        split the inner nodes in spatial order until the graph of each chunk fits into max_edges
+        """
+        start = now()
+        inner = sorted(
+            self.inner_node_ids,
+            key=lambda i: (self.all_nodes[i]['center_z'], self.all_nodes[i]['center_y'], self.all_nodes[i]['center_x']))
+
+        self.chunks = []
+        self.rag_excerpts = []
+        candidates = [inner] if len(inner) > 0 else []
+        while len(candidates) > 0:
+            chunk = candidates.pop()
+            rag_excerpt = self.read_node_halo(chunk)
+            num_edges = self.num_directed_edges(rag_excerpt)
+            if num_edges > self.config.max_edges and len(chunk) > 1:
+                candidates.append(chunk[len(chunk) // 2:])
+                candidates.append(chunk[:len(chunk) // 2])
+            else:
+                if num_edges > self.config.max_edges:
+                    logger.warning(
+                        f'chunk with a single node has {num_edges} edges, limit is {self.config.max_edges}')
+                self.chunks.append(chunk)
+                self.rag_excerpts.append(rag_excerpt)
+
+        self.len = len(self.chunks)
+        logger.info(f'split affected region into {self.len} graphs in {now() - start} s')
+
+    def bounding_box(self, node_ids):
+        pos = np.array([[self.all_nodes[i]['center_z'], self.all_nodes[i]['center_y'], self.all_nodes[i]['center_x']]
+                        for i in node_ids], dtype=np.int_)
+        offset = pos.min(axis=0)
+        return offset, pos.max(axis=0) + 1 - offset
+
+    def get_from_db(self, idx):
+        chunk = self.chunks[idx]
+        rag_excerpt = self.rag_excerpts[idx]
+        outer_offset, outer_shape = self.bounding_box(
+            [n['id'] for n in rag_excerpt[0]])
+        inner_offset, inner_shape = self.bounding_box(chunk)
+
+        logger.info(
+            f'get graph {idx} with {len(chunk)} inner nodes, {len(rag_excerpt[1])} edges')
+        graph = registry.graph(self.config.graph_type)(config=self.config)
+        graph.read_and_process(
+            graph_provider=self.graph_provider,
+            embeddings=self.embeddings,
+            all_nodes=self.all_nodes,
+            block_offset=outer_offset,
+            block_shape=outer_shape,
+            inner_block_offset=inner_offset,
+            inner_block_shape=inner_shape,
+            rag_excerpt=rag_excerpt,
+            inner_node_ids=np.array(chunk, dtype=np.int64)
+        )
+        return graph
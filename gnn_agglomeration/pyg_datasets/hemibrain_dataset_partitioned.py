@@ -0,0 +1,287 @@
+import torch
+import numpy as np
+import logging
+import daisy
+import os
+import pickle
+from time import time as now
+from torch_sparse import SparseTensor
+
+from .hemibrain_dataset import HemibrainDataset
+
+from gnn_agglomeration import registry
+from gnn_agglomeration import utils
+from gnn_agglomeration.utils import TooManyEdgesException
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HemibrainDatasetPartitioned(HemibrainDataset):
+    """
+    Blockwise dataset, where the blocks are the parts of a balanced min-edge-cut
+    partition of the RAG of the whole ROI, computed with METIS, instead of
+    axis-aligned cubes. Each part is read with a halo of hops around it from a
+    snapshot of the RAG, see HemibrainDataset.num_halo_hops, and parts whose
+    graph exceeds config.max_edges are split recursively.
+    The partition is cached in the root directory of the dataset.
+    """
+    deterministic_graphs = True
+
+    def __init__(
+            self,
+            root,
+            config,
+            db_name,
+            embeddings_collection,
+            roi_offset,
+            roi_shape,
+            length=None,
+            save_processed=False):
+        self.partition_cache = os.path.join(root, 'partition.pkl')
+        super(HemibrainDatasetPartitioned, self).__init__(
+            root=root,
+            config=config,
+            db_name=db_name,
+            embeddings_collection=embeddings_collection,
+            roi_offset=roi_offset,
+            roi_shape=roi_shape,
+            length=length,
+            save_processed=save_processed
+        )
+
+    def prepare(self):
+        self.load_rag_snapshot()
+        self.define_parts()
+
+    def load_rag_snapshot(self):
+        """
+        Read the RAG of the ROI and build an adjacency in CSR format over the
+        indices of the node ids in sorted order
+        """
+        start = now()
+        roi = daisy.Roi(list(self.roi_offset), list(self.roi_shape))
+        block_size = np.minimum(
+            np.array(self.config.block_size, dtype=np.int_), self.roi_shape)
+        node_attrs, edge_attrs = self.graph_provider.read_blockwise(
+            roi=roi,
+            block_size=daisy.Coordinate(block_size),
+            num_workers=self.config.num_workers
+        )
+
+        # TODO parametrize the used names
+        id_field = 'id'
+        node1_field = 'u'
+        node2_field = 'v'
+        edge_attrs = utils.drop_outgoing_edges(
+            node_attrs=node_attrs,
+            edge_attrs=edge_attrs,
+            id_field=id_field,
+            node1_field=node1_field,
+            node2_field=node2_field
+        )
+
+        order = np.argsort(node_attrs[id_field])
+        self.snapshot_nodes = {k: np.asarray(v)[order] for k, v in node_attrs.items()}
+        self.snapshot_edges = {k: np.asarray(v) for k, v in edge_attrs.items()}
+        self.edge_u = np.searchsorted(
+            self.snapshot_nodes[id_field], self.snapshot_edges[node1_field])
+        self.edge_v = np.searchsorted(
+            self.snapshot_nodes[id_field], self.snapshot_edges[node2_field])
+        num_nodes = len(self.snapshot_nodes[id_field])
+        num_edges = len(self.edge_u)
+
+        # both directions, sorted by source
+        src = np.concatenate([self.edge_u, self.edge_v])
+        dst = np.concatenate([self.edge_v, self.edge_u])
+        edge_ids = np.concatenate([np.arange(num_edges), np.arange(num_edges)])
+        adj_order = np.argsort(src, kind='stable')
+        self.adj_dst = dst[adj_order]
+        self.adj_edge_ids = edge_ids[adj_order]
+        self.adj_rowptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(src, minlength=num_nodes))]).astype(np.int64)
+
+        logger.info(
+            f'load RAG snapshot with {num_nodes} nodes, {num_edges} edges in {now() - start} s')
+
+    def incident_edges(self, nodes):
+        """
+        Returns:
+            (numpy.array, numpy.array): ids of the edges incident to nodes, and their other endpoint
+        """
+        starts = self.adj_rowptr[nodes]
+        counts = self.adj_rowptr[nodes + 1] - starts
+        idx = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+            np.arange(counts.sum())
+        return self.adj_edge_ids[idx], self.adj_dst[idx]
+
+    def halo(self, part):
+        """
+        Nodes and edges of the graph for a part: the edges with u in the part are
+        the targets, and all edges within num_halo_hops - 1 hops of their
+        endpoints provide the context.
+
+        Args:
+            part (numpy.array): node indices
+
+        Returns:
+            (numpy.array, numpy.array): node indices, edge ids
+        """
+        num_nodes = len(self.adj_rowptr) - 1
+        in_part = np.zeros(num_nodes, dtype=np.bool_)
+        in_part[part] = True
+
+        edge_ids, _ = self.incident_edges(part)
+        targets = edge_ids[in_part[self.edge_u[edge_ids]]]
+
+        visited = in_part.copy()
+        visited[self.edge_v[targets]] = True
+        frontier = np.nonzero(visited)[0]
+        edges = [targets]
+        for _ in range(self.num_halo_hops()):
+            edge_ids, neighbours = self.incident_edges(frontier)
+            edges.append(edge_ids)
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+
+        return np.nonzero(visited)[0], np.unique(np.concatenate(edges))
+
+    def num_directed_edges(self, nodes, edges):
+        """
+        number of directed edges of the graph parsed from a halo, see
+        HemibrainGraph.parse_rag_excerpt
+        """
+        num_edges = len(edges)
+        if self.config.self_loops:
+            num_edges += len(nodes)
+        return 2 * num_edges
+
+    def metis(self, nodes, num_parts):
+        """
+        balanced min-edge-cut partition of the subgraph induced by nodes
+
+        Args:
+            nodes (numpy.array): node indices
+            num_parts (int):
+
+        Returns:
+            list of numpy.array: node indices per part
+        """
+        if num_parts <= 1:
+            return [nodes]
+
+        num_nodes = len(self.adj_rowptr) - 1
+        local = np.full(num_nodes, -1, dtype=np.int64)
+        local[nodes] = np.arange(len(nodes))
+        inside = (local[self.edge_u] >= 0) & (local[self.edge_v] >= 0)
+        u = local[self.edge_u[inside]]
+        v = local[self.edge_v[inside]]
+
+        adj = SparseTensor(
+            row=torch.from_numpy(np.concatenate([u, v])),
+            col=torch.from_numpy(np.concatenate([v, u])),
+            sparse_sizes=(len(nodes), len(nodes)))
+        _, partptr, perm = adj.partition(num_parts=num_parts, recursive=False)
+        perm = perm.numpy()
+        partptr = partptr.numpy()
+        parts = [nodes[perm[partptr[i]:partptr[i + 1]]]
+                 for i in range(len(partptr) - 1)]
+        return [p for p in parts if len(p) > 0]
+
+    def define_parts(self):
+        # TODO parametrize the used names
+        id_field = 'id'
+
+        cache_key = {
+            'dataset': type(self).__name__,
+            'roi_offset': self.roi_offset.tolist(),
+            'roi_shape': self.roi_shape.tolist(),
+            'max_edges': self.config.max_edges,
+            'halo_hops': self.num_halo_hops(),
+            'self_loops': self.config.self_loops,
+        }
+        if os.path.isfile(self.partition_cache):
+            with open(self.partition_cache, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == cache_key:
+                self.parts = [np.searchsorted(self.snapshot_nodes[id_field], p)
+                              for p in cached['parts']]
+                self.len = len(self.parts)
+                logger.info(f'load {self.len} cached parts from {self.partition_cache}')
+                return
+
+        start = now()
+        num_nodes = len(self.adj_rowptr) - 1
+        num_parts = max(1, int(np.ceil(2 * len(self.edge_u) / self.config.max_edges)))
+        candidates = self.metis(np.arange(num_nodes), num_parts)
+
+        # split parts recursively until their graph with halo fits into max_edges
+        self.parts = []
+        while len(candidates) > 0:
+            part = candidates.pop()
+            nodes, edges = self.halo(part)
+            num_edges = self.num_directed_edges(nodes, edges)
+            if num_edges > self.config.max_edges and len(part) > 1:
+                candidates.extend(self.metis(part, 2))
+            else:
+                if num_edges > self.config.max_edges:
+                    logger.warning(
+                        f'part with a single node has {num_edges} edges, limit is {self.config.max_edges}')
+                self.parts.append(part)
+
+        self.len = len(self.parts)
+        logger.info(
+            f'partition RAG into {self.len} parts, starting from {num_parts}, in {now() - start} s')
+
+        os.makedirs(os.path.dirname(self.partition_cache), exist_ok=True)
+        with open(self.partition_cache, 'wb') as f:
+            pickle.dump({
+                'key': cache_key,
+                'parts': [self.snapshot_nodes[id_field][p] for p in self.parts]
+            }, f)
+
+    def get_from_db(self, idx):
+        # TODO parametrize the used names
+        id_field = 'id'
+        pos_fields = ['center_z', 'center_y', 'center_x']
+
+        start = now()
+        part = self.parts[idx]
+        nodes, edges = self.halo(part)
+
+        node_attrs = [{k: self.snapshot_nodes[k][i] for k in [id_field] + pos_fields}
+                      for i in nodes]
+        edge_attrs = [{k: v[e] for k, v in self.snapshot_edges.items()}
+                      for e in edges]
+
+        # bounding boxes of the halo and the part, for logging and the unmasked graph
+        pos = np.stack([self.snapshot_nodes[k] for k in pos_fields], axis=1).astype(np.int_)
+        outer_offset = pos[nodes].min(axis=0)
+        outer_shape = pos[nodes].max(axis=0) + 1 - outer_offset
+        inner_offset = pos[part].min(axis=0)
+        inner_shape = pos[part].max(axis=0) + 1 - inner_offset
+
+        logger.info(
+            f'get graph {idx} with {len(part)} inner nodes, {len(nodes)} nodes, {len(edges)} edges')
+
+        graph = registry.graph(self.config.graph_type)(config=self.config)
+        try:
+            graph.read_and_process(
+                graph_provider=self.graph_provider,
+                embeddings=self.embeddings,
+                all_nodes=self.all_nodes,
+                block_offset=outer_offset,
+                block_shape=outer_shape,
+                inner_block_offset=inner_offset,
+                inner_block_shape=inner_shape,
+                rag_excerpt=(node_attrs, edge_attrs),
+                inner_node_ids=self.snapshot_nodes[id_field][part]
+            )
+            # index in the snapshot of the ROI graph
+            graph.n_id = torch.tensor(nodes, dtype=torch.long)
+            graph.num_inner_nodes = len(part)
+            logger.debug(f'get_from_db in {now() - start} s')
+            return graph
+        except (ValueError, TooManyEdgesException) as e:
+            logger.warning(f'{e}, duplicating previous graph')
+            return self.get_from_db((idx - 1) % self.len)
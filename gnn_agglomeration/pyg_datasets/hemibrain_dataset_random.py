@@ -1,11 +1,9 @@
 import numpy as np
 import logging
-import daisy
 
 from .hemibrain_dataset import HemibrainDataset
-from .hemibrain_graph_unmasked import HemibrainGraphUnmasked
-from .hemibrain_graph_masked import HemibrainGraphMasked
 
+from gnn_agglomeration import registry
 from gnn_agglomeration.utils import TooManyEdgesException
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -30,22 +28,14 @@ class HemibrainDatasetRandom(HemibrainDataset):
             low=0, high=self.roi_shape[2] - self.config.block_size[2])
         total_offset = self.roi_offset + random_offset
 
-        outer_offset, outer_shape = self.pad_block(
-            total_offset, self.config.block_size)
-        logger.info(
-            f'get graph {idx} from {daisy.Roi(outer_offset, outer_shape)}')
-
-        graph = globals()[self.config.graph_type](config=self.config)
+        logger.info(f'get graph {idx}')
+        graph = registry.graph(self.config.graph_type)(config=self.config)
 
         try:
-            graph.read_and_process(
-                graph_provider=self.graph_provider,
-                embeddings=self.embeddings,
-                all_nodes=self.all_nodes,
-                block_offset=outer_offset,
-                block_shape=outer_shape,
-                inner_block_offset=total_offset,
-                inner_block_shape=self.config.block_size
+            self.read_graph(
+                graph=graph,
+                inner_offset=total_offset,
+                inner_shape=np.array(self.config.block_size, dtype=np.int_)
             )
             return graph
         except (ValueError, TooManyEdgesException) as e:
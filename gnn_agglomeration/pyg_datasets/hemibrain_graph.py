@@ -2,6 +2,8 @@ import torch
 from torch_geometric.data import Data
 import logging
 import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
 from abc import ABC, abstractmethod
 import time
 from time import time as now
@@ -22,10 +24,13 @@ class HemibrainGraph(Data, ABC):
             self,
             graph_provider,
             embeddings,
+            all_nodes,
             block_offset,
             block_shape,
             inner_block_offset,
-            inner_block_shape):
+            inner_block_shape,
+            rag_excerpt=None,
+            inner_node_ids=None):
         """
         Initiates reading the graph from DB and converting it to the desired format for torch_geometric.
         Assigns values to all torch_geometric.Data attributes
@@ -50,19 +55,119 @@ class HemibrainGraph(Data, ABC):
             inner_block_shape (``list`` of ``int``):
 
                 shape of sub-block, which might be used for masking, in nanometers
+
+            rag_excerpt (``tuple`` of ``list`` or None):
+
+                node and edge attributes that have already been read, e.g. a
+                halo of hops around the inner block. If None, the block is read
+                from graph_provider
+
+            inner_node_ids (``numpy.array`` or None):
+
+                ids of the inner nodes, for inner blocks that are not cubes
         """
 
         pass
 
+    def __inc__(self, key, value, *args, **kwargs):
+        # permutations of the directed edges are offset by the number of
+        # directed edges when batching, which is the sum of all in-degrees
+        if key == 'edge_perm':
+            return int(self.in_degree.sum())
+        # assignments and edges of coarsening level l refer to the clusters of level l
+        if key.startswith('assignment_') or key.startswith('coarse_edge_index_'):
+            return int(self[f'num_clusters_{key.split("_")[-1]}'])
+        return super(HemibrainGraph, self).__inc__(key, value, *args, **kwargs)
+
+    def add_csr_structure(self):
+        """
+        store a destination-sorted permutation of the directed edges and the
+        in-degree per node, used by OurConv for segment-based aggregation.
+        For undirected storage, the permutation refers to the directed edges
+        as expanded by utils.expand_undirected_edge_index
+        """
+        start = now()
+        if self.config.undirected_edges:
+            edge_index = utils.expand_undirected_edge_index(self.edge_index)
+        else:
+            edge_index = self.edge_index
+        self.edge_perm, self.in_degree = utils.csr_structure(
+            edge_index, self.num_nodes)
+        logger.debug(f'add csr structure in {now() - start} s')
+
+    def add_coarsening(self, thresholds):
+        """
+        Build a hierarchy of coarsened RAGs. Level l clusters the fragments into
+        the connected components of the edges with merge score <= thresholds[l - 1],
+        i.e. the confident merges. For each level, store
+            assignment_l: cluster of level l for each node of level l - 1
+            coarse_edge_index_l: directed edges between the clusters of level l
+            num_clusters_l: number of clusters of level l
+
+        Args:
+            thresholds (list of float): ascending, such that the levels are nested
+        """
+        start = now()
+        assert list(thresholds) == sorted(thresholds)
+
+        if self.config.undirected_edges:
+            edge_index_undir = self.edge_index
+            merge_score = self.edge_attr[:, 0]
+        else:
+            edge_index_undir = self.edge_index[:, 0::2]
+            merge_score = self.edge_attr[0::2, 0]
+        u = edge_index_undir[0].numpy()
+        v = edge_index_undir[1].numpy()
+        merge_score = merge_score.numpy()
+        num_nodes = self.num_nodes
+
+        labels_prev = np.arange(num_nodes)
+        num_clusters_prev = num_nodes
+        for level, threshold in enumerate(thresholds, start=1):
+            merged = merge_score <= threshold
+            adj = scipy.sparse.coo_matrix(
+                (np.ones(merged.sum()), (u[merged], v[merged])),
+                shape=(num_nodes, num_nodes))
+            num_clusters, labels = scipy.sparse.csgraph.connected_components(
+                adj, directed=False)
+
+            assignment = np.zeros(num_clusters_prev, dtype=np.int64)
+            assignment[labels_prev] = labels
+
+            cu, cv = labels[u], labels[v]
+            cross = cu != cv
+            # unique pairs of clusters, lower cluster first
+            keys = np.unique(
+                np.minimum(cu[cross], cv[cross]) * num_clusters + np.maximum(cu[cross], cv[cross]))
+            coarse_edges = np.stack([keys // num_clusters, keys % num_clusters])
+            coarse_edges = np.concatenate(
+                [coarse_edges, np.flip(coarse_edges, axis=0)], axis=1)
+
+            self[f'assignment_{level}'] = torch.tensor(assignment, dtype=torch.long)
+            self[f'coarse_edge_index_{level}'] = torch.tensor(
+                coarse_edges.astype(np.int64), dtype=torch.long)
+            self[f'num_clusters_{level}'] = num_clusters
+            logger.debug(
+                f'coarsening level {level}: {num_clusters} clusters, {coarse_edges.shape[1]} edges')
+
+            labels_prev = labels
+            num_clusters_prev = num_clusters
+
+        logger.debug(f'add coarsening in {now() - start} s')
+
     def assert_graph(self):
         """
-        check whether bi-directed edges are next to each other in edge_index
+        check whether bi-directed edges are next to each other in edge_index,
+        or that there is one column per target for undirected storage
         """
         start = now()
-        uv = self.edge_index[:, 0::2]
-        vu = torch.flip(self.edge_index, dims=[0])[:, 1::2]
+        if self.config.undirected_edges:
+            assert self.edge_index.size(1) == self.y.size(0)
+        else:
+            uv = self.edge_index[:, 0::2]
+            vu = torch.flip(self.edge_index, dims=[0])[:, 1::2]
 
-        assert torch.equal(uv, vu)
+            assert torch.equal(uv, vu)
         # remove config property so Data object can be saved with torch
         del self.config
         logger.debug(f'assert graph in {now() - start} s')
@@ -194,16 +299,23 @@ class HemibrainGraph(Data, ABC):
             )
             logger.debug(f'add self loops in {now() - start} s')
 
-        edge_index_undir = edge_index_undir.transpose()
-        edge_index_dir = np.repeat(edge_index_undir, 2, axis=0)
-        edge_index_dir[1::2, :] = np.flip(edge_index_dir[1::2, :], axis=1)
-        edge_index = torch.tensor(edge_index_dir.astype(
-            np.int64).transpose(), dtype=torch.long)
-
         edge_attr_undir = np.expand_dims(
             edge_attr_undir, axis=1)
-        edge_attr_dir = np.repeat(edge_attr_undir, 2, axis=0)
-        edge_attr = torch.tensor(edge_attr_dir, dtype=torch.float)
+
+        if self.config.undirected_edges:
+            # one column per RAG edge, models expand both directions
+            edge_index = torch.tensor(
+                edge_index_undir.astype(np.int64), dtype=torch.long)
+            edge_attr = torch.tensor(edge_attr_undir, dtype=torch.float)
+        else:
+            edge_index_undir = edge_index_undir.transpose()
+            edge_index_dir = np.repeat(edge_index_undir, 2, axis=0)
+            edge_index_dir[1::2, :] = np.flip(edge_index_dir[1::2, :], axis=1)
+            edge_index = torch.tensor(edge_index_dir.astype(
+                np.int64).transpose(), dtype=torch.long)
+
+            edge_attr_dir = np.repeat(edge_attr_undir, 2, axis=0)
+            edge_attr = torch.tensor(edge_attr_dir, dtype=torch.float)
 
         pos = torch.transpose(
             input=torch.tensor(
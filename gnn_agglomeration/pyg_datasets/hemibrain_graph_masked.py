@@ -6,7 +6,7 @@ import time
 from time import time as now
 
 from .hemibrain_graph import HemibrainGraph
-from gnn_agglomeration.utils import TooManyEdgesException
+from gnn_agglomeration.utils import TooManyEdgesException, num_directed_edges
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -24,7 +24,9 @@ class HemibrainGraphMasked(HemibrainGraph):
             block_offset,
             block_shape,
             inner_block_offset,
-            inner_block_shape):
+            inner_block_shape,
+            rag_excerpt=None,
+            inner_node_ids=None):
 
         # TODO remove duplicate code
         logger.debug(
@@ -38,8 +40,11 @@ class HemibrainGraphMasked(HemibrainGraph):
         start_read_and_process = now()
         start = time.time()
         roi = daisy.Roi(list(block_offset), list(block_shape))
-        node_attrs = graph_provider.read_nodes(roi=roi)
-        edge_attrs = graph_provider.read_edges(roi=roi, nodes=node_attrs)
+        if rag_excerpt is None:
+            node_attrs = graph_provider.read_nodes(roi=roi)
+            edge_attrs = graph_provider.read_edges(roi=roi, nodes=node_attrs)
+        else:
+            node_attrs, edge_attrs = rag_excerpt
         logger.debug(f'read block in {time.time() - start} s')
 
         if len(node_attrs) == 0:
@@ -58,31 +63,43 @@ class HemibrainGraphMasked(HemibrainGraph):
             node_attrs, edge_attrs, embeddings, all_nodes)
         logger.debug(f'parse rag excerpt in {time.time() - start} s')
 
-        if self.edge_index.size(1) > self.config.max_edges:
+        num_edges = num_directed_edges(self, self.config)
+        if num_edges > self.config.max_edges:
             raise TooManyEdgesException(
-                f'extracted graph has {self.edge_index.size(1)} edges, but the limit is set to {self.config.max_edges}')
+                f'extracted graph has {num_edges} edges, but the limit is set to {self.config.max_edges}')
 
         start = time.time()
         self.mask, self.roi_mask = self.mask_target_edges(
             inner_roi=daisy.Roi(
                 list(inner_block_offset),
                 list(inner_block_shape)),
-            mask=mask)
+            mask=mask,
+            inner_node_ids=inner_node_ids)
 
         self.mask = self.class_balance_mask(y=self.y, mask=self.mask)
         self.nodes_mask = self.mask_nodes(
             pos=self.pos,
             inner_block_offset=inner_block_offset,
-            inner_block_shape=inner_block_shape
+            inner_block_shape=inner_block_shape,
+            inner_node_ids=inner_node_ids
         )
 
         logger.debug(f'mask target edges in {time.time() - start} s')
 
         logger.debug(f'read_and_process in {now() - start_read_and_process} s')
 
+        if len(self.config.coarsening_thresholds) > 0:
+            self.add_coarsening(self.config.coarsening_thresholds)
+
+        if self.config.csr_aggregation:
+            self.add_csr_structure()
+
         self.assert_graph()
 
-    def mask_nodes(self, pos, inner_block_offset, inner_block_shape):
+    def mask_nodes(self, pos, inner_block_offset, inner_block_shape, inner_node_ids=None):
+        if inner_node_ids is not None:
+            return torch.tensor(np.isin(self.node_ids.numpy(), inner_node_ids)).byte()
+
         lower_limit = np.array(inner_block_offset, dtype=np.int64)
         upper_limit = lower_limit + np.array(inner_block_shape, dtype=np.int64)
         pos = pos.numpy().astype(np.int64)
@@ -90,23 +107,37 @@ class HemibrainGraphMasked(HemibrainGraph):
                    np.all(pos < upper_limit, axis=1)
         return torch.tensor(nodes_in).byte()
 
-    def mask_target_edges(self, inner_roi, mask):
+    def mask_target_edges(self, inner_roi, mask, inner_node_ids=None):
+        """
+        Args:
+            inner_roi (daisy.Roi): inner block
+            mask (torch.Tensor): labeled edges
+            inner_node_ids (numpy.array or None): if given, the inner nodes are
+                defined by their ids instead of their position in inner_roi
+        """
         logger.debug('masking target edges, zero for all context edges')
-        lower_limit = torch.tensor(inner_roi.get_offset(), dtype=torch.long)
-        upper_limit = lower_limit + \
-                      torch.tensor(inner_roi.get_shape(), dtype=torch.long)
-
-        # Careful, we might be off by 1 here due to casting back and forth between long and float
-        pos_long = self.pos.long()
-        nodes_in = torch.all(
-            pos_long >= lower_limit,
-            dim=1) & torch.all(
-            pos_long < upper_limit,
-            dim=1)
+        if inner_node_ids is not None:
+            nodes_in = torch.tensor(
+                np.isin(self.node_ids.numpy(), inner_node_ids), dtype=torch.uint8)
+        else:
+            lower_limit = torch.tensor(inner_roi.get_offset(), dtype=torch.long)
+            upper_limit = lower_limit + \
+                          torch.tensor(inner_roi.get_shape(), dtype=torch.long)
+
+            # Careful, we might be off by 1 here due to casting back and forth between long and float
+            pos_long = self.pos.long()
+            nodes_in = torch.all(
+                pos_long >= lower_limit,
+                dim=1) & torch.all(
+                pos_long < upper_limit,
+                dim=1)
 
         # only check u (the first node, first direction), as each edge should be
         # unmasked exactly once if we go blockwise
-        edge_index_u = self.edge_index[0, 0::2]
+        if self.config.undirected_edges:
+            edge_index_u = self.edge_index[0]
+        else:
+            edge_index_u = self.edge_index[0, 0::2]
         inner_mask = nodes_in[edge_index_u]
 
         # inner mask is needed for inference
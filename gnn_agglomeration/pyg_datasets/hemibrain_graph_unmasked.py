@@ -3,7 +3,7 @@ import logging
 import daisy
 
 from .hemibrain_graph import HemibrainGraph
-from gnn_agglomeration.utils import TooManyEdgesException
+from gnn_agglomeration.utils import TooManyEdgesException, num_directed_edges
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,7 +21,9 @@ class HemibrainGraphUnmasked(HemibrainGraph):
             block_offset,
             block_shape,
             inner_block_offset,
-            inner_block_shape):
+            inner_block_shape,
+            rag_excerpt=None,
+            inner_node_ids=None):
 
         assert self.config is not None
 
@@ -32,8 +34,11 @@ class HemibrainGraphUnmasked(HemibrainGraph):
         )
 
         roi = daisy.Roi(list(block_offset), list(block_shape))
-        node_attrs = graph_provider.read_nodes(roi=roi)
-        edge_attrs = graph_provider.read_edges(roi=roi, nodes=node_attrs)
+        if rag_excerpt is None:
+            node_attrs = graph_provider.read_nodes(roi=roi)
+            edge_attrs = graph_provider.read_edges(roi=roi, nodes=node_attrs)
+        else:
+            node_attrs, edge_attrs = rag_excerpt
 
         if len(node_attrs) == 0:
             raise ValueError('No nodes found in roi %s' % roi)
@@ -59,11 +64,18 @@ class HemibrainGraphUnmasked(HemibrainGraph):
             self.y = self.parse_rag_excerpt(
                 node_attrs, edge_attrs, embeddings, all_nodes)
 
-        if self.edge_index.size(1) > self.config.max_edges:
+        num_edges = num_directed_edges(self, self.config)
+        if num_edges > self.config.max_edges:
             raise ValueError(
-                f'extracted graph has {self.edge_index.size(1)} edges, but the limit is set to {self.config.max_edges}')
+                f'extracted graph has {num_edges} edges, but the limit is set to {self.config.max_edges}')
 
         self.mask = self.class_balance_mask(y=self.y, mask=self.mask)
         self.roi_mask = torch.ones_like(self.mask, dtype=torch.uint8)
 
+        if len(self.config.coarsening_thresholds) > 0:
+            self.add_coarsening(self.config.coarsening_thresholds)
+
+        if self.config.csr_aggregation:
+            self.add_csr_structure()
+
         self.assert_graph()
@@ -1,8 +1,14 @@
-from .count_neighbors_graph import CountNeighborsGraph  # noqa
-from .count_neighbors_dataset import CountNeighborsDataset  # noqa
+from gnn_agglomeration.registry import lazy_attributes
 
-from .diameter_graph import DiameterGraph  # noqa
-from .diameter_dataset import DiameterDataset  # noqa
+__getattr__, __dir__, __all__ = lazy_attributes(
+    __name__,
+    {
+        'CountNeighborsGraph': '.count_neighbors_graph',
+        'CountNeighborsDataset': '.count_neighbors_dataset',
 
-from .iterative_graph import IterativeGraph  # noqa
-from .iterative_dataset import IterativeDataset  # noqa
\ No newline at end of file
+        'DiameterGraph': '.diameter_graph',
+        'DiameterDataset': '.diameter_dataset',
+
+        'IterativeGraph': '.iterative_graph',
+        'IterativeDataset': '.iterative_dataset',
+    })
@@ -0,0 +1,91 @@
+import importlib
+import sys
+
+# packages that define the classes a config can refer to by name, see resolve
+PACKAGES = {
+    'model': ['gnn_agglomeration.nn.models'],
+    'model_type': ['gnn_agglomeration.nn.models.model_type'],
+    'dataset': ['gnn_agglomeration.pyg_datasets', 'gnn_agglomeration.pyg_datasets.toy_datasets'],
+    'graph': ['gnn_agglomeration.pyg_datasets'],
+    'data_augmentation': ['gnn_agglomeration.data_transforms'],
+}
+
+
+def lazy_attributes(package, attributes, submodules=()):
+    """
+    Module-level __getattr__ and __dir__ for a package, see PEP 562, such that
+    importing the package does not import its modules. The module that
+    defines an attribute is imported on first access.
+
+    Args:
+        package (str): __name__ of the package
+        attributes (dict): attribute name -> module relative to the package
+        submodules (iterable of str): subpackages that are imported on first access
+
+    Returns:
+        (function, function, list): __getattr__, __dir__, __all__
+    """
+    submodules = list(submodules)
+
+    def __getattr__(name):
+        if name in attributes:
+            value = getattr(importlib.import_module(attributes[name], package), name)
+        elif name in submodules:
+            value = importlib.import_module(f'.{name}', package)
+        else:
+            raise AttributeError(f'module {package} has no attribute {name}')
+        # later accesses do not go through __getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(sys.modules[package].__dict__) | set(attributes) | set(submodules))
+
+    return __getattr__, __dir__, list(attributes)
+
+
+def choices(kind):
+    """
+    Returns:
+        list of str: names that resolve for kind
+    """
+    return [name for p in PACKAGES[kind] for name in importlib.import_module(p).__all__]
+
+
+def resolve(kind, name):
+    """
+    The class called name, e.g. config.model, importing only the module that defines it
+
+    Args:
+        kind (str): one of PACKAGES
+        name (str):
+
+    Returns:
+        type:
+    """
+    for p in PACKAGES[kind]:
+        package = importlib.import_module(p)
+        if name in package.__all__:
+            return getattr(package, name)
+    raise NotImplementedError(
+        f'{kind} {name} is not implemented, choose from {choices(kind)}')
+
+
+def model(name):
+    return resolve('model', name)
+
+
+def model_type(name):
+    return resolve('model_type', name)
+
+
+def dataset(name):
+    return resolve('dataset', name)
+
+
+def graph(name):
+    return resolve('graph', name)
+
+
+def data_augmentation(name):
+    return resolve('data_augmentation', name)
@@ -0,0 +1,212 @@
+import torch
+from torch_geometric.data import Batch
+import numpy as np
+import multiprocessing
+import queue
+import random
+import traceback
+import logging
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# offsets of the arrays in a slot
+ALIGNMENT = 64
+
+
+def worker_loop(worker_id, base_seed, dataset, buf, slot_bytes, tasks, free_slots, ready):
+    """
+    Collates the batches of the received indices and writes their tensors
+    into a free slot of the ring buffer
+    """
+    # forked workers inherit the random state of the trainer. Seed all generators
+    # per worker like torch's DataLoader, the augmentations use random and torch
+    seed = base_seed + worker_id
+    random.seed(seed)
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2**32)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        epoch, indices = task
+        try:
+            batch = Batch.from_data_list([dataset[i] for i in indices])
+
+            tensors = []
+            other = {}
+            offset = 0
+            for key, value in batch:
+                if torch.is_tensor(value):
+                    array = value.detach().cpu().numpy()
+                    tensors.append((key, array))
+                    offset += -offset % ALIGNMENT + array.nbytes
+                else:
+                    other[key] = value
+
+            if offset > slot_bytes:
+                # too large for a slot, pickled through the queue instead
+                ready.put((epoch, None, batch))
+                continue
+
+            slot = free_slots.get()
+            header = []
+            offset = 0
+            for key, array in tensors:
+                offset += -offset % ALIGNMENT
+                dst = np.ndarray(
+                    array.shape, dtype=array.dtype, buffer=buf, offset=slot * slot_bytes + offset)
+                dst[...] = array
+                header.append((key, array.dtype.str, array.shape, offset))
+                offset += array.nbytes
+            ready.put((epoch, slot, (header, other)))
+        except Exception:
+            ready.put((epoch, None, RuntimeError(traceback.format_exc())))
+
+
+class SharedMemoryLoader:
+    """
+    Loads collated batches through a ring buffer of num_slots preallocated
+    slots in one shared memory segment, instead of pickling each batch
+    through torch multiprocessing. The worker processes live as long as the
+    loader and receive the indices of each epoch from the sampler. A worker
+    writes the tensors of a collated batch into a free slot, and the trainer
+    wraps them as tensors without a copy.
+
+    A batch is a view into its slot, which is handed back to the workers when
+    the next batch is requested. Move it to a device or clone it to keep it
+    longer. Batches larger than a slot are pickled through the queue.
+
+    The segment is unlinked by close, which is registered to run at exit.
+    If the trainer is killed, the resource tracker of multiprocessing unlinks
+    it, such that no files are left in /dev/shm.
+
+    Args:
+        dataset (torch.utils.data.Dataset):
+        sampler (torch.utils.data.Sampler):
+        batch_size (int):
+        num_workers (int):
+        num_slots (int): at least num_workers + 1, such that all workers can fill a slot while the trainer holds one
+        slot_bytes (int):
+    """
+
+    def __init__(self, dataset, sampler, batch_size, num_workers, num_slots, slot_bytes):
+        assert num_workers > 0
+        assert num_slots > num_workers, 'need more slots than workers'
+        self.dataset = dataset
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.slot_bytes = slot_bytes
+        self.epoch = 0
+        self.held_slot = None
+        self.num_oversized = 0
+
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_bytes)
+        logger.info(
+            f'shared memory ring buffer {self.shm.name}: {num_slots} slots of {slot_bytes / 2**20:.0f} MB')
+
+        # the workers inherit the mapping of the segment
+        ctx = multiprocessing.get_context('fork')
+        self.tasks = ctx.Queue()
+        self.free_slots = ctx.Queue()
+        self.ready = ctx.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+        # drawn from the torch generator of the trainer, such that runs with torch.manual_seed repeat
+        base_seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        self.workers = []
+        for worker_id in range(num_workers):
+            w = ctx.Process(
+                target=worker_loop,
+                args=(worker_id, base_seed, dataset, self.shm.buf, slot_bytes,
+                      self.tasks, self.free_slots, self.ready),
+                daemon=True)
+            w.start()
+            self.workers.append(w)
+
+    def __len__(self):
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        # results of an epoch that was not iterated to the end are dropped
+        self.epoch += 1
+        indices = list(self.sampler)
+        num_batches = 0
+        for i in range(0, len(indices), self.batch_size):
+            self.tasks.put((self.epoch, indices[i:i + self.batch_size]))
+            num_batches += 1
+
+        try:
+            for _ in range(num_batches):
+                self.release()
+                yield self.next_batch()
+        finally:
+            self.release()
+
+    def next_batch(self):
+        while True:
+            epoch, slot, content = self.get_ready()
+            if epoch != self.epoch:
+                if slot is not None:
+                    self.free_slots.put(slot)
+                continue
+
+            if isinstance(content, Exception):
+                raise content
+            if slot is None:
+                if self.num_oversized == 0:
+                    logger.warning(
+                        f'batch exceeds the slots of {self.slot_bytes / 2**20:.0f} MB, '
+                        f'it is pickled instead')
+                self.num_oversized += 1
+                return content
+
+            self.held_slot = slot
+            return self.view(slot, *content)
+
+    def get_ready(self):
+        while True:
+            try:
+                return self.ready.get(timeout=5.0)
+            except queue.Empty:
+                dead = [w.pid for w in self.workers if not w.is_alive()]
+                if len(dead) > 0:
+                    raise RuntimeError(f'shared memory loader workers {dead} exited unexpectedly')
+
+    def view(self, slot, header, other):
+        batch = Batch()
+        for key, dtype, shape, offset in header:
+            array = np.ndarray(
+                shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=slot * self.slot_bytes + offset)
+            batch[key] = torch.from_numpy(array)
+        for key, value in other.items():
+            batch[key] = value
+        return batch
+
+    def release(self):
+        if self.held_slot is not None:
+            self.free_slots.put(self.held_slot)
+            self.held_slot = None
+
+    def close(self):
+        """
+        stop the workers and unlink the shared memory segment
+        """
+        if self.shm is None:
+            return
+        for _ in self.workers:
+            self.tasks.put(None)
+        for w in self.workers:
+            w.join(timeout=5.0)
+            if w.is_alive():
+                w.terminate()
+        self.workers = []
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # batches still reference the mapping, it is released with them
+            pass
+        self.shm = None
@@ -95,5 +95,157 @@ def output_similarities_split(writer, iteration, out0, out1, labels):
         )
 
 
+def csr_structure(edge_index, num_nodes):
+    """
+    destination-sorted permutation of the edges and in-degree per node.
+    In-degrees are stored instead of the CSR row pointer, as they can be
+    concatenated when graphs are collated into a batch.
+
+    Args:
+        edge_index (torch.Tensor): of shape (2, E)
+        num_nodes (int):
+
+    Returns:
+        (torch.Tensor, torch.Tensor): permutation of shape (E,), in-degree of shape (num_nodes,)
+    """
+    dst = edge_index[1].cpu().numpy()
+    # stable, such that edges with the same destination keep their order
+    perm = np.argsort(dst, kind='stable')
+    in_degree = np.bincount(dst, minlength=num_nodes)
+    return torch.tensor(perm, dtype=torch.long, device=edge_index.device), \
+        torch.tensor(in_degree, dtype=torch.long, device=edge_index.device)
+
+
+def degree_to_rowptr(in_degree):
+    """
+    CSR row pointer of shape (N + 1,) from the in-degree per node
+    """
+    return torch.cat([in_degree.new_zeros(1), torch.cumsum(in_degree, dim=0)])
+
+
+def expand_undirected_edge_index(edge_index):
+    """
+    duplicate each undirected edge (u, v) into the directed pair (u, v), (v, u),
+    with both directions next to each other
+
+    Args:
+        edge_index (torch.Tensor): of shape (2, E)
+
+    Returns:
+        torch.Tensor: of shape (2, 2 * E)
+    """
+    return torch.stack(
+        [edge_index, torch.flip(edge_index, dims=[0])], dim=2).view(2, -1)
+
+
+def expand_undirected_edge_attr(edge_attr, reversed_dims):
+    """
+    duplicate the attributes of each undirected edge for both directions.
+    The last reversed_dims attributes are normalized cartesian pseudo
+    coordinates in [0, 1], see torch_geometric.transforms.Cartesian, which
+    are mirrored for the reverse direction.
+
+    Args:
+        edge_attr (torch.Tensor): of shape (E, D)
+        reversed_dims (int): number of trailing attributes that depend on the direction
+
+    Returns:
+        torch.Tensor: of shape (2 * E, D)
+    """
+    edge_attr = edge_attr.unsqueeze(-1) if edge_attr.dim() == 1 else edge_attr
+    if reversed_dims > 0:
+        reverse_attr = torch.cat(
+            [edge_attr[:, :-reversed_dims], 1 - edge_attr[:, -reversed_dims:]], dim=-1)
+    else:
+        reverse_attr = edge_attr
+    return torch.stack([edge_attr, reverse_attr], dim=1).view(-1, edge_attr.size(-1))
+
+
+def reversed_edge_attr_dims(config):
+    """
+    number of trailing edge attributes that change with the direction of an edge,
+    for the pseudo coordinates of config.data_transform
+    """
+    if config.data_transform == 'Cartesian':
+        return config.euclidian_dimensionality
+    elif config.data_transform == 'Distance':
+        return 0
+    else:
+        raise NotImplementedError(
+            f'undirected edges are not supported for data_transform {config.data_transform}')
+
+
+def num_directed_edges(data, config):
+    """
+    number of directed edges the models operate on, for graphs in either storage mode
+    """
+    if config.undirected_edges:
+        return 2 * data.num_edges
+    return data.num_edges
+
+
+def merge_block_predictions(edges, scores):
+    """
+    Merge the predictions of all blocks of a test pass into one score per
+    edge. Edges predicted in several blocks get the maximum score, which does
+    not depend on the order of the blocks or of the processes that predicted
+    them.
+
+    The endpoints are relabeled to consecutive indices and packed into one
+    uint64 key per edge, lower index first. The keys are sorted and the
+    maximum per key is reduced in one pass with np.maximum.reduceat.
+
+    Args:
+        edges (list of numpy.array): node ids (u, v) per block without self-loops, of shape (E_i, 2)
+        scores (list of numpy.array): one-dimensional outputs per block, of shape (E_i,)
+
+    Returns:
+        (numpy.array, numpy.array, int): unique edges with lower id first, their scores,
+            number of duplicate predictions
+    """
+    if sum(len(e) for e in edges) == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros((0,), dtype=np.float32), 0
+    edges = np.concatenate(edges, axis=0).astype(np.int64)
+    scores = np.concatenate(scores, axis=0)
+
+    # consecutive indices, such that two of them fit into 64 bits
+    node_ids, idx = np.unique(edges, return_inverse=True)
+    idx = idx.reshape(edges.shape).astype(np.uint64)
+    num_nodes = np.uint64(len(node_ids))
+    keys = np.minimum(idx[:, 0], idx[:, 1]) * num_nodes + np.maximum(idx[:, 0], idx[:, 1])
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+    merged = np.maximum.reduceat(scores[order], starts)
+
+    unique_keys = keys[starts]
+    unique_edges = np.stack([
+        node_ids[(unique_keys // num_nodes).astype(np.int64)],
+        node_ids[(unique_keys % num_nodes).astype(np.int64)]], axis=1)
+    return unique_edges, merged, len(keys) - len(unique_keys)
+
+
+def merge_block_embeddings(node_ids, embeddings):
+    """
+    One embedding per node from the blocks of a test pass. The first block,
+    in the given order, that contains a node provides its embedding.
+
+    Args:
+        node_ids (list of numpy.array): node ids per block, of shape (N_i,)
+        embeddings (list of numpy.array): embeddings per block, of shape (N_i, D)
+
+    Returns:
+        (numpy.array, numpy.array, int): unique node ids, their embeddings, number of duplicates
+    """
+    if sum(len(n) for n in node_ids) == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0, 0), dtype=np.float32), 0
+    node_ids = np.concatenate(node_ids, axis=0).astype(np.int64)
+    embeddings = np.concatenate(embeddings, axis=0)
+    # index of the first occurrence of each id
+    unique_ids, first = np.unique(node_ids, return_index=True)
+    return unique_ids, embeddings[first].astype(np.float32), len(node_ids) - len(unique_ids)
+
+
 class TooManyEdgesException(Exception):
     pass
@@ -1,19 +1,10 @@
-import torch  # noqa
-torch.multiprocessing.set_sharing_strategy('file_system')
-# with cudnn enabled, validation with fixed params breaks
-# cudnn speedups for PyG seem to be negligible anyway
-torch.backends.cudnn.enabled = False
-
 import sacred  # noqa
 from sacred.observers import MongoObserver, TelegramObserver  # noqa
-from sacred.stflow import LogFileWriter  # noqa
 import logging  # noqa
 
 import os  # noqa
 import os.path as osp  # noqa
 import shutil  # noqa
-from torch_geometric.data import DataLoader  # noqa
-from tensorboardX import SummaryWriter  # noqa
 
 import sys  # noqa
 import atexit  # noqa
@@ -22,15 +13,8 @@ import argparse  # noqa
 import json  # noqa
 import time  # noqa
 from time import time as now  # noqa
-import numpy as np  # noqa
 import datetime  # noqa
 import pytz  # noqa
-from funlib.segment.arrays import replace_values  # noqa
-
-from gnn_agglomeration import utils  # noqa
-from gnn_agglomeration.pyg_datasets import *  # noqa
-from gnn_agglomeration.nn.models import *  # noqa
-
 
 from gnn_agglomeration.experiment import ex  # noqa
 from gnn_agglomeration.config import Config  # noqa
@@ -42,8 +26,23 @@ logging.basicConfig(level=logging.INFO)
 
 @ex.main
 @ex.capture
-@LogFileWriter(ex)
 def main(_config, _run, _log):
+    # torch and the training modules are only imported for a run, not to parse the command line.
+    # Modules of optional features are imported where they are used
+    import torch
+    from torch_geometric.data import DataLoader
+    import numpy as np
+    from gnn_agglomeration import utils
+    from gnn_agglomeration import registry
+    from gnn_agglomeration import distributed
+    from gnn_agglomeration.metrics import MetricAccumulator, ConfusionMatrixAccumulator, ScoreHistogramAccumulator
+    from gnn_agglomeration.artifact_writer import ArtifactWriter
+
+    torch.multiprocessing.set_sharing_strategy('file_system')
+    # with cudnn enabled, validation with fixed params breaks
+    # cudnn speedups for PyG seem to be negligible anyway
+    torch.backends.cudnn.enabled = False
+
     # Check for a comment, if none is given raise error
     if _run.meta_info['options']['--comment'] is None:
         raise ValueError('You need to specify a comment with -c, --comment')
@@ -51,6 +50,13 @@ def main(_config, _run, _log):
     config = argparse.Namespace(**_config)
     _log.info('Logging to {}'.format(config.run_abs_path))
 
+    # in distributed training, only rank 0 writes summaries, outputs and checkpoints
+    main_process = distributed.is_main_process()
+    # the per-batch metrics are reduced over all ranks, so decide before disabling summaries on the other ranks
+    summarize_batches = config.write_summary and config.summary_per_batch
+    if not main_process:
+        config.write_summary = False
+
     # -----------------------------------------------
     # ---------------- CREATE SETUP -----------------
     # -----------------------------------------------
@@ -63,7 +69,7 @@ def main(_config, _run, _log):
     summary_dir = os.path.join(config.run_abs_path, config.summary_dir)
     model_dir = os.path.join(config.run_abs_path, config.model_dir)
     outputs_dir = os.path.join(config.run_abs_path, config.outputs_dir)
-    if not config.load_model:
+    if main_process and not config.load_model:
         if os.path.isdir(summary_dir):
             shutil.rmtree(summary_dir)
         if os.path.isdir(model_dir):
@@ -76,73 +82,86 @@ def main(_config, _run, _log):
         os.makedirs(model_dir)
         os.makedirs(os.path.join(outputs_dir, 'train'))
         os.makedirs(os.path.join(outputs_dir, 'val'))
+    distributed.barrier()
 
-    # Pass the path of tensorboardX summaries to sacred
+    # Pass the path of tensorboardX summaries to sacred, as sacred.stflow.LogFileWriter would for tensorflow
     if config.write_summary:
         _run.info["tensorflow"] = dict()
         _run.info["tensorflow"]["logdirs"] = [os.path.join(
             config.run_abs_path, config.summary_dir)]
 
     # set up the summary writer for tensorboardX
-    train_writer = SummaryWriter(os.path.join(
-        config.run_abs_path, 'summary', 'training'))
-    val_writer = SummaryWriter(os.path.join(
-        config.run_abs_path, 'summary', 'validation'))
+    if main_process:
+        # tensorboardX is slow to import, only needed for training
+        from tensorboardX import SummaryWriter
+        train_writer = SummaryWriter(os.path.join(
+            config.run_abs_path, 'summary', 'training'))
+        val_writer = SummaryWriter(os.path.join(
+            config.run_abs_path, 'summary', 'validation'))
+    else:
+        train_writer = distributed.NullSummaryWriter()
+        val_writer = distributed.NullSummaryWriter()
+
+    if config.undirected_edges and config.model not in ['OurConvModel', 'HierarchicalOurConvModel']:
+        # the other models would run message passing in one direction only
+        raise NotImplementedError(
+            f'undirected_edges is not supported for {config.model}')
 
     start_load_datasets = now()
-    # create and load datasets
-    if config.dataset_type_train.startswith('HemibrainDataset'):
-        _log.info('Preparing training dataset ...')
-        train_dataset = globals()[config.dataset_type_train](
-            root=config.dataset_abs_path_train,
-            config=config,
-            db_name=config.db_name_train,
-            embeddings_collection=config.embeddings_collection_train,
-            roi_offset=config.train_roi_offset,
-            roi_shape=config.train_roi_shape,
-            length=config.samples,
-            save_processed=config.save_processed_train
-        )
+    # create and load datasets, on rank 0 first, which processes and caches them
+    with distributed.main_process_first():
+        if config.dataset_type_train.startswith('HemibrainDataset'):
+            _log.info('Preparing training dataset ...')
+            train_dataset = registry.dataset(config.dataset_type_train)(
+                root=config.dataset_abs_path_train,
+                config=config,
+                db_name=config.db_name_train,
+                embeddings_collection=config.embeddings_collection_train,
+                roi_offset=config.train_roi_offset,
+                roi_shape=config.train_roi_shape,
+                length=config.samples,
+                save_processed=config.save_processed_train
+            )
 
-        _log.info('Preparing validation dataset ...')
-        validation_dataset = globals()[config.dataset_type_val](
-            root=config.dataset_abs_path_val,
-            config=config,
-            db_name=config.db_name_val,
-            embeddings_collection=config.embeddings_collection_val,
-            roi_offset=config.val_roi_offset,
-            roi_shape=config.val_roi_shape,
-            save_processed=config.save_processed_val
-        )
-        if config.final_test_pass:
-            _log.info('Preparing test dataset ...')
-            test_dataset = globals()[config.dataset_type_test](
-                root=config.dataset_abs_path_test,
+            _log.info('Preparing validation dataset ...')
+            validation_dataset = registry.dataset(config.dataset_type_val)(
+                root=config.dataset_abs_path_val,
                 config=config,
-                db_name=config.db_name_test,
-                embeddings_collection=config.embeddings_collection_test,
-                roi_offset=config.test_roi_offset,
-                roi_shape=config.test_roi_shape,
-                save_processed=config.save_processed_test
+                db_name=config.db_name_val,
+                embeddings_collection=config.embeddings_collection_val,
+                roi_offset=config.val_roi_offset,
+                roi_shape=config.val_roi_shape,
+                save_processed=config.save_processed_val
             )
+            if config.final_test_pass:
+                _log.info('Preparing test dataset ...')
+                test_dataset = registry.dataset(config.dataset_type_test)(
+                    root=config.dataset_abs_path_test,
+                    config=config,
+                    db_name=config.db_name_test,
+                    embeddings_collection=config.embeddings_collection_test,
+                    roi_offset=config.test_roi_offset,
+                    roi_shape=config.test_roi_shape,
+                    save_processed=config.save_processed_test
+                )
 
-    else:
-        dataset = globals()[config.dataset_type_train](
-            root=config.dataset_abs_path_train, config=config)
-        # split into train and test
-        split_train_idx = int(
-            config.samples * (1 - config.test_split - config.validation_split))
-        split_validation_idx = int(config.samples * (1 - config.test_split))
-
-        train_dataset = dataset[:split_train_idx]
-        validation_dataset = dataset[split_train_idx:split_validation_idx]
-        test_dataset = dataset[split_validation_idx:]
-
-        # new feature: if model is loaded, use the same train val test split.
-        # shuffle can return the permutation of the dataset, which can then be used to permute the same way
-        # dataset, perm = dataset.shuffle(return_perm=True)
-        # when loading a model:
-        # dataset = dataset.__indexing__(permutation)
+        else:
+            dataset = registry.dataset(config.dataset_type_train)(
+                root=config.dataset_abs_path_train, config=config)
+            # split into train and test
+            split_train_idx = int(
+                config.samples * (1 - config.test_split - config.validation_split))
+            split_validation_idx = int(config.samples * (1 - config.test_split))
+
+            train_dataset = dataset[:split_train_idx]
+            validation_dataset = dataset[split_train_idx:split_validation_idx]
+            test_dataset = dataset[split_validation_idx:]
+
+            # new feature: if model is loaded, use the same train val test split.
+            # shuffle can return the permutation of the dataset, which can then be used to permute the same way
+            # dataset, perm = dataset.shuffle(return_perm=True)
+            # when loading a model:
+            # dataset = dataset.__indexing__(permutation)
 
     train_dataset.update_config(config)
     assert train_dataset.__getitem__(0).edge_attr.size(
@@ -153,7 +172,8 @@ def main(_config, _run, _log):
 
     _log.info(f'Datasets ready in {now() - start_load_datasets} s')
 
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    device = torch.device(
+        f'cuda:{distributed.local_rank()}' if torch.cuda.is_available() else 'cpu')
     _log.debug(f'num of gpus available: {torch.cuda.device_count()}')
     if torch.cuda.is_available():
         _log.info(f'current device: {torch.cuda.current_device()}')
@@ -163,14 +183,18 @@ def main(_config, _run, _log):
     data_sampler_train = torch.utils.data.RandomSampler(
         data_source=train_dataset,
         replacement=True,
-        num_samples=config.epoch_samples_train
+        num_samples=distributed.shard_size(config.epoch_samples_train)
     )
     data_sampler_val = torch.utils.data.RandomSampler(
         data_source=validation_dataset,
         replacement=True,
-        num_samples=config.epoch_samples_val
+        num_samples=distributed.shard_size(config.epoch_samples_val)
     )
 
+    # the workers receive the indices of each epoch from the samplers.
+    # DataLoader only takes persistent_workers from torch 1.7 on, pass it only if enabled
+    persistent_workers = {'persistent_workers': True} \
+        if config.persistent_workers and config.num_workers > 0 else {}
     data_loader_train = DataLoader(
         train_dataset,
         batch_size=config.batch_size_train,
@@ -178,7 +202,8 @@ def main(_config, _run, _log):
         sampler=data_sampler_train,
         num_workers=config.num_workers,
         pin_memory=config.dataloader_pin_memory,
-        worker_init_fn=lambda idx: np.random.seed()
+        worker_init_fn=lambda idx: np.random.seed(),
+        **persistent_workers
     )
     data_loader_validation = DataLoader(
         validation_dataset,
@@ -186,12 +211,13 @@ def main(_config, _run, _log):
         shuffle=False,
         sampler=data_sampler_val,
         num_workers=config.num_workers,
-        worker_init_fn=lambda idx: np.random.seed()
+        worker_init_fn=lambda idx: np.random.seed(),
+        **persistent_workers
     )
 
     start_load_model = now()
     if not config.load_model:
-        model = globals()[config.model](
+        model = registry.model(config.model)(
             config=config,
             train_writer=train_writer,
             val_writer=val_writer,
@@ -206,17 +232,9 @@ def main(_config, _run, _log):
         _log.info(f'model_dir {config.model_dir}')
         load_model_dir = os.path.join(
             config.root_dir, config.run_abs_path, config.model_dir)
-        checkpoint_versions = [name for name in os.listdir(
-            load_model_dir) if name.endswith('.tar')]
-        if config.load_model_version == 'latest':
-            if 'final.tar' in checkpoint_versions:
-                checkpoint_to_load = 'final.tar'
-            else:
-                checkpoint_versions = sorted([
-                    x for x in checkpoint_versions if x.startswith('epoch')])
-                checkpoint_to_load = checkpoint_versions[-1]
-        else:
-            checkpoint_to_load = f'{config.load_model_version}.tar'
+        from gnn_agglomeration.nn.models.checkpoint import find_checkpoint
+        checkpoint_to_load = find_checkpoint(
+            load_model_dir, config.load_model_version)
 
         _log.info('Loading checkpoint {} ...'.format(
             os.path.join(load_model_dir, checkpoint_to_load)))
@@ -224,7 +242,7 @@ def main(_config, _run, _log):
             load_model_dir, checkpoint_to_load))
 
         # restore the checkpoint
-        model = globals()[config.model](
+        model = registry.model(config.model)(
             config=config,
             train_writer=train_writer,
             val_writer=val_writer,
@@ -237,20 +255,31 @@ def main(_config, _run, _log):
         # dicts
         model.to(device)
         model.load_state_dict(checkpoint['model_state_dict'])
-        model.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        try:
+            model.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        except ValueError as e:
+            # e.g. fine-tuning with frozen layers, which are not in the optimizer
+            _log.warning(f'optimizer state not loaded, starting from scratch: {e}')
 
     total_params = sum(p.numel()
                        for p in model.parameters() if p.requires_grad)
     _log.info(f'nr params: {total_params}')
     _run.log_scalar('nr_params', total_params, config.training_epochs)
+    # all ranks start from the parameters of rank 0
+    distributed.broadcast_module(model)
     _log.info(f'Model ready in {now() - start_load_model} s')
+
+    # outputs and checkpoints are written in the background
+    artifact_writer = ArtifactWriter(keep_checkpoints=config.keep_checkpoints)
+    model.artifact_writer = artifact_writer
     utils.log_max_memory_allocated(device)
 
     # save config to file and store in DB
     config_filepath = os.path.join(config.run_abs_path, 'config.json')
-    with open(config_filepath, 'w') as f:
-        json.dump(vars(config), f)
-    _run.add_artifact(filename=config_filepath)
+    if main_process:
+        with open(config_filepath, 'w') as f:
+            json.dump(vars(config), f)
+        _run.add_artifact(filename=config_filepath)
 
     def atexit_tasks(model):
 
@@ -273,6 +302,17 @@ def main(_config, _run, _log):
 
         model.eval()
         model.current_writer = None
+        model.artifact_writer = None
+        try:
+            artifact_writer.drain()
+        except Exception as e:
+            _log.error(f'writing artifacts failed: {e}')
+
+        if model.recorder is not None:
+            model.recorder.close()
+        # the test ROI is processed blockwise
+        if config.historical_embeddings:
+            model.history = None
 
         # final print routine
         train_dataset.print_summary()
@@ -283,24 +323,19 @@ def main(_config, _run, _log):
         if config.final_training_pass:
             # TODO seems to be buggy at the moment
             # train loss
-            final_loss_train = 0.0
-            final_metric_train = 0.0
-            final_nr_nodes_train = 0
+            metrics_final_train = MetricAccumulator(device)
 
             _log.info('final training pass ...')
             start = time.time()
             for data_ft in data_loader_train:
                 data_ft = data_ft.to(device)
                 out_ft = model(data_ft)
-                final_loss_train += model.loss(out_ft,
-                                               data_ft.y,
-                                               data_ft.mask).item() * data_ft.mask.sum().item()
-                final_metric_train += model.out_to_metric(
-                    out_ft, data_ft.y, data_ft.mask) * data_ft.mask.sum().item()
-                final_nr_nodes_train += data_ft.mask.sum().item()
+                metrics_final_train.add(
+                    model.loss(out_ft, data_ft.y, data_ft.mask),
+                    model.out_to_weighted_correct(out_ft, data_ft.y, data_ft.mask),
+                    data_ft.mask)
                 utils.log_max_memory_allocated(device)
-            final_loss_train /= final_nr_nodes_train
-            final_metric_train /= final_nr_nodes_train
+            final_loss_train, final_metric_train, _ = metrics_final_train.compute()
 
             _run.log_scalar(
                 'loss_train_final',
@@ -326,32 +361,55 @@ def main(_config, _run, _log):
         _log.info(
             f'Mean accuracy on train set: {final_metric_train:.3f}')
 
+        # the test pass runs all layers on the graphs from the DB
+        if config.frozen_layers > 0:
+            model.input_layer = 0
+
         if config.final_test_pass:
 
-            # test loss
+            # in distributed runs, each rank predicts its shard of the blocks
+            test_shard = distributed.shard_indices(len(test_dataset))
             data_loader_test = DataLoader(
-                test_dataset,
+                torch.utils.data.Subset(test_dataset, test_shard),
                 batch_size=config.batch_size_eval,
                 shuffle=False,
                 num_workers=config.num_workers,
                 worker_init_fn=lambda idx: np.random.seed()
             )
-            test_loss = 0.0
-            test_metric = 0.0
-            edge_weights_test = 0
-            test_predictions = []
-            test_targets = []
+            metrics_test = MetricAccumulator(device)
+            confusion_matrix_test = ConfusionMatrixAccumulator(
+                num_classes=config.classes, device=device)
+            # threshold curves are only defined for a binary problem
+            if config.classes == 2:
+                score_histograms_test = ScoreHistogramAccumulator(
+                    num_bins=config.score_histogram_bins, device=device)
+            else:
+                score_histograms_test = None
 
-            test_1d_outputs = dict()
-            test_embeddings = dict()
+            # per batch: index of its first block, node ids, outputs per edge or node
+            test_blocks = []
+
+            if config.confidence_gating:
+                if config.our_conv_output_node_embeddings:
+                    raise NotImplementedError(
+                        'confidence gating outputs edge scores, not node embeddings')
+                from gnn_agglomeration.inference import ConfidenceGate
+                confidence_gate = ConfidenceGate(model=model, config=config)
 
             _log.info('test pass ...')
             start_test_pass = time.time()
             for i, data_fe in enumerate(data_loader_test):
+                block_id = test_shard[i * config.batch_size_eval]
                 _log.info(
                     f'batch {i}: num nodes {data_fe.num_nodes}, num edges {data_fe.num_edges}')
                 data_fe = data_fe.to(device)
-                out_fe = model(data_fe)
+                if config.confidence_gating:
+                    # only one-dimensional outputs per edge, the loss is not defined
+                    out_fe = None
+                    out_1d_fe = confidence_gate(data_fe)
+                else:
+                    out_fe = model(data_fe)
+                    out_1d_fe = None
                 utils.log_max_memory_allocated(device)
 
                 if config.our_conv_output_node_embeddings:
@@ -361,102 +419,135 @@ def main(_config, _run, _log):
 
                     embeddings = out_fe.cpu().numpy()[nodes_mask]
                     ids = data_fe.node_ids.cpu().numpy()[nodes_mask]
-                    for k, v in zip(ids, embeddings):
-                        if k not in test_embeddings:
-                            test_embeddings[k] = v
-                        else:
-                            _log.warning(
-                                f'embedding for node {k} already exists')
+                    test_blocks.append((block_id, ids, embeddings))
                     continue
 
                 if config.write_to_db:
                     start = time.time()
-                    out_1d = model.out_to_one_dim(out_fe)
-                    # TODO this assumes again that every pairs of directed edges are next to each other
-                    # and we grab the original representation (u,v) from the DB? Does not seem to work
-                    edges = torch.transpose(data_fe.edge_index, 0, 1)[0::2]
-
-                    # mask outputs
-                    edges = edges[data_fe.roi_mask.byte()].cpu(
+                    if out_1d_fe is not None:
+                        out_1d = out_1d_fe
+                    else:
+                        out_1d = model.out_to_one_dim(out_fe)
+                    if config.undirected_edges:
+                        edges = torch.transpose(data_fe.edge_index, 0, 1)
+                    else:
+                        # TODO this assumes again that every pairs of directed edges are next to each other
+                        # and we grab the original representation (u,v) from the DB? Does not seem to work
+                        edges = torch.transpose(data_fe.edge_index, 0, 1)[0::2]
+
+                    # mask outputs and remove artificial self-loops
+                    # TODO this is super hacky, only applies for RAG
+                    keep = data_fe.roi_mask.byte() & (edges[:, 0] != edges[:, 1]).byte()
+                    # original node ids of the endpoints
+                    edges_orig_labels = data_fe.node_ids[edges[keep]].cpu(
                     ).numpy().astype(np.int64)
-                    out_1d = out_1d[data_fe.roi_mask.byte()].cpu().numpy()
+                    out_1d = out_1d[keep].cpu().numpy()
 
-                    if len(edges) == 0:
+                    if len(edges_orig_labels) == 0:
                         _log.warning(
                             f'test pass: no edges in block after masking')
                         continue
 
-                    edges_orig_labels = np.zeros_like(edges, dtype=np.int64)
-                    edges_orig_labels = replace_values(
-                        in_array=edges,
-                        out_array=edges_orig_labels,
-                        old_values=np.arange(
-                            data_fe.num_nodes, dtype=np.int64),
-                        new_values=data_fe.node_ids.cpu().numpy().astype(np.int64),
-                        inplace=False
-                    )
-
-                    edges_list = [tuple(i)
-                                  for i in edges_orig_labels]
-
-                    for k, v in zip(edges_list, out_1d):
-                        # TODO this is super hacky, only applies for RAG
-                        # remove artificial self-loops:
-                        if k[0] == k[1]:
-                            continue
-
-                        if k not in test_1d_outputs:
-                            test_1d_outputs[k] = v
-                        else:
-                            # TODO adapt strategy here if desired
-                            if config.graph_type == 'HemibrainGraphMasked':
-                                test_1d_outputs[k] = max(test_1d_outputs[k], v)
-                                _log.warning(
-                                    'Masking should lead to a single prediction per edge in blockwise dataset, unless a block is doubled because another one is empty')
-                                _log.warning(
-                                    f'Edge {k} with value {test_1d_outputs[k]} already exists, new value would be {v}')
-                            else:
-                                test_1d_outputs[k] = max(test_1d_outputs[k], v)
-
+                    test_blocks.append((block_id, edges_orig_labels, out_1d))
                     _log.debug(
-                        f'writing outputs to dict in {time.time() - start}s')
+                        f'collect outputs of block in {time.time() - start}s')
 
-                test_loss += model.loss(out_fe, data_fe.y,
-                                        data_fe.mask).item() * data_fe.mask.sum().item()
-                test_metric += model.out_to_metric(out_fe,
-                                                   data_fe.y, data_fe.mask) * data_fe.mask.sum().item()
-                edge_weights_test += data_fe.mask.sum().item()
-                pred = model.out_to_predictions(out_fe)
-                test_predictions.extend(model.predictions_to_list(pred))
-                test_targets.extend(data_fe.y.tolist())
+                if out_fe is not None:
+                    loss_fe = model.loss(out_fe, data_fe.y, data_fe.mask)
+                    pred = model.out_to_predictions(out_fe)
+                else:
+                    # the loss is not defined for gated outputs
+                    loss_fe = torch.zeros((), device=device)
+                    pred = model.one_dim_to_predictions(out_1d_fe)
+                metrics_test.add(
+                    loss_fe,
+                    model.model_type.weighted_correct(pred, data_fe.y, data_fe.mask),
+                    data_fe.mask)
+                confusion_matrix_test.add(pred, data_fe.y)
+                if score_histograms_test is not None:
+                    if out_1d_fe is None:
+                        out_1d_fe = model.out_to_one_dim(out_fe)
+                    score_histograms_test.add(
+                        model.model_type.one_dim_to_probability(out_1d_fe), data_fe.y)
+
+            # blocks of all ranks on rank 0, in the order of the blocks
+            gathered = distributed.gather_object(test_blocks)
+            if main_process:
+                test_blocks = sorted(
+                    [b for blocks in gathered for b in blocks], key=lambda b: b[0])
 
             if config.our_conv_output_node_embeddings:
-                # save embeddings to file
-                emb_path = osp.join(config.run_abs_path, 'embeddings.npz')
-                _log.info(f'save embeddings to {emb_path}')
-                np.savez(
-                    emb_path,
-                    node_ids=np.array(
-                        list(test_embeddings.keys()), dtype=np.int64),
-                    embeddings=np.array(
-                        list(test_embeddings.values()), dtype=np.float32)
-                )
+                if main_process:
+                    # the first block that contains a node provides its embedding
+                    emb_node_ids, embeddings, num_duplicates = utils.merge_block_embeddings(
+                        node_ids=[b[1] for b in test_blocks],
+                        embeddings=[b[2] for b in test_blocks])
+                    if num_duplicates > 0:
+                        _log.warning(
+                            f'{num_duplicates} embeddings of nodes that already exist are dropped')
+
+                    # save embeddings to file
+                    emb_path = osp.join(config.run_abs_path, 'embeddings.npz')
+                    _log.info(f'save embeddings to {emb_path}')
+                    np.savez(
+                        emb_path,
+                        node_ids=emb_node_ids,
+                        embeddings=embeddings
+                    )
                 return
 
-            test_loss /= edge_weights_test
-            test_metric /= edge_weights_test
+            test_loss, test_metric, _ = metrics_test.compute()
+            if config.confidence_gating:
+                confidence_gate.log_summary()
+
+            test_confusion_matrix = confusion_matrix_test.compute()
+            if score_histograms_test is not None:
+                test_curves = score_histograms_test.compute()
+            else:
+                test_curves = None
 
-            _run.log_scalar('loss_test', test_loss, config.training_epochs)
+            # the loss is not defined for the gated one-dimensional outputs
+            if not config.confidence_gating:
+                _run.log_scalar('loss_test', test_loss, config.training_epochs)
             _run.log_scalar('accuracy_test', test_metric,
                             config.training_epochs)
             _log.info(f'test pass in {time.time() - start_test_pass:.3f}s\n')
 
-            _log.info(
-                f'Mean test loss ({test_dataset.__len__()} samples): {test_loss:.3f}')
+            if not config.confidence_gating:
+                _log.info(
+                    f'Mean test loss ({test_dataset.__len__()} samples): {test_loss:.3f}')
             _log.info(
                 f'Mean accuracy on test set: {test_metric:.3f}\n')
 
-            if config.write_to_db:
+            if test_curves is not None:
+                _run.log_scalar('pr_auc_test', test_curves['pr_auc'], config.training_epochs)
+                _run.log_scalar('roc_auc_test', test_curves['roc_auc'], config.training_epochs)
+                _run.log_scalar('best_threshold_test', test_curves['best_threshold'],
+                                config.training_epochs)
+                _log.info(
+                    f'test set: PR AUC {test_curves["pr_auc"]:.3f}, ROC AUC {test_curves["roc_auc"]:.3f}, '
+                    f'best accuracy {test_curves["best_accuracy"]:.3f} at threshold '
+                    f'{test_curves["best_threshold"]:.3f}\n')
+                if main_process:
+                    curves_path = os.path.join(config.run_abs_path, 'threshold_curves_test.npz')
+                    np.savez(
+                        curves_path,
+                        confusion_matrix=test_confusion_matrix,
+                        **{k: v for k, v in test_curves.items() if isinstance(v, np.ndarray)})
+                    _run.add_artifact(filename=curves_path, name='threshold_curves_test.npz')
+
+            if config.write_to_db and main_process:
+                # the maximum over all blocks that predict an edge
+                merged_edges, merged_outputs, num_duplicates = utils.merge_block_predictions(
+                    edges=[b[1] for b in test_blocks],
+                    scores=[b[2] for b in test_blocks])
+                if num_duplicates > 0 and config.graph_type == 'HemibrainGraphMasked':
+                    _log.warning(
+                        f'{num_duplicates} edges predicted in several blocks. Masking should lead to a single '
+                        f'prediction per edge in blockwise dataset, unless a block is doubled because another one is empty')
+                test_1d_outputs = dict(zip(
+                    map(tuple, merged_edges.tolist()), merged_outputs.tolist()))
+
                 comment = _run.meta_info['options']['--comment']
                 timestamp = str(_run.start_time).replace(' ', 'T')
                 test_dataset.write_outputs_to_db(
@@ -464,11 +555,10 @@ def main(_config, _run, _log):
                     collection_name=f'{timestamp}_{comment}',
                 )
 
-            if config.plot_targets_vs_predictions:
+            if config.plot_targets_vs_predictions and main_process:
                 # TODO fix to run on cluster
                 # plot targets vs predictions. default is a confusion matrix
-                model.plot_targets_vs_predictions(
-                    targets=test_targets, predictions=test_predictions)
+                model.plot_confusion_matrix(confusion_matrix=test_confusion_matrix)
                 _run.add_artifact(
                     filename=os.path.join(
                         config.run_abs_path,
@@ -486,7 +576,7 @@ def main(_config, _run, _log):
                 #         targets=test_targets, outputs=test_outputs)
 
             # plot the graphs in the test dataset for visual inspection
-            if config.plot_graphs_testset:
+            if config.plot_graphs_testset and main_process:
                 if config.plot_graphs_testset < 0 or config.plot_graphs_testset > test_dataset.__len__():
                     plot_limit = test_dataset.__len__()
                 else:
@@ -532,16 +622,193 @@ def main(_config, _run, _log):
     # no training if we simply want to produce node embeddings
     if config.our_conv_output_node_embeddings:
         atexit.unregister(atexit_tasks)
-        return atexit_tasks(model=model)
+        result = atexit_tasks(model=model)
+        distributed.destroy()
+        return result
+
+    if config.historical_embeddings:
+        if distributed.is_distributed():
+            raise NotImplementedError('historical embeddings are not supported in distributed training')
+        if config.model != 'OurConvModel' or config.prune_to_targets:
+            raise NotImplementedError(
+                'historical embeddings are only supported for OurConvModel without prune_to_targets')
+        assert config.batch_size_train == 1 and config.batch_size_eval == 1
+        assert isinstance(train_dataset, registry.dataset('HemibrainDatasetHistorical'))
+        assert isinstance(validation_dataset, registry.dataset('HemibrainDatasetHistorical'))
+        from gnn_agglomeration.nn.history import History
+        history_train = History(
+            path=os.path.join(config.run_abs_path, 'history_train'),
+            num_nodes=train_dataset.num_snapshot_nodes(),
+            dims=model.layer_output_dims())
+        history_val = History(
+            path=os.path.join(config.run_abs_path, 'history_val'),
+            num_nodes=validation_dataset.num_snapshot_nodes(),
+            dims=model.layer_output_dims())
+
+    if config.prune_to_targets:
+        if config.model != 'OurConvModel':
+            raise NotImplementedError(
+                f'prune_to_targets is not supported for {config.model}')
+        if config.batch_norm or config.att_batch_norm:
+            # in training mode, batch norm would normalize over the pruned nodes and edges only
+            raise NotImplementedError(
+                'prune_to_targets is not supported with batch_norm or att_batch_norm')
+        from gnn_agglomeration.data_transforms import PruneToTargets
+        prune_to_targets = PruneToTargets(
+            num_layers=config.hidden_layers + 1 - config.frozen_layers,
+            undirected_edges=config.undirected_edges,
+            reversed_dims=utils.reversed_edge_attr_dims(config) if config.undirected_edges else 0,
+            csr=config.csr_aggregation
+        )
+
+    if config.frozen_layers > 0:
+        if config.model != 'OurConvModel' or config.historical_embeddings:
+            raise NotImplementedError(
+                'frozen layers are only supported for OurConvModel without historical embeddings')
+        assert config.frozen_layers <= config.hidden_layers
+        _log.info(f'caching the outputs of {config.frozen_layers} frozen layers ...')
+        from gnn_agglomeration.nn.feature_cache import FeatureCache, FeatureCacheDataset
+        caches = {}
+        for name, dataset in [('train', train_dataset), ('val', validation_dataset)]:
+            # rank 0 builds the cache, the other ranks load it
+            with distributed.main_process_first():
+                caches[name] = FeatureCacheDataset(FeatureCache(
+                    path=os.path.join(
+                        config.run_abs_path,
+                        f'feature_cache_{name}_{config.frozen_layers}_{config.feature_cache_augmentations}'),
+                    dataset=dataset,
+                    model=model,
+                    num_layers=config.frozen_layers,
+                    num_augmentations=config.feature_cache_augmentations,
+                    device=device
+                ))
+
+        data_loader_train = DataLoader(
+            caches['train'],
+            batch_size=config.batch_size_train,
+            shuffle=False,
+            sampler=torch.utils.data.RandomSampler(
+                data_source=caches['train'],
+                replacement=True,
+                num_samples=distributed.shard_size(config.epoch_samples_train)
+            ),
+            num_workers=config.num_workers,
+            pin_memory=config.dataloader_pin_memory,
+            **persistent_workers
+        )
+        data_loader_validation = DataLoader(
+            caches['val'],
+            batch_size=config.batch_size_eval,
+            shuffle=False,
+            sampler=torch.utils.data.RandomSampler(
+                data_source=caches['val'],
+                replacement=True,
+                num_samples=distributed.shard_size(config.epoch_samples_val)
+            ),
+            num_workers=config.num_workers,
+            **persistent_workers
+        )
+        model.input_layer = config.frozen_layers
+
+    # with async validation, only the validation process of rank 0 validates, on the whole subset
+    if config.val_cache and (main_process or not config.async_validation):
+        # the same unaugmented graphs in every validation pass
+        from gnn_agglomeration.pyg_datasets import CachedValidationSet
+        data_loader_validation = CachedValidationSet(
+            dataset=data_loader_validation.dataset,
+            num_samples=config.epoch_samples_val,
+            batch_size=config.batch_size_eval,
+            config=config,
+            max_edges=config.val_cache_max_edges,
+            seed=config.val_cache_seed,
+            device=device if config.val_cache_on_device else None,
+            shard=not config.async_validation
+        )
+
+    if config.shm_loader and config.num_workers > 0:
+        # multiprocessing.shared_memory needs python >= 3.8
+        from gnn_agglomeration.shm_loader import SharedMemoryLoader
+        shm_loaders = {}
+        for name, loader, batch_size in [
+                ('train', data_loader_train, config.batch_size_train),
+                ('val', data_loader_validation, config.batch_size_eval)]:
+            # cached or validated by the async validation process with its own loader
+            if name == 'val' and (config.val_cache or config.async_validation):
+                continue
+            shm_loaders[name] = SharedMemoryLoader(
+                dataset=loader.dataset,
+                sampler=loader.sampler,
+                batch_size=batch_size,
+                num_workers=config.num_workers,
+                num_slots=config.shm_slots or 2 * config.num_workers,
+                slot_bytes=config.shm_slot_mb * 2**20
+            )
+            atexit.register(shm_loaders[name].close)
+        data_loader_train = shm_loaders['train']
+        data_loader_validation = shm_loaders.get('val', data_loader_validation)
+
+    if config.drop_edge_rate > 0:
+        from gnn_agglomeration.data_transforms import DropEdgePairs
+        drop_edges = DropEdgePairs(
+            rate=config.drop_edge_rate,
+            anneal_epochs=config.drop_edge_anneal_epochs,
+            undirected_edges=config.undirected_edges
+        )
+    else:
+        drop_edges = None
+
+    def log_validation(epoch, validation_loss, epoch_metric_val):
+        if config.write_summary:
+            val_writer.add_scalar('_per_epoch/loss', validation_loss, epoch)
+            val_writer.add_scalar('_per_epoch/metric', epoch_metric_val, epoch)
+
+        _run.log_scalar('loss_val', validation_loss, epoch)
+        _run.log_scalar('accuracy_val', epoch_metric_val, epoch)
+        _run.result = f'train acc: {epoch_metrics_train[epoch]:.3f}, val acc: {epoch_metric_val:.3f}'
+
+    def log_async_validation(result):
+        if summarize_batches:
+            for iteration, batch_loss, batch_metric in result['batch_summaries']:
+                val_writer.add_scalar('00/weighted_loss', batch_loss, iteration)
+                val_writer.add_scalar('00/weighted_accuracy', batch_metric, iteration)
+        log_validation(result['epoch'], result['loss'], result['metric'])
+        _log.info(
+            f'validation of epoch {result["epoch"]}: acc {result["metric"]:.3f}, '
+            f'in {result["seconds"]:.3f} s')
+
+    epoch_metrics_train = {}
+    # validation on rank 0 only, in a separate process
+    if config.async_validation and main_process:
+        if config.historical_embeddings:
+            raise NotImplementedError('async validation does not support historical embeddings')
+        from gnn_agglomeration.async_validation import AsyncValidator
+        async_validator = AsyncValidator(
+            config=config,
+            dataset=data_loader_validation if config.val_cache else data_loader_validation.dataset,
+            prune_to_targets=prune_to_targets if config.prune_to_targets else None,
+            input_layer=model.input_layer,
+            device=device,
+            outputs_dir=os.path.join(outputs_dir, 'val'),
+            iterations_per_epoch=data_loader_train.__len__(),
+            max_pending=config.async_validation_max_pending,
+            policy=config.async_validation_policy
+        )
+        atexit.register(async_validator.terminate)
+    else:
+        async_validator = None
 
     for epoch in range(model.epoch, config.training_epochs):
         start_epoch_train = time.time()
+        if drop_edges is not None:
+            drop_edges.set_epoch(epoch)
+        epoch_directed_edges = 0
 
         # put model in training mode (e.g. use dropout)
         model.train()
-        epoch_loss = 0.0
-        epoch_metric_train = 0.0
-        edge_weights_train = 0
+        if config.historical_embeddings:
+            model.history = history_train
+        metrics_train = MetricAccumulator(device)
+        metrics_train_batch = MetricAccumulator(device)
         _log.info('epoch {} ...'.format(epoch))
         for batch_i, data in enumerate(data_loader_train):
             start_batch = now()
@@ -549,10 +816,16 @@ def main(_config, _run, _log):
             # mask is half as long as num edges, because it is not directed
             _log.info(
                 f'batch {batch_i}: num nodes {data.num_nodes},'
-                f'num edges in loss/total {int(2 * data.mask.sum().item())}/{data.num_edges}'
+                f'num edges in loss/total {int(2 * data.mask.sum().item())}/{utils.num_directed_edges(data, config)}'
             )
 
             data = data.to(device)
+            # only in training, validation and test run on the full graphs
+            if drop_edges is not None:
+                data = drop_edges(data)
+            epoch_directed_edges += utils.num_directed_edges(data, config)
+            if config.prune_to_targets:
+                data = prune_to_targets(data)
 
             # call the forward method
             _log.debug('forward pass')
@@ -562,6 +835,7 @@ def main(_config, _run, _log):
 
             _log.debug('backward pass')
             loss.backward()
+            distributed.all_reduce_gradients(model.trainable_parameters)
 
             # Gradient clipping
             if config.clip_grad:
@@ -586,42 +860,44 @@ def main(_config, _run, _log):
 
             model.print_current_loss(epoch, batch_i, _log)
 
-            epoch_loss += loss.item() * data.mask.sum().item()
-            epoch_metric_train += model.out_to_metric(
-                out, data.y, data.mask) * data.mask.sum().item()
-            edge_weights_train += data.mask.sum().item()
+            weighted_correct = model.out_to_weighted_correct(out, data.y, data.mask)
+            metrics_train.add(loss, weighted_correct, data.mask)
+            if summarize_batches:
+                metrics_train_batch.add(loss, weighted_correct, data.mask)
 
-            if batch_i % config.outputs_interval == 0:
+            if main_process and batch_i % config.outputs_interval == 0:
                 if isinstance(out, tuple):
                     # first dim: u,v second dim: num_edges, third dim = number of output node features
                     # store pairs of node embeddings
                     out = torch.stack([out[0], out[1]], dim=0)
 
-                np.savez(
+                artifact_writer.savez(
                     os.path.join(outputs_dir, 'train',
                                  f'epoch_{epoch}_batch_{batch_i}'),
-                    out=out.detach().cpu().numpy(),
-                    labels=data.y.detach().cpu().numpy(),
-                    mask=data.mask.detach().cpu().numpy()
+                    out=out,
+                    labels=data.y,
+                    mask=data.mask
                 )
 
-            if config.summary_per_batch:
+            # reduced every scalar_summary_interval batches, averaged over these batches
+            if summarize_batches and batch_i % config.scalar_summary_interval == 0:
+                batch_loss, batch_metric, _ = metrics_train_batch.compute()
+                metrics_train_batch.reset()
                 train_writer.add_scalar(
                     '00/weighted_loss',
-                    loss.item(),
+                    batch_loss,
                     epoch * data_loader_train.__len__() + batch_i
                 )
                 train_writer.add_scalar(
                     '00/weighted_accuracy',
-                    model.out_to_metric(out, data.y, data.mask),
+                    batch_metric,
                     epoch * data_loader_train.__len__() + batch_i
                 )
 
             model.train_batch_iteration += 1
             _log.debug(f'batch {batch_i} in {now() - start_batch} s')
 
-        epoch_loss /= edge_weights_train
-        epoch_metric_train /= edge_weights_train
+        epoch_loss, epoch_metric_train, _ = metrics_train.compute()
 
         if config.write_summary:
             train_writer.add_scalar('_per_epoch/loss', epoch_loss, epoch)
@@ -630,106 +906,146 @@ def main(_config, _run, _log):
         _run.log_scalar('loss_train', epoch_loss, epoch)
         _run.log_scalar('accuracy_train', epoch_metric_train, epoch)
 
-        _log.info(f'training in {time.time() - start_epoch_train:.3f} s')
-        start_epoch_val = time.time()
-
-        # validation
-        model.eval()
-        validation_loss = 0.0
-        epoch_metric_val = 0.0
-        edge_weights_val = 0
-        for batch_i, data in enumerate(data_loader_validation):
-            data = data.to(device)
-            out = model(data)
-            loss = model.loss(out, data.y, data.mask)
-            utils.log_max_memory_allocated(device)
-            # model.print_current_loss(
-            # epoch, 'validation {}'.format(batch_i), _log)
-            validation_loss += loss.item() * data.mask.sum().item()
-            epoch_metric_val += model.out_to_metric(
-                out, data.y, data.mask) * data.mask.sum().item()
-            edge_weights_val += data.mask.sum().item()
-
-            if batch_i % config.outputs_interval == 0:
-                if isinstance(out, tuple):
-                    # first dim: u,v second dim: num_edges, third dim = number of output node features
-                    # store pairs of node embeddings
-                    out = torch.stack([out[0], out[1]], dim=0)
-
-                np.savez(
-                    os.path.join(outputs_dir, 'val',
-                                 f'epoch_{epoch}_batch_{batch_i}'),
-                    out=out.detach().cpu().numpy(),
-                    labels=data.y.detach().cpu().numpy(),
-                    mask=data.mask.detach().cpu().numpy()
-                )
-
-            if config.summary_per_batch:
-                val_writer.add_scalar(
-                    '00/weighted_loss',
-                    loss.item(),
-                    epoch * data_loader_train.__len__() + batch_i
-                )
-                val_writer.add_scalar(
-                    '00/weighted_accuracy',
-                    model.out_to_metric(out, data.y, data.mask),
-                    epoch * data_loader_train.__len__() + batch_i
-                )
-                # for cosine embedding loss
-                if isinstance(out, tuple):
-                    utils.output_similarities_split(
-                        writer=val_writer,
-                        iteration=epoch * data_loader_train.__len__() + batch_i,
-                        out0=out[0],
-                        out1=out[1],
-                        labels=data.y
+        time_epoch_train = time.time() - start_epoch_train
+        _log.info(f'training in {time_epoch_train:.3f} s')
+        _run.log_scalar('edges_per_second_train', epoch_directed_edges / time_epoch_train, epoch)
+        if drop_edges is not None:
+            _log.info(
+                f'drop edges: rate {drop_edges.current_rate:.3f}, '
+                f'dropped {int(drop_edges.num_dropped)}/{drop_edges.num_pairs} edge pairs, '
+                f'{epoch_directed_edges / time_epoch_train:.0f} directed edges/s')
+            _run.log_scalar('drop_edge_rate', drop_edges.current_rate, epoch)
+            _run.log_scalar('dropped_edge_fraction', drop_edges.dropped_fraction(), epoch)
+        epoch_metrics_train[epoch] = epoch_metric_train
+        if not config.async_validation:
+            start_epoch_val = time.time()
+
+            # validation
+            model.eval()
+            if config.historical_embeddings:
+                model.history = history_val
+            metrics_val = MetricAccumulator(device)
+            metrics_val_batch = MetricAccumulator(device)
+            for batch_i, data in enumerate(data_loader_validation):
+                data = data.to(device)
+                if config.prune_to_targets:
+                    data = prune_to_targets(data)
+                out = model(data)
+                loss = model.loss(out, data.y, data.mask)
+                utils.log_max_memory_allocated(device)
+                # model.print_current_loss(
+                # epoch, 'validation {}'.format(batch_i), _log)
+                weighted_correct = model.out_to_weighted_correct(out, data.y, data.mask)
+                metrics_val.add(loss, weighted_correct, data.mask)
+                if summarize_batches:
+                    metrics_val_batch.add(loss, weighted_correct, data.mask)
+
+                if main_process and batch_i % config.outputs_interval == 0:
+                    if isinstance(out, tuple):
+                        # first dim: u,v second dim: num_edges, third dim = number of output node features
+                        # store pairs of node embeddings
+                        out = torch.stack([out[0], out[1]], dim=0)
+
+                    artifact_writer.savez(
+                        os.path.join(outputs_dir, 'val',
+                                     f'epoch_{epoch}_batch_{batch_i}'),
+                        out=out,
+                        labels=data.y,
+                        mask=data.mask
                     )
 
-            model.val_batch_iteration += 1
-
-        # The numbering of train and val does not correspond 1-to-1!
-        # Here we skip some numbers for maintaining loose correspondence
-        model.val_batch_iteration = model.train_batch_iteration
-
-        validation_loss /= edge_weights_val
-        epoch_metric_val /= edge_weights_val
-
-        if config.write_summary:
-            val_writer.add_scalar('_per_epoch/loss', validation_loss, epoch)
-            val_writer.add_scalar('_per_epoch/metric', epoch_metric_val, epoch)
+                if summarize_batches and batch_i % config.scalar_summary_interval == 0:
+                    batch_loss, batch_metric, _ = metrics_val_batch.compute()
+                    metrics_val_batch.reset()
+                    val_writer.add_scalar(
+                        '00/weighted_loss',
+                        batch_loss,
+                        epoch * data_loader_train.__len__() + batch_i
+                    )
+                    val_writer.add_scalar(
+                        '00/weighted_accuracy',
+                        batch_metric,
+                        epoch * data_loader_train.__len__() + batch_i
+                    )
+                    # for cosine embedding loss
+                    if isinstance(out, tuple):
+                        utils.output_similarities_split(
+                            writer=val_writer,
+                            iteration=epoch * data_loader_train.__len__() + batch_i,
+                            out0=out[0],
+                            out1=out[1],
+                            labels=data.y
+                        )
+
+                model.val_batch_iteration += 1
+
+            # The numbering of train and val does not correspond 1-to-1!
+            # Here we skip some numbers for maintaining loose correspondence
+            model.val_batch_iteration = model.train_batch_iteration
+
+            validation_loss, epoch_metric_val, _ = metrics_val.compute()
+            log_validation(epoch, validation_loss, epoch_metric_val)
+            if drop_edges is not None:
+                # training accuracy is measured on the subsampled graphs, validation on the full graphs
+                _log.info(
+                    f'drop edges: train acc {epoch_metric_train:.3f} at rate {drop_edges.current_rate:.3f}, '
+                    f'val acc {epoch_metric_val:.3f} without dropping')
 
-        _run.log_scalar('loss_val', validation_loss, epoch)
-        _run.log_scalar('accuracy_val', epoch_metric_val, epoch)
-        _run.result = f'train acc: {epoch_metric_train:.3f}, val acc: {epoch_metric_val:.3f}'
+            _log.info(f'validation in {time.time() - start_epoch_val:.3f} s')
 
         model.epoch += 1
 
-        _log.info(f'validation in {time.time() - start_epoch_val:.3f} s')
+        # batch norm statistics of rank 0, the parameters are the same on all ranks
+        distributed.broadcast_module(model)
+
+        if async_validator is not None:
+            # training continues while the snapshot is validated
+            async_validator.submit(epoch, model)
+            for result in async_validator.poll():
+                log_async_validation(result)
 
         # save intermediate models
-        if model.epoch % config.checkpoint_interval == 0:
+        if main_process and model.epoch % config.checkpoint_interval == 0:
             _log.info('saving model ...')
             model.save('epoch_{}'.format(model.epoch))
 
+    if async_validator is not None:
+        _log.info('waiting for the validation of the last snapshots ...')
+        for result in async_validator.close():
+            log_async_validation(result)
+        if len(async_validator.dropped_epochs) > 0:
+            _log.info(f'validation skipped for epochs {async_validator.dropped_epochs}')
+
     # save the final model
     final_model_name = 'final'
-    model.save(final_model_name)
-    _run.add_artifact(
-        filename=os.path.join(
-            config.run_abs_path,
-            config.model_dir,
-            final_model_name + '.tar'),
-        name=final_model_name)
+    if main_process:
+        model.save(final_model_name)
+        artifact_writer.wait()
+        _run.add_artifact(
+            filename=os.path.join(
+                config.run_abs_path,
+                config.model_dir,
+                final_model_name + '.tar'),
+            name=final_model_name)
 
     ###########################
 
-    # After training loop is over, the exit function is called directly
+    # After training loop is over, the exit function is called directly.
+    # In distributed runs, all ranks take part in the final passes
     atexit.unregister(atexit_tasks)
-    return atexit_tasks(model=model)
+    result = atexit_tasks(model=model)
+    distributed.destroy()
+    return result
 
 
 if __name__ == '__main__':
     config_dict, remaining_args = Config().parse_args()
+    # after parsing, such that --help does not import torch
+    from gnn_agglomeration import distributed
+    if config_dict['distributed']:
+        distributed.init(backend=config_dict['dist_backend'])
+        # the run directory is named after the start time of rank 0
+        config_dict['run_abs_path'] = distributed.broadcast_object(config_dict['run_abs_path'])
     ex.add_config(config_dict)
 
     # sacred_default_flags = ['--enforce_clean', '-l', 'INFO']
@@ -737,14 +1053,16 @@ if __name__ == '__main__':
     # remove all argparse arguments from sys.argv
     argv = [sys.argv[0], *sacred_default_flags, *remaining_args]
 
-    ex.observers.append(
-        MongoObserver.create(
-            url=config_dict['mongo_url'],
-            db_name=config_dict['mongo_db']
+    # sacred observers only on rank 0
+    if distributed.is_main_process():
+        ex.observers.append(
+            MongoObserver.create(
+                url=config_dict['mongo_url'],
+                db_name=config_dict['mongo_db']
+            )
         )
-    )
 
-    if config_dict['telegram']:
+    if config_dict['telegram'] and distributed.is_main_process():
         telegram_obs = TelegramObserver.from_config(
             os.path.join(config_dict['root_dir'], 'telegram.json'))
         ex.observers.append(telegram_obs)
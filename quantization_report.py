@@ -0,0 +1,154 @@
+import torch  # noqa
+import logging  # noqa
+import argparse  # noqa
+import os  # noqa
+import json  # noqa
+from time import time as now  # noqa
+
+from gnn_agglomeration import registry  # noqa
+from gnn_agglomeration.nn.models.checkpoint import load_model_from_run  # noqa
+from gnn_agglomeration.nn.models.frozen_our_conv_model import freeze_our_conv_model, script_frozen_model  # noqa
+from gnn_agglomeration.nn.models.quantization import quantize_frozen_model, calibrate_quantization  # noqa
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        description='Compare dynamic int8 CPU inference of a trained OurConvModel '
+                    'against float32 on the validation ROI of the run',
+        allow_abbrev=False)
+    p.add_argument('--run_path', type=str, required=True,
+                   help='absolute path to the run directory that contains config.json')
+    p.add_argument('--version', type=str, default='latest',
+                   help="checkpoint to use, 'latest', 'final' or e.g. 'epoch_10'")
+    p.add_argument('--calibration_blocks', type=int, default=4,
+                   help='number of validation blocks used to select the layers to quantize, not used for the comparison')
+    p.add_argument('--tolerance', type=float, default=0.01,
+                   help='maximal mean absolute score deviation for a group of quantized layers')
+    p.add_argument('--max_blocks', type=int, default=None,
+                   help='limit the number of validation blocks, including the calibration blocks')
+    p.add_argument('--num_threads', type=int, default=None,
+                   help='number of CPU threads used by torch')
+    p.add_argument('--save_model', action='store_true',
+                   help='save the calibrated int8 model next to the checkpoints')
+    return p.parse_args()
+
+
+def evaluate(frozen_model, model, graphs):
+    """
+    Returns:
+        dict: weighted accuracy, time and scores of a frozen model on the graphs
+    """
+    correct = 0.0
+    weights = 0.0
+    time = 0.0
+    all_scores = []
+    with torch.no_grad():
+        for g in graphs:
+            start = now()
+            scores = frozen_model(g.x, g.edge_index, g.edge_attr)
+            time += now() - start
+            all_scores.append(scores)
+            pred = model.one_dim_to_predictions(scores)
+            mask_sum = g.mask.sum().item()
+            correct += model.metric(pred, g.y, g.mask) * mask_sum
+            weights += mask_sum
+
+    return {
+        'accuracy': correct / max(weights, torch.finfo(torch.float).tiny),
+        'time': time,
+        'scores': all_scores
+    }
+
+
+def quantization_report(run_path, version, calibration_blocks, tolerance, max_blocks, save_model):
+    config, model = load_model_from_run(run_abs_path=run_path, version=version)
+
+    logger.info('Preparing validation dataset ...')
+    dataset = registry.dataset(config.dataset_type_val)(
+        root=config.dataset_abs_path_val,
+        config=config,
+        db_name=config.db_name_val,
+        embeddings_collection=config.embeddings_collection_val,
+        roi_offset=config.val_roi_offset,
+        roi_shape=config.val_roi_shape,
+        save_processed=config.save_processed_val
+    )
+    num_blocks = len(dataset) if max_blocks is None else min(max_blocks, len(dataset))
+    assert num_blocks > calibration_blocks, \
+        f'{num_blocks} blocks leave none for evaluation after {calibration_blocks} calibration blocks'
+    graphs = [dataset.get_unaugmented(i) for i in range(num_blocks)]
+    # evaluate on held-out blocks only, the quantized groups are chosen on the calibration blocks
+    calibration_graphs = graphs[:calibration_blocks]
+    eval_graphs = graphs[calibration_blocks:]
+
+    frozen = freeze_our_conv_model(model)
+    groups, deviations = calibrate_quantization(
+        frozen, calibration_graphs, tolerance=tolerance)
+
+    float_model = script_frozen_model(frozen)
+    int8_model = script_frozen_model(quantize_frozen_model(frozen, groups=groups))
+
+    # warm up the TorchScript profiling executor on the calibration blocks
+    evaluate(float_model, model, calibration_graphs)
+    evaluate(int8_model, model, calibration_graphs)
+
+    eval_float = evaluate(float_model, model, eval_graphs)
+    eval_int8 = evaluate(int8_model, model, eval_graphs)
+
+    agree = 0
+    num_edges = 0
+    max_diff = 0.0
+    for s_float, s_int8 in zip(eval_float['scores'], eval_int8['scores']):
+        agree += model.one_dim_to_predictions(s_float).eq(
+            model.one_dim_to_predictions(s_int8)).sum().item()
+        num_edges += s_float.numel()
+        max_diff = max(max_diff, (s_float - s_int8).abs().max().item())
+
+    report = {
+        'version': version,
+        'num_blocks': num_blocks,
+        'calibration_blocks': calibration_blocks,
+        'evaluation_blocks': len(eval_graphs),
+        'tolerance': tolerance,
+        'calibration_deviations': deviations,
+        'quantized_groups': groups,
+        'accuracy_float32': eval_float['accuracy'],
+        'accuracy_int8': eval_int8['accuracy'],
+        'time_float32': eval_float['time'],
+        'time_int8': eval_int8['time'],
+        'speedup': eval_float['time'] / max(eval_int8['time'], 1e-12),
+        'prediction_agreement': agree / max(num_edges, 1),
+        'max_abs_score_diff': max_diff,
+    }
+    for k, v in report.items():
+        logger.info(f'{k}: {v}')
+
+    report_path = os.path.join(run_path, f'quantization_report_{version}.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f'saved report to {report_path}')
+
+    if save_model:
+        out_path = os.path.join(run_path, config.model_dir, f'frozen_int8_{version}.pt')
+        torch.jit.save(int8_model, out_path)
+        logger.info(f'saved int8 model to {out_path}')
+
+    return report
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    quantization_report(
+        run_path=args.run_path,
+        version=args.version,
+        calibration_blocks=args.calibration_blocks,
+        tolerance=args.tolerance,
+        max_blocks=args.max_blocks,
+        save_model=args.save_model
+    )
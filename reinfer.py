@@ -0,0 +1,91 @@
+import torch  # noqa
+import logging  # noqa
+import argparse  # noqa
+import json  # noqa
+from time import time as now  # noqa
+
+from gnn_agglomeration.pyg_datasets import HemibrainDatasetIncremental  # noqa
+from gnn_agglomeration.nn.models.checkpoint import load_model_from_run  # noqa
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        description='Update the predicted merge scores of the edges affected by edits of the RAG, '
+                    'instead of rerunning the whole blockwise test pass',
+        allow_abbrev=False)
+    p.add_argument('--run_path', type=str, required=True,
+                   help='absolute path to the run directory that contains config.json')
+    p.add_argument('--version', type=str, default='latest',
+                   help="checkpoint to use, 'latest', 'final' or e.g. 'epoch_10'")
+    p.add_argument('--changes', type=str, required=True,
+                   help='json file with the changed node ids under "nodes" and the changed edges (u, v) under "edges"')
+    p.add_argument('--collection', type=str, required=True,
+                   help='collection with the merge scores of a previous test pass in the test db')
+    return p.parse_args()
+
+
+def reinfer(run_path, version, changes_path, collection_name):
+    config, model = load_model_from_run(run_abs_path=run_path, version=version)
+    if config.graph_type != 'HemibrainGraphMasked':
+        raise NotImplementedError(
+            'incremental re-inference needs masked graphs to restrict the outputs to inner edges')
+
+    with open(changes_path, 'r') as f:
+        changes = json.load(f)
+
+    dataset = HemibrainDatasetIncremental(
+        root=config.dataset_abs_path_test,
+        config=config,
+        db_name=config.db_name_test,
+        embeddings_collection=config.embeddings_collection_test,
+        roi_offset=config.test_roi_offset,
+        roi_shape=config.test_roi_shape,
+        changed_node_ids=changes.get('nodes', []),
+        changed_edges=changes.get('edges', []),
+        predictions_collection=collection_name
+    )
+
+    start = now()
+    outputs = {}
+    with torch.no_grad():
+        for i in range(len(dataset)):
+            data = dataset.get_unaugmented(i)
+            out_1d = model.out_to_one_dim(model(data))
+            if config.undirected_edges:
+                edges = data.edge_index
+            else:
+                # a pair of directed edges is next to each other in the edge index
+                edges = data.edge_index[:, 0::2]
+
+            roi_mask = data.roi_mask.byte()
+            edges = data.node_ids[edges[:, roi_mask]].t().tolist()
+            for (u, v), score in zip(edges, out_1d[roi_mask].tolist()):
+                # artificial self-loops
+                if u == v:
+                    continue
+                if u in dataset.affected_node_ids or v in dataset.affected_node_ids:
+                    outputs[(min(u, v), max(u, v))] = score
+
+    logger.info(
+        f'predict {len(outputs)} affected edges on {len(dataset)} graphs in {now() - start} s')
+
+    dataset.update_outputs_in_db(
+        outputs_dict=outputs,
+        collection_name=collection_name,
+        removed_edges=dataset.removed_edges
+    )
+    return outputs
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    reinfer(
+        run_path=args.run_path,
+        version=args.version,
+        changes_path=args.changes,
+        collection_name=args.collection
+    )
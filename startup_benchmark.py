@@ -0,0 +1,85 @@
+import argparse  # noqa
+import json  # noqa
+import logging  # noqa
+import subprocess  # noqa
+import sys  # noqa
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# slow to import and only needed for plots, summaries or sacred runs
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'chartify', 'pandas', 'networkx', 'sacred', 'tensorboardX', 'funlib']
+
+# startup of the entry points, each measured in a fresh interpreter
+TARGETS = {
+    'registry': 'from gnn_agglomeration import registry',
+    'config': 'from gnn_agglomeration.config import Config',
+    'checkpoint': 'from gnn_agglomeration.nn.models.checkpoint import load_model_from_run',
+    'resolve_model': 'from gnn_agglomeration import registry; '
+                     'registry.model("{model}"); registry.model_type("{model_type}")',
+    'resolve_dataset': 'from gnn_agglomeration import registry; '
+                       'registry.dataset("{dataset}"); registry.graph("{graph}")',
+    # up to parsing the command line, torch is imported when the run starts
+    'main': 'import runpy; runpy.run_path("main.py", run_name="startup_benchmark")',
+}
+
+SNIPPET = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+
+def measure(statement, repeats):
+    """
+    Returns:
+        (list of float, list of str): seconds per repeat, heavy modules imported by the statement
+    """
+    seconds = []
+    heavy = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, '-c', SNIPPET.format(statement=statement, heavy=HEAVY_MODULES)],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        seconds.append(result['seconds'])
+        heavy = result['heavy']
+    return seconds, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time the imports of the entry points of gnn_agglomeration in fresh interpreters')
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=list(TARGETS),
+                        help='main has to be timed from the repository root')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='maximal median startup time in seconds, exit code 1 if exceeded')
+    parser.add_argument('--model', type=str, default='OurConvModel')
+    parser.add_argument('--model_type', type=str, default='ClassificationProblem')
+    parser.add_argument('--dataset', type=str, default='HemibrainDatasetBlockwise')
+    parser.add_argument('--graph', type=str, default='HemibrainGraphMasked')
+    args = parser.parse_args()
+
+    exceeded = []
+    for target in args.targets:
+        statement = TARGETS[target].format(
+            model=args.model, model_type=args.model_type, dataset=args.dataset, graph=args.graph)
+        seconds, heavy = measure(statement, args.repeats)
+        median = sorted(seconds)[len(seconds) // 2]
+        logger.info(
+            f'{target}: median {median:.3f} s, min {min(seconds):.3f} s over {args.repeats} runs, '
+            f'heavy modules: {heavy if len(heavy) > 0 else "none"}')
+        if median > args.budget:
+            exceeded.append(target)
+
+    if len(exceeded) > 0:
+        logger.warning(f'startup budget of {args.budget} s exceeded by {exceeded}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()